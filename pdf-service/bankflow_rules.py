@@ -3,16 +3,23 @@
 
 from __future__ import annotations
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Tuple, List, Optional
+import numpy as np
 import pandas as pd
+import re
 import unicodedata
 from datetime import datetime, timedelta
+from eu_parsing import to_date_ddmmyyyy, to_float_eu
+import metrics
+from remesa_matcher import a_centimos, buscar_subconjunto
 
 # =========================
 # Utilidades de texto y parseo
 # =========================
 
 
+@lru_cache(maxsize=8192)
 def _norm_text(s: str) -> str:
     s = str(s or "").strip().lower()
     s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
@@ -24,45 +31,25 @@ def _contains_any(s: str, keywords: list[str]) -> bool:
     return any(k in s for k in keywords)
 
 
-def _to_date_ddmmyyyy(txt: str) -> str:
-    if not txt or str(txt).strip() == "":
-        return ""
-    t = str(txt).strip()
-    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d"):
-        try:
-            return datetime.strptime(t, fmt).strftime("%d/%m/%Y")
-        except Exception:
-            continue
-    try:
-        d = pd.to_datetime(t, dayfirst=True, errors="coerce")
-        if pd.notna(d):
-            return d.strftime("%d/%m/%Y")
-    except Exception:
-        pass
-    return t
-
-
-def _to_float_eu(txt) -> Optional[float]:
-    if txt is None:
-        return None
-    s = str(txt).strip().replace("€", "").replace("EUR", "").replace(" ", "")
-    # 1.234,56 -> 1234.56
-    if "." in s and "," in s and s.rfind(",") > s.rfind("."):
-        s = s.replace(".", "").replace(",", ".")
-    else:
-        s = s.replace(",", ".")
-    try:
-        return float(s)
-    except Exception:
-        try:
-            return float(s.replace(".", "").replace(",", "."))
-        except Exception:
-            return None
-
-
 def _redondea2(x: float) -> float:
     return float(f"{x:.2f}")
 
+
+def _redondea2_vec(x: np.ndarray) -> np.ndarray:
+    """
+    _redondea2 sobre un array. np.round coincide con f"{x:.2f}" salvo en los
+    valores que, escalados a céntimos, caen (casi) justo en ,5: esos pocos se
+    recalculan con _redondea2 para cuadrar al céntimo.
+    """
+    x = np.asarray(x, dtype=float)
+    r = np.round(x, 2)
+    with np.errstate(invalid="ignore"):
+        c = x * 100.0
+        dudosos = np.abs(np.abs(c - np.trunc(c)) - 0.5) < 1e-6
+    if dudosos.any():
+        r[dudosos] = [_redondea2(v) for v in x[dudosos]]
+    return r
+
 # =========================
 # Configuración de reglas
 # =========================
@@ -84,7 +71,7 @@ IVA_CERO_FORZADO = [
 REMESA_HINTS = ["remesa", "transferencias", "norma 19", "csb19", "cuaderno 19"]
 
 
-@dataclass
+@dataclass(frozen=True)
 class Clasificacion:
     tipo: str
     iva_pct: float
@@ -92,11 +79,74 @@ class Clasificacion:
     es_traspaso: bool
     es_comision_banco: bool
     es_remesa: bool
+    sin_comision_fija: bool = False  # ENIV / Drawdown: nunca comisión fija
 
 
-def _clasificar(concepto: str) -> Clasificacion:
-    txt = _norm_text(concepto)
-    es_remesa = _contains_any(txt, REMESA_HINTS)
+# =========================
+# Clasificador compilado (una sola regex) + memo por concepto
+# =========================
+# TIPO_RULES, REMESA_HINTS, IVA_CERO_FORZADO, "dalux" y "eniv"/"drawdown" se
+# compilan en UNA alternancia (claves más largas primero). Cada clave lleva una
+# máscara de bits con los grupos a los que pertenece; como las claves que casan
+# en una misma posición son prefijos de la más larga, cada clave hereda también
+# la máscara de sus prefijos y una sola pasada da todos los grupos presentes.
+# El resultado se memoriza por concepto normalizado (los extractos repiten unos
+# pocos cientos de conceptos miles de veces).
+
+CLASIFICADOR_CACHE_SIZE = 4096
+
+_BIT_REMESA = 1 << len(TIPO_RULES)
+_BIT_IVA_CERO = _BIT_REMESA << 1
+_BIT_DALUX = _BIT_REMESA << 2
+_BIT_SIN_COMISION = _BIT_REMESA << 3
+
+
+def _compila_claves() -> tuple[re.Pattern, dict[str, int]]:
+    grupos: list[tuple[list[str], int]] = [(keys, 1 << i) for i, (keys, _, _, _) in enumerate(TIPO_RULES)]
+    grupos += [
+        (REMESA_HINTS, _BIT_REMESA),
+        (IVA_CERO_FORZADO, _BIT_IVA_CERO),
+        (["dalux"], _BIT_DALUX),
+        (["eniv", "drawdown"], _BIT_SIN_COMISION),
+    ]
+    propia: dict[str, int] = {}
+    for keys, bit in grupos:
+        for k in keys:
+            propia[k] = propia.get(k, 0) | bit
+    mascara = {
+        k: _or_prefijos(k, propia)
+        for k in propia
+    }
+    alternancia = "|".join(re.escape(k) for k in sorted(propia, key=len, reverse=True))
+    return re.compile(f"(?=({alternancia}))"), mascara
+
+
+def _or_prefijos(clave: str, propia: dict[str, int]) -> int:
+    m = 0
+    for k, bits in propia.items():
+        if clave.startswith(k):
+            m |= bits
+    return m
+
+
+_RX_CLAVES, _MASCARA_CLAVE = _compila_claves()
+
+
+def _bits_claves(txt: str) -> int:
+    """OR de las máscaras de todas las claves contenidas en `txt` (ya normalizado)."""
+    bits = 0
+    for m in _RX_CLAVES.finditer(txt):
+        bits |= _MASCARA_CLAVE[m.group(1)]
+    return bits
+
+
+@lru_cache(maxsize=CLASIFICADOR_CACHE_SIZE)
+def _clasificar_norm(txt: str) -> Clasificacion:
+    """Clasificación de un concepto YA normalizado con _norm_text (memoizada)."""
+    bits_txt = _bits_claves(txt)
+    # Las listas de claves se comprobaban sobre _norm_text(txt) (casi siempre == txt)
+    txt2 = _norm_text(txt)
+    bits = bits_txt if txt2 == txt else _bits_claves(txt2)
 
     tipo = "General"
     iva = 0.21
@@ -104,8 +154,8 @@ def _clasificar(concepto: str) -> Clasificacion:
     es_traspaso = False
     es_comision_banco = False
 
-    for keys, tipo_name, iva_pct, irpf_pct in TIPO_RULES:
-        if _contains_any(txt, keys):
+    for i, (_, tipo_name, iva_pct, irpf_pct) in enumerate(TIPO_RULES):
+        if bits & (1 << i):
             tipo = tipo_name
             iva = iva_pct
             irpf = irpf_pct
@@ -116,9 +166,9 @@ def _clasificar(concepto: str) -> Clasificacion:
             break
 
     # Excepción: DALUX siempre lleva IVA 21 %
-    if "dalux" in txt:
+    if bits_txt & _BIT_DALUX:
       iva = 0.21
-    elif _contains_any(txt, IVA_CERO_FORZADO):
+    elif bits & _BIT_IVA_CERO:
       iva = 0.0
 
 
@@ -128,9 +178,29 @@ def _clasificar(concepto: str) -> Clasificacion:
         irpf_pct=irpf,
         es_traspaso=es_traspaso,
         es_comision_banco=es_comision_banco,
-        es_remesa=es_remesa,
+        es_remesa=bool(bits & _BIT_REMESA),
+        sin_comision_fija=bool(bits_txt & _BIT_SIN_COMISION),
     )
 
+
+def _clasificar(concepto: str) -> Clasificacion:
+    return _clasificar_norm(_norm_text(concepto))
+
+
+def classifier_cache_stats() -> dict:
+    """Aciertos/fallos de las memos del clasificador (para /api/cache/stats)."""
+    def _info(fn) -> dict:
+        ci = fn.cache_info()
+        total = ci.hits + ci.misses
+        return {
+            "hits": ci.hits,
+            "misses": ci.misses,
+            "ratio_hits": round(ci.hits / total, 4) if total else 0.0,
+            "entradas": ci.currsize,
+            "max_entradas": ci.maxsize,
+        }
+    return {"clasificacion": _info(_clasificar_norm), "normalizacion": _info(_norm_text)}
+
 # =========================
 # Cálculo fiscal por línea
 # =========================
@@ -149,8 +219,7 @@ def _calcula_linea(concepto: str, importe: float, disable_fixed_commission: bool
     if not disable_fixed_commission and not clas.es_remesa and not clas.es_comision_banco:
         # Jamás aplicar comisión positiva.
         # También evitar comisión si el concepto contiene ENIV o Drawdown.
-        txt_concepto = _norm_text(concepto)
-        if "eniv" in txt_concepto or "drawdown" in txt_concepto:
+        if clas.sin_comision_fija:
             comision = 0.0
         elif importe < 0:
             comision = -1.0
@@ -194,6 +263,90 @@ def _calcula_linea(concepto: str, importe: float, disable_fixed_commission: bool
     return (tipo, com_r, iva_r, irpf_r, importe_neto)
 
 
+# =========================
+# Cálculo fiscal vectorizado (todo el extracto de una vez)
+# =========================
+# Mismo resultado que _calcula_linea fila a fila, pero:
+#  - cada concepto distinto se clasifica una sola vez (factorize + clasificador
+#    memoizado);
+#  - base / IVA / IRPF / ajuste de redondeo / neto son operaciones NumPy.
+
+
+def _importe_escalar(v) -> float:
+    try:
+        return float(v or 0.0)
+    except Exception:
+        return to_float_eu(v if v is not None else "0") or 0.0
+
+
+def _importes_vec(col: pd.Series) -> np.ndarray:
+    """Columna Importe -> float64 (mismas reglas que apply_accounting_rules fila a fila)."""
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_extension_array_dtype(col):
+        return col.to_numpy(dtype=float)
+    return np.array([_importe_escalar(v) for v in col.tolist()], dtype=float)
+
+
+def _calcula_vectorizado(
+    conceptos: list[str], importes: np.ndarray, disable_fixed_commission: bool = False
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Versión vectorizada de _calcula_linea.
+    Devuelve arrays: (tipo, comision_fija, iva, irpf, total_calculado)
+    """
+    importe = np.asarray(importes, dtype=float)
+    codes, uniques = pd.factorize(pd.Series(conceptos, dtype=object))
+
+    # --- Clasificación por concepto único (memoizada) ---
+    clas_u = [_clasificar(u) for u in uniques]
+    tipo = np.array([c.tipo for c in clas_u], dtype=object)[codes]
+    iva_pct = np.array([float(c.iva_pct or 0.0) for c in clas_u])[codes]
+    irpf_pct = np.array([float(c.irpf_pct or 0.0) for c in clas_u])[codes]
+    es_traspaso = np.array([c.es_traspaso for c in clas_u], dtype=bool)[codes]
+    es_comision_banco = np.array([c.es_comision_banco for c in clas_u], dtype=bool)[codes]
+    es_remesa = np.array([c.es_remesa for c in clas_u], dtype=bool)[codes]
+    sin_comision = np.array([c.sin_comision_fija for c in clas_u], dtype=bool)[codes]
+
+    # --- Comisión fija (-1 € en cargos salvo remesas / comisiones / ENIV / Drawdown) ---
+    comision = np.zeros(len(importe))
+    if not disable_fixed_commission:
+        aplica = ~es_remesa & ~es_comision_banco & ~sin_comision & (importe < 0)
+        comision[aplica] = -1.0
+
+    # --- Base / IVA / IRPF ---
+    imponible = importe - comision
+    denom = 1.0 + iva_pct - irpf_pct
+    sin_denom = np.abs(denom) < 1e-9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        base = np.where(sin_denom, imponible, imponible / np.where(sin_denom, 1.0, denom))
+    iva = np.where(sin_denom, 0.0, base * iva_pct)
+    irpf = np.where(sin_denom, 0.0, - base * irpf_pct)
+
+    base_r = _redondea2_vec(base)
+    iva_r = _redondea2_vec(iva)
+    irpf_r = _redondea2_vec(irpf)
+    com_r = _redondea2_vec(comision)
+
+    importe_r = _redondea2_vec(importe)
+    total_calc = base_r + iva_r + irpf_r + com_r
+    delta = _redondea2_vec(importe_r - total_calc)
+
+    # Ajuste de redondeo (≤ 2 céntimos) sobre el IVA
+    ajusta = (np.abs(delta) > 0) & (np.abs(delta) <= 0.02)
+    iva_r = np.where(ajusta, _redondea2_vec(iva_r + delta), iva_r)
+
+    # Importe Neto = |Importe| - |IVA| - |IRPF|
+    importe_neto = _redondea2_vec(np.abs(importe_r) - np.abs(iva_r) - np.abs(irpf_r))
+
+    # Traspasos: sin comisión/IVA/IRPF y el total es el importe tal cual
+    tipo = np.where(es_traspaso, "Traspaso", tipo).astype(object)
+    com_r = np.where(es_traspaso, 0.0, com_r)
+    iva_r = np.where(es_traspaso, 0.0, iva_r)
+    irpf_r = np.where(es_traspaso, 0.0, irpf_r)
+    importe_neto = np.where(es_traspaso, importe_r, importe_neto)
+
+    return tipo, com_r, iva_r, irpf_r, importe_neto
+
+
 # =========================
 # API pública — Reglas generales
 # =========================
@@ -219,23 +372,12 @@ def apply_accounting_rules(df: pd.DataFrame) -> pd.DataFrame:
 
     out = df.copy()
 
-    tipos, coms, ivas, irpfs, totales = [], [], [], [], []
-    for _, row in out.iterrows():
-        concepto = str(row.get("Concepto", "")) or ""
-        try:
-            importe = float(row.get("Importe", 0.0) or 0.0)
-        except Exception:
-            importe = _to_float_eu(row.get("Importe", "0")) or 0.0
-
+    # Todo el extracto de una vez (mismo resultado que _calcula_linea por fila)
+    conceptos = [str(c) or "" for c in out["Concepto"].tolist()]
+    importes = _importes_vec(out["Importe"])
+    tipos, coms, ivas, irpfs, totales = _calcula_vectorizado(conceptos, importes)
 
-        tipo, com, iva, irpf, total = _calcula_linea(concepto, importe)
-        tipos.append(tipo)
-        coms.append(com)
-        ivas.append(iva)
-        irpfs.append(irpf)
-        totales.append(total) # <-- Guardamos el Total
-
-    out["Tipo"] = tipos
+    out["Tipo"] = tipos.tolist()
     out["Comisión"] = coms
     out["IVA"] = ivas
     out["IRPF"] = irpfs
@@ -277,11 +419,11 @@ def _normalize_detalle(detalle_df: pd.DataFrame) -> pd.DataFrame:
 
     rows = []
     for _, r in df.iterrows():
-        fecha = _to_date_ddmmyyyy(r.get(col_fecha, "")) if col_fecha else ""
+        fecha = to_date_ddmmyyyy(r.get(col_fecha, "")) if col_fecha else ""
         concepto = str(r.get(col_conc, "") or "") if col_conc else ""
         proveedor = str(r.get(col_prov, "") or "") if col_prov else ""
         
-        imp = _to_float_eu(r.get(col_imp, "")) if col_imp else None
+        imp = to_float_eu(r.get(col_imp, "")) if col_imp else None
         
         if imp is None:
             try:
@@ -317,9 +459,79 @@ def _in_range_ddmm(date_str: str, pivot_str: str, days: int = 1) -> bool:
         return False
 
 
+class _IndiceFechasDetalle:
+    """
+    Detalle de remesas indexado por día: cada fecha se parsea UNA vez y las
+    filas se agrupan por ordinal de día. La ventana ±N días de una remesa es
+    la unión de 2N+1 cubos (mismo criterio que _in_range_ddmm), en el orden
+    original de las filas.
+    """
+
+    def __init__(self, fechas: List[str]):
+        self._cubos: dict[int, List[int]] = {}
+        self.dias: List[Optional[int]] = []
+        for pos, f in enumerate(fechas):
+            dia = _dia_ordinal(f)
+            self.dias.append(dia)
+            if dia is not None:
+                self._cubos.setdefault(dia, []).append(pos)
+
+    def ventana(self, pivot_str: str, days: int = 1) -> List[int]:
+        p = _dia_ordinal(pivot_str)
+        if p is None:
+            return []
+        posiciones: List[int] = []
+        for dia in range(p - days, p + days + 1):
+            posiciones.extend(self._cubos.get(dia, ()))
+        posiciones.sort()
+        return posiciones
+
+
+@lru_cache(maxsize=4096)
+def _dia_ordinal(date_str: str) -> Optional[int]:
+    try:
+        return datetime.strptime(date_str, "%d/%m/%Y").toordinal()
+    except Exception:
+        return None
+
+
+def _reparte_remesa(
+    importes: List[float],
+    posiciones: List[int],
+    target: float,
+    fecha: str,
+    indice_fechas: Optional[_IndiceFechasDetalle],
+) -> Optional[List[int]]:
+    """
+    Cuando la ventana entera no cuadra (p. ej. dos remesas en días seguidos),
+    busca el subconjunto de líneas cuya suma cuadra con la remesa, prefiriendo
+    las más cercanas en fecha. Devuelve posiciones (orden original) o None.
+    Se queda con el primer subconjunto que cuadra (±2 céntimos): con muchas
+    líneas del mismo importe puede ser una coincidencia, por eso expand_remesas
+    avisa de cada reparto.
+    """
+    if indice_fechas is not None:
+        pivot = _dia_ordinal(fecha)
+        posiciones = sorted(
+            posiciones,
+            key=lambda pos: (abs(indice_fechas.dias[pos] - pivot) if pivot is not None else 0, pos),
+        )
+    elegidos = buscar_subconjunto([a_centimos(importes[pos]) for pos in posiciones], a_centimos(target))
+    if elegidos is None:
+        return None
+    return sorted(posiciones[i] for i in elegidos)
+
+
 def expand_remesas(extract_df: pd.DataFrame, detalle_df: Optional[pd.DataFrame]) -> tuple[pd.DataFrame, List[str]]:
     """
     Detecta remesas en extracto y sustituye por N líneas del detalle.
+    Si la ventana ±1 día entera no cuadra, se reparte un subconjunto de sus
+    líneas (remesa_matcher); cada línea del detalle se usa una sola vez.
+
+    El reparto es voraz, remesa a remesa en el orden del extracto, no un reparto
+    conjunto: una remesa anterior puede quedarse líneas que necesitaba una
+    posterior, y entonces esa sale como "No cuadra" (no se reintenta con otro
+    reparto). Cada reparto automático deja un aviso para poder revisarlo.
     """
     if extract_df is None or extract_df.empty:
         return extract_df, []
@@ -329,6 +541,12 @@ def expand_remesas(extract_df: pd.DataFrame, detalle_df: Optional[pd.DataFrame])
 
     det_norm = _normalize_detalle(detalle_df) if (detalle_df is not None and not detalle_df.empty) else pd.DataFrame(columns=["Fecha", "Proveedor", "Concepto", "Importe"])
 
+    # Fechas del detalle parseadas una sola vez (no una vez por remesa)
+    has_detail_dates = not det_norm.empty and not det_norm["Fecha"].str.strip().eq("").all()
+    indice_fechas = _IndiceFechasDetalle(det_norm["Fecha"].tolist()) if has_detail_dates else None
+    importes_det = det_norm["Importe"].tolist()
+    consumidas: set[int] = set()
+
     for idx, r in extract_df.reset_index(drop=True).iterrows():
         fecha = str(r.get("Fecha", "") or "")
         concepto = str(r.get("Concepto", "") or "")
@@ -337,25 +555,37 @@ def expand_remesas(extract_df: pd.DataFrame, detalle_df: Optional[pd.DataFrame])
         clas_remesa = _clasificar(concepto)
         
         if clas_remesa.es_remesa and not det_norm.empty:
-            det_win = pd.DataFrame() 
-
-            has_detail_dates = "Fecha" in det_norm.columns and not det_norm["Fecha"].str.strip().eq("").all()
-
             if has_detail_dates:
-                det_win = det_norm[det_norm["Fecha"].apply(lambda d: _in_range_ddmm(d, fecha, 1))].copy()
+                posiciones = indice_fechas.ventana(fecha, 1)
             else:
-                det_win = det_norm.copy()
+                posiciones = list(range(len(det_norm)))
+            # Una línea de detalle solo puede ir a una remesa
+            posiciones = [pos for pos in posiciones if pos not in consumidas]
 
-            if det_win.empty:
+            if not posiciones:
                 avisos.append(f"Remesa sin detalle coincidente ({fecha}): '{concepto}'")
                 out_rows.append(r.to_dict())
                 continue
 
+            det_win = det_norm.iloc[posiciones]
             suma_det = float(det_win["Importe"].sum() if not det_win.empty else 0.0)
             target = _redondea2(importe)
             suma_det_signed = _redondea2(abs(suma_det) * (1 if target >= 0 else -1))
 
+            if abs(target - suma_det_signed) > 0.02:
+                # La ventana entera no cuadra: ¿cuadra un subconjunto?
+                elegidas = _reparte_remesa(importes_det, posiciones, target, fecha, indice_fechas)
+                if elegidas is not None:
+                    avisos.append(
+                        f"Remesa {fecha}: '{concepto}' ({target:.2f}) repartida automáticamente con "
+                        f"{len(elegidas)} de {len(posiciones)} líneas del detalle de la ventana ±1 día; revísala"
+                    )
+                    posiciones = elegidas
+                    det_win = det_norm.iloc[posiciones]
+                    suma_det_signed = target
+
             if abs(target - suma_det_signed) <= 0.02: 
+                consumidas.update(posiciones)
                 for _, drow in det_win.iterrows():
                     imp_det = float(drow["Importe"] or 0.0)
                     imp_det = abs(imp_det) * (1 if target >= 0 else -1)
@@ -398,9 +628,40 @@ def process_bankflow(extract_df: pd.DataFrame, detalle_df: Optional[pd.DataFrame
     Devuelve (df_final, avisos).
     """
     # 1. Aplicar reglas a todo (IVA, IRPF, Comisión Fija, Total)
-    base = apply_accounting_rules(extract_df)
+    with metrics.etapa("reglas"):
+        base = apply_accounting_rules(extract_df)
     
     # 2. Expandir remesas (recalcula todo sin comisión fija y con su Total)
-    final, avisos = expand_remesas(base, detalle_df)
+    with metrics.etapa("remesas"):
+        final, avisos = expand_remesas(base, detalle_df)
     
-    return final, avisos
\ No newline at end of file
+    return final, avisos
+
+# =========================
+# Presentación — filas de remesa desglosada
+# =========================
+
+
+def remesa_row_mask(df: pd.DataFrame) -> np.ndarray:
+    """
+    Máscara (una posición por fila) de las líneas que se sombrean en el Excel:
+    sin comisión (0 o vacía) y cuyo Tipo no es traspaso ni comisión bancaria.
+    Una Comisión no numérica (o NaN) nunca se sombrea.
+    """
+    if df is None or df.empty:
+        return np.zeros(0 if df is None else len(df), dtype=bool)
+
+    tipo = df["Tipo"].fillna("").astype(str).str.lower()
+    excluida = (
+        tipo.str.contains("traspaso", regex=False) | tipo.str.contains("comision", regex=False)
+    ).to_numpy(dtype=bool)
+
+    com = df["Comisión"]
+    if pd.api.types.is_numeric_dtype(com) and not pd.api.types.is_bool_dtype(com):
+        valores = com.to_numpy(dtype=float)
+    else:
+        # Como float(v or 0.0): None / "" / False cuentan como 0
+        vacias = com.map(lambda v: v is None or (isinstance(v, (str, bool)) and not v)).to_numpy(dtype=bool)
+        valores = pd.to_numeric(com.mask(vacias, 0.0), errors="coerce").to_numpy(dtype=float)
+
+    return (valores == 0.0) & ~excluida
@@ -0,0 +1,107 @@
+# bench_invoice_codes.py
+# Micro-benchmark del motor de códigos de /api/contraste-facturas
+# (invoice_codes.py): construcción del índice + pasadas sobre nombres de PDF.
+#
+# Uso (desde pdf-service/):
+#   python benchmarks/bench_invoice_codes.py --filas 30000 --pdfs 1000
+
+from __future__ import annotations
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from invoice_codes import InvoiceIndex, match_filenames, norm_invoice_code, tokenize_filename
+
+
+def _pendientes(filas: int, rnd: random.Random) -> pd.DataFrame:
+    codigos = []
+    for i in range(filas):
+        r = rnd.random()
+        if r < 0.4:
+            codigos.append(f"2025/{100000 + i}")
+        elif r < 0.7:
+            codigos.append(f"{rnd.choice(['MA', 'FV', 'A', 'INV'])}-{rnd.randint(10, 99999)}")
+        else:
+            codigos.append(str(rnd.randint(10**5, 10**10)))
+    return pd.DataFrame({
+        "proveedor": [f"Proveedor {i % 300}" for i in range(filas)],
+        "s/fra. numero": codigos,
+        "importe": [f"{rnd.uniform(10, 9999):.2f}".replace(".", ",") for _ in range(filas)],
+    })
+
+
+def _nombres(pdfs: int, df: pd.DataFrame, rnd: random.Random) -> list[str]:
+    codigos = df["s/fra. numero"].tolist()
+    nombres = []
+    for i in range(pdfs):
+        r = rnd.random()
+        if r < 0.5:
+            nombres.append(f"Factura_{rnd.choice(codigos).replace('/', '_')}_{rnd.choice(['2024', '2025'])}.pdf")
+        elif r < 0.7:
+            nombres.append(f"{rnd.randint(1000, 99999)}TRAVI {rnd.choice(['ENERO', 'FEB'])}.pdf")
+        elif r < 0.85:
+            nombres.append(f"scan_{i:04d}.pdf")
+        else:
+            nombres.append(f"FRA N {rnd.choice(codigos)} copia.pdf")
+    return nombres
+
+
+def _mide(fn, repeticiones: int) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark de invoice_codes.py")
+    ap.add_argument("--filas", type=int, default=30000, help="filas del Excel de pendientes")
+    ap.add_argument("--pdfs", type=int, default=1000, help="nº de nombres de PDF")
+    ap.add_argument("--repeticiones", type=int, default=5)
+    ap.add_argument("--semilla", type=int, default=0)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.semilla)
+    df = _pendientes(args.filas, rnd)
+    nombres = _nombres(args.pdfs, df, rnd)
+
+    def _frio():
+        norm_invoice_code.cache_clear()
+        tokenize_filename.cache_clear()
+
+    def _indice():
+        _frio()
+        return InvoiceIndex.from_dataframe(df, ["s/fra. numero"])
+
+    t_indice = _mide(_indice, args.repeticiones)
+    index = InvoiceIndex.from_dataframe(df, ["s/fra. numero"])
+
+    def _lote_frio():
+        tokenize_filename.cache_clear()
+        return match_filenames(nombres, index)
+
+    t_frio = _mide(_lote_frio, args.repeticiones)
+    t_caliente = _mide(lambda: match_filenames(nombres, index), args.repeticiones)
+
+    res = match_filenames(nombres, index)
+    por_origen: dict[str, int] = {}
+    for m in res:
+        for c in m.coincidencias[:1]:
+            por_origen[c.origen] = por_origen.get(c.origen, 0) + 1
+
+    print(f"Excel: {args.filas} filas -> {len(index)} claves | PDFs: {args.pdfs}")
+    print(f"  índice:                {t_indice * 1000:9.2f} ms")
+    print(f"  nombres (tokens frío): {t_frio * 1000:9.2f} ms  ({t_frio / max(1, args.pdfs) * 1e6:.1f} µs/PDF)")
+    print(f"  nombres (caliente):    {t_caliente * 1000:9.2f} ms")
+    print(f"  coincidencias: {sum(m.coincide for m in res)}/{len(res)}  por origen: {por_origen}")
+
+
+if __name__ == "__main__":
+    main()
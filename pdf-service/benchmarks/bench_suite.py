@@ -0,0 +1,348 @@
+# bench_suite.py
+# Línea base de rendimiento del servicio con datos sintéticos (sinteticos.py):
+# lectura de facturas PDF, extractor sobre texto, lectura de CSV/XLSX,
+# normalización + reglas de BankFlow, contraste de facturas y escritura del Excel,
+# cada uno a varios tamaños.
+#
+# Resultado en JSON (una entrada por escenario y tamaño, con la clave estable
+# "escenario/param=valor,...") para comparar entre commits:
+#
+# Uso (desde pdf-service/):
+#   python benchmarks/bench_suite.py --salida base.json
+#   python benchmarks/bench_suite.py --salida nuevo.json --comparar base.json
+#   python benchmarks/bench_suite.py --rapido --escenarios parse_pdf_to_df,excel
+#
+# Con --comparar, el proceso sale con código 1 si algún escenario empeora más
+# de --umbral (mejor tiempo frente a mejor tiempo).
+
+from __future__ import annotations
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_PDF_SERVICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _PDF_SERVICE)
+
+import numpy as np
+import pandas as pd
+
+import sinteticos
+from bankflow_rules import process_bankflow, remesa_row_mask
+from eu_parsing import to_float_eu
+from extractor import extract_fields_from_text
+from invoice_codes import AmountIndex, InvoiceIndex, match_content, match_filenames
+from pdf_parser import parse_pdf_to_df
+from xlsx_writer import SheetStyle, column_widths, eu_number_width, to_xlsx_bytes
+import main as servicio
+
+FORMATO_RESULTADOS = 1
+
+
+def _mide(fn: Callable[[], Any], repeticiones: int) -> Dict[str, float]:
+    """Tiempos de `repeticiones` ejecuciones: la primera (cachés frías) aparte, y mejor / mediana de todas."""
+    tiempos = []
+    for _ in range(max(1, repeticiones)):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+    return {"primera_s": tiempos[0], "mejor_s": min(tiempos), "mediana_s": statistics.median(tiempos)}
+
+
+def _resultado(escenario: str, params: Dict[str, Any], unidades: int, tiempos: Dict[str, float], **extra) -> Dict[str, Any]:
+    clave = escenario + "/" + ",".join(f"{k}={v}" for k, v in params.items())
+    return {
+        "clave": clave,
+        "escenario": escenario,
+        "parametros": params,
+        "unidades": unidades,
+        **tiempos,
+        "mejor_por_unidad_ms": tiempos["mejor_s"] * 1000 / max(1, unidades),
+        **extra,
+    }
+
+
+def _lista(texto: str) -> List[int]:
+    return [int(x) for x in texto.split(",") if x.strip()]
+
+
+# =========================
+# Escenarios
+# =========================
+# Cada uno recibe (args, rnd) y produce un resultado por tamaño.
+
+
+def esc_parse_pdf_to_df(args, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    """parse_pdf_to_df (pdfplumber + extractor, lectura perezosa) por nº de páginas."""
+    for paginas in args.paginas:
+        facturas = sinteticos.facturas(rnd, args.facturas, paginas)
+        pdfs = [(f.nombre, f.pdf) for f in facturas]
+        filas: List[pd.DataFrame] = []
+
+        def _lote():
+            filas[:] = [parse_pdf_to_df(b, n) for n, b in pdfs]
+
+        tiempos = _mide(_lote, args.repeticiones)
+        aciertos = sum(
+            1 for f, df in zip(facturas, filas)
+            if df.at[0, "Invoice"] == f.numero and abs((df.at[0, "Importe Bruto"] or 0.0) - f.total) < 0.02
+        )
+        yield _resultado("parse_pdf_to_df", {"paginas": paginas}, len(pdfs), tiempos,
+                         aciertos=aciertos, bytes_medios=sum(len(b) for _, b in pdfs) // max(1, len(pdfs)))
+
+
+def esc_extract_fields_from_text(args, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    """extract_fields_from_text sobre el texto de facturas de una página."""
+    for n in args.textos:
+        facturas = sinteticos.facturas(rnd, n)
+        textos = [(f.nombre, f.texto) for f in facturas]
+        campos: List[Dict[str, Any]] = []
+
+        def _lote():
+            campos[:] = [extract_fields_from_text(t, nombre) for nombre, t in textos]
+
+        tiempos = _mide(_lote, args.repeticiones)
+        aciertos = sum(
+            1 for f, c in zip(facturas, campos)
+            if abs((c.get("Importe bruto") or c.get("Total Bruto") or 0.0) - f.total) < 0.02
+        )
+        yield _resultado("extract_fields_from_text", {"facturas": n}, n, tiempos, aciertos=aciertos)
+
+
+def esc_read_tabular(args, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    """_read_tabular (CSV por bloques / XLSX en streaming con metadatos arriba)."""
+    for filas in args.filas:
+        movs, _ = sinteticos.movimientos(rnd, filas)
+        for formato in ("csv", "xlsx"):
+            nombre, datos = sinteticos.extracto(movs, formato)
+            tiempos = _mide(lambda: servicio._read_tabular(nombre, io.BytesIO(datos)), args.repeticiones)
+            yield _resultado("read_tabular", {"formato": formato, "filas": filas}, filas, tiempos, bytes=len(datos))
+
+
+def _extracto_leido(nombre: str, datos: bytes) -> pd.DataFrame:
+    return servicio._norm_colnames(servicio._read_tabular(nombre, io.BytesIO(datos)))
+
+
+def _columnas_extracto(df: pd.DataFrame) -> tuple:
+    """Mismas columnas que detecta /api/bankflowpro."""
+    f = servicio._find_col
+    return (
+        f(df, ["fecha operacion", "fecha de operacion", "fecha", "fecha valor"]),
+        f(df, ["concepto", "descripcion", "descripción", "detalle", "concepto ampliado",
+               "detalle del movimiento", "observaciones"]),
+        f(df, ["importe", "importe eur", "importe operacion", "amount", "importe operación"]),
+        f(df, ["cargo", "debe", "debito", "débito", "debit"]),
+        f(df, ["abono", "haber", "credito", "crédito", "credit"]),
+        f(df, ["signo", "d/c", "tipo movimiento", "tipo mov", "movimiento"]),
+    )
+
+
+def esc_normaliza_extracto(args, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    """Extracto leído -> DataFrame canónico de BankFlow, por variante de columnas de importe."""
+    for filas in args.filas:
+        movs, _ = sinteticos.movimientos(rnd, filas)
+        for variante in sinteticos.VARIANTES_EXTRACTO:
+            df = _extracto_leido(*sinteticos.extracto(movs, "csv", variante))
+            cols = _columnas_extracto(df)
+            tiempos = _mide(lambda: servicio._normaliza_extracto(df, *cols), args.repeticiones)
+            yield _resultado("normaliza_extracto", {"variante": variante, "filas": filas}, filas, tiempos)
+
+
+def _bankflow(rnd: random.Random, filas: int) -> tuple:
+    movs, detalle = sinteticos.movimientos(rnd, filas)
+    df = _extracto_leido(*sinteticos.extracto(movs, "csv"))
+    base = servicio._normaliza_extracto(df, *_columnas_extracto(df))
+    det = _extracto_leido(*sinteticos.detalle_remesas(detalle, "csv"))
+    return base, det
+
+
+def esc_process_bankflow(args, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    """process_bankflow (reglas fiscales + expansión de remesas con detalle)."""
+    for filas in args.filas:
+        base, det = _bankflow(rnd, filas)
+        salida: List[Any] = []
+
+        def _uno():
+            salida[:] = process_bankflow(base.copy(), det)
+
+        tiempos = _mide(_uno, args.repeticiones)
+        df, avisos = salida
+        yield _resultado("process_bankflow", {"filas": filas}, filas, tiempos,
+                         filas_salida=len(df), lineas_detalle=len(det), avisos=len(avisos))
+
+
+def esc_contraste(args, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    """
+    Contraste de facturas sin la lectura de PDFs: índice del Excel de pendientes,
+    pasadas sobre los nombres y, para los que no casan, por contenido (campos ya extraídos).
+    """
+    facturas = sinteticos.facturas(rnd, args.pdfs)
+    nombres = [f.nombre if i % 2 == 0 else f"scan_{i:04d}.pdf" for i, f in enumerate(facturas)]
+    campos = [{"Invoice": f.numero, "Proveedor": f.proveedor, "Importe Bruto": f.total, "Neto": f.base}
+              for f in facturas]
+    for filas in args.pendientes:
+        pend = _extracto_leido(*sinteticos.pendientes(rnd, filas, facturas))
+        coincidencias: List[int] = [0]
+
+        def _contraste():
+            inv_cols = servicio._pick_invoice_columns(pend)
+            amt_cols = servicio._pick_amount_columns(pend)
+            index = InvoiceIndex.from_dataframe(pend, inv_cols)
+            por_nombre = match_filenames(nombres, index)
+            col_prov = servicio._find_col(pend, ["proveedor", "acreedor", "razon social", "tercero", "nombre"])
+            importes = AmountIndex.from_dataframe(pend, amt_cols, to_float_eu, col_prov)
+            n = 0
+            for m, c in zip(por_nombre, campos):
+                n += bool(m.coincide or match_content(c, index, importes, 0.05) is not None)
+            coincidencias[0] = n
+
+        tiempos = _mide(_contraste, args.repeticiones)
+        yield _resultado("contraste", {"pendientes": filas, "pdfs": len(nombres)}, len(nombres), tiempos,
+                         coincidencias=coincidencias[0])
+
+
+def esc_excel(args, rnd: random.Random) -> Iterator[Dict[str, Any]]:
+    """to_xlsx_bytes de la salida de BankFlow (mismo estilo que /api/bankflowpro)."""
+    for filas in args.filas:
+        base, det = _bankflow(rnd, filas)
+        out_df, _ = process_bankflow(base, det)
+        izquierda = {"align": "left"}
+        fmt = [({**izquierda, "num_format": "#,##0.00"} if 3 <= i < 8 else None) for i in range(len(out_df.columns))]
+
+        def _libro():
+            estilo = SheetStyle(
+                header={**izquierda, "bold": True, "font_color": "#FFFFFF", "pattern": 1, "bg_color": "#1f3564"},
+                number_formats=fmt,
+                text_formats=fmt,
+                widths=column_widths(out_df, eu_number_width, extra=2, minimo=10, maximo=50),
+                row_fill=remesa_row_mask(out_df),
+                fill_color="#EAF2F8",
+            )
+            return to_xlsx_bytes([(out_df, "Movimientos_desglosados", estilo)])
+
+        tiempos = _mide(_libro, args.repeticiones)
+        yield _resultado("excel", {"filas": filas}, len(out_df), tiempos, bytes=len(_libro()))
+
+
+ESCENARIOS: Dict[str, Callable[..., Iterator[Dict[str, Any]]]] = {
+    "parse_pdf_to_df": esc_parse_pdf_to_df,
+    "extract_fields_from_text": esc_extract_fields_from_text,
+    "read_tabular": esc_read_tabular,
+    "normaliza_extracto": esc_normaliza_extracto,
+    "process_bankflow": esc_process_bankflow,
+    "contraste": esc_contraste,
+    "excel": esc_excel,
+}
+
+# =========================
+# Entorno y comparación
+# =========================
+
+
+def _git(*cmd: str) -> Optional[str]:
+    try:
+        out = subprocess.run(["git", *cmd], cwd=_PDF_SERVICE, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 else None
+
+
+def _entorno() -> Dict[str, Any]:
+    import pdfplumber
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "cambios_sin_commit": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "pdfplumber": pdfplumber.__version__,
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compara(actual: Dict[str, Any], base: Dict[str, Any], umbral: float) -> List[Dict[str, Any]]:
+    """Por clave común: ratio mejor_s actual / base y si supera 1 + umbral."""
+    previos = {r["clave"]: r for r in base.get("resultados", [])}
+    filas = []
+    for r in actual["resultados"]:
+        p = previos.get(r["clave"])
+        if p is None or not p.get("mejor_s"):
+            continue
+        ratio = r["mejor_s"] / p["mejor_s"]
+        filas.append({"clave": r["clave"], "base_s": p["mejor_s"], "actual_s": r["mejor_s"],
+                      "ratio": ratio, "regresion": ratio > 1 + umbral})
+    return filas
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmarks del servicio con datos sintéticos (salida JSON)")
+    ap.add_argument("--escenarios", default=",".join(ESCENARIOS), help="lista separada por comas")
+    ap.add_argument("--paginas", type=_lista, default=[1, 3, 12], help="páginas por factura (parse_pdf_to_df)")
+    ap.add_argument("--facturas", type=int, default=20, help="facturas por tamaño (parse_pdf_to_df)")
+    ap.add_argument("--textos", type=_lista, default=[100, 1000], help="textos de factura (extract_fields_from_text)")
+    ap.add_argument("--filas", type=_lista, default=[1000, 20000], help="filas de extracto")
+    ap.add_argument("--pendientes", type=_lista, default=[1000, 30000], help="filas del Excel de pendientes")
+    ap.add_argument("--pdfs", type=int, default=300, help="PDFs del contraste")
+    ap.add_argument("--rapido", action="store_true", help="solo el tamaño más pequeño de cada escenario")
+    ap.add_argument("--repeticiones", type=int, default=5)
+    ap.add_argument("--semilla", type=int, default=0)
+    ap.add_argument("--salida", default="-", help="archivo JSON de resultados ('-' = stdout)")
+    ap.add_argument("--comparar", help="JSON de una ejecución anterior")
+    ap.add_argument("--umbral", type=float, default=0.20, help="empeoramiento tolerado con --comparar (0.20 = 20%%)")
+    args = ap.parse_args()
+
+    if args.rapido:
+        for campo in ("paginas", "textos", "filas", "pendientes"):
+            setattr(args, campo, getattr(args, campo)[:1])
+    desconocidos = [e for e in args.escenarios.split(",") if e not in ESCENARIOS]
+    if desconocidos:
+        ap.error(f"escenarios desconocidos: {', '.join(desconocidos)} (hay: {', '.join(ESCENARIOS)})")
+
+    informe: Dict[str, Any] = {
+        "formato": FORMATO_RESULTADOS,
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "entorno": _entorno(),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar")},
+        "resultados": [],
+    }
+    for nombre in args.escenarios.split(","):
+        # Semilla propia por escenario: los datos no dependen de qué otros se ejecuten
+        rnd = random.Random(f"{args.semilla}:{nombre}")
+        for r in ESCENARIOS[nombre](args, rnd):
+            informe["resultados"].append(r)
+            print(f"{r['clave']:<55} mejor {r['mejor_s'] * 1000:10.2f} ms  "
+                  f"({r['mejor_por_unidad_ms']:.3f} ms/u)  primera {r['primera_s'] * 1000:10.2f} ms",
+                  file=sys.stderr)
+
+    codigo = 0
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        informe["comparacion"] = {"base": base.get("entorno", {}).get("commit"), "umbral": args.umbral,
+                                  "filas": compara(informe, base, args.umbral)}
+        for c in informe["comparacion"]["filas"]:
+            marca = "  << REGRESIÓN" if c["regresion"] else ""
+            print(f"{c['clave']:<55} {c['base_s'] * 1000:10.2f} -> {c['actual_s'] * 1000:10.2f} ms "
+                  f"(x{c['ratio']:.2f}){marca}", file=sys.stderr)
+        codigo = 1 if any(c["regresion"] for c in informe["comparacion"]["filas"]) else 0
+
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida == "-":
+        print(texto)
+    else:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
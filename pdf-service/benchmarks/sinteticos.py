@@ -0,0 +1,331 @@
+# sinteticos.py
+# Datos sintéticos reproducibles (misma semilla -> mismos bytes) para los
+# benchmarks: facturas en PDF, extractos bancarios, detalle de remesas y Excel
+# de pendientes para el contraste.
+#
+# Sin dependencias nuevas: el PDF se escribe a mano (Helvetica, texto
+# posicionado, una página por lista de elementos) y los Excel con openpyxl.
+# Las facturas usan las etiquetas que reconoce extractor.py (TOTAL FACTURA,
+# I.V.A., IRPF, Base imponible...) en tres disposiciones:
+#   lineas:   "Etiqueta: importe" en una sola línea
+#   derecha:  etiqueta a la izquierda, importe alineado a la derecha
+#   columnas: tabla de totales (cabecera arriba, valores debajo)
+
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import io
+import json
+import os
+import random
+
+import openpyxl
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DISPOSICIONES = ("lineas", "derecha", "columnas")
+
+# Variantes de etiqueta por campo (todas las reconoce extractor.py)
+ETIQUETAS = {
+    "base": ["Base imponible", "BASE IMPONIBLE", "Subtotal", "TOTAL BASE"],
+    "iva": ["I.V.A. {tipo}%", "IVA {tipo}%", "TOTAL I.V.A.", "Cuota IVA"],
+    "irpf": ["Retención IRPF {tipo}%", "IRPF {tipo}%", "Retención"],
+    "total": ["TOTAL FACTURA", "Total a pagar", "Importe total", "Total factura"],
+}
+
+# =========================
+# Escritor de PDF mínimo
+# =========================
+
+# Anchos Helvetica (1/1000 em) de lo que se alinea a la derecha (importes)
+_ANCHOS = {c: 556 for c in "0123456789"}
+_ANCHOS.update({",": 278, ".": 278, " ": 278, "%": 889, "€": 556, "(": 333, ")": 333, "-": 333})
+_CUERPO = 10
+_ALTO_PAGINA = 842
+
+
+def _ancho(texto: str) -> float:
+    return sum(_ANCHOS.get(c, 600) for c in texto) * _CUERPO / 1000
+
+
+def escribe_pdf(paginas: List[List[Tuple[float, float, str, str]]]) -> bytes:
+    """
+    Páginas = [[(x, y_desde_arriba, texto, "l" | "r"), ...], ...] -> bytes de un
+    PDF A4 con el texto en Helvetica (WinAnsi). "r" alinea el texto a la derecha de x.
+    """
+    objetos: List[bytes] = []
+
+    def _nuevo(b: bytes) -> int:
+        objetos.append(b)
+        return len(objetos)
+
+    fuente = _nuevo(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    id_paginas = len(objetos) + 1 + 2 * len(paginas)  # /Pages va detrás de cada (contenido, página)
+    hijos = []
+    for elementos in paginas:
+        ops = []
+        for x, y, texto, alinea in elementos:
+            if alinea == "r":
+                x -= _ancho(texto)
+            s = texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"BT /F1 {_CUERPO} Tf {x:.2f} {_ALTO_PAGINA - y:.2f} Td ({s}) Tj ET")
+        flujo = "\n".join(ops).encode("cp1252")
+        contenido = _nuevo(b"<< /Length %d >>\nstream\n" % len(flujo) + flujo + b"\nendstream")
+        hijos.append(_nuevo(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 %d] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (id_paginas, _ALTO_PAGINA, contenido, fuente)
+        ))
+    kids = " ".join(f"{h} 0 R" for h in hijos).encode()
+    _nuevo(b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(hijos))
+    catalogo = _nuevo(b"<< /Type /Catalog /Pages %d 0 R >>" % id_paginas)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, o in enumerate(objetos, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + o + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    for o in offsets:
+        out += b"%010d 00000 n \n" % o
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, catalogo, xref)
+    return bytes(out)
+
+
+# =========================
+# Facturas
+# =========================
+
+
+def eu(v: float) -> str:
+    """1234.5 -> '1.234,50'"""
+    return f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def _proveedores() -> List[str]:
+    try:
+        with open(os.path.join(_BASE_DIR, "proveedores.json"), encoding="utf-8") as f:
+            nombres = sorted(set(json.load(f).values()))
+    except (OSError, ValueError):
+        nombres = []
+    return nombres or ["PROVEEDOR GENERICO S.L."]
+
+
+@dataclass
+class Factura:
+    nombre: str
+    proveedor: str
+    numero: str
+    fecha: date
+    base: float
+    tipo_iva: int
+    iva: float
+    tipo_irpf: int
+    irpf: float
+    total: float
+    disposicion: str
+    paginas: List[List[Tuple[float, float, str, str]]]
+
+    @property
+    def pdf(self) -> bytes:
+        return escribe_pdf(self.paginas)
+
+    @property
+    def texto(self) -> str:
+        """Texto por renglones (como extract_text() de un PDF así)."""
+        renglones = []
+        for elementos in self.paginas:
+            por_y: Dict[float, List[Tuple[float, str]]] = {}
+            for x, y, texto, alinea in elementos:
+                por_y.setdefault(y, []).append((x - _ancho(texto) if alinea == "r" else x, texto))
+            renglones += [" ".join(t for _, t in sorted(por_y[y])) for y in sorted(por_y)]
+        return "\n".join(renglones)
+
+
+def _partidas(rnd: random.Random, base: float, n: int) -> List[Tuple[str, float]]:
+    """n partidas que suman `base` (la última cuadra el redondeo)."""
+    pesos = [rnd.uniform(0.5, 2.0) for _ in range(n)]
+    importes = [round(base * p / sum(pesos), 2) for p in pesos]
+    importes[-1] = round(base - sum(importes[:-1]), 2)
+    conceptos = ["Honorarios", "Certificación de obra", "Suministro de material", "Mantenimiento",
+                 "Servicios profesionales", "Alquiler de maquinaria", "Transporte", "Consultoría"]
+    return [(f"{rnd.choice(conceptos)} {i + 1}", imp) for i, imp in enumerate(importes)]
+
+
+def _totales(rnd: random.Random, f: Factura, y: float) -> List[Tuple[float, float, str, str]]:
+    etiqueta = {k: rnd.choice(v).format(tipo=f.tipo_iva if k == "iva" else f.tipo_irpf) for k, v in ETIQUETAS.items()}
+    filas = [("base", f.base), ("iva", f.iva)] + ([("irpf", -f.irpf)] if f.irpf else []) + [("total", f.total)]
+    if f.disposicion == "lineas":
+        return [(60, y + 15 * i, f"{etiqueta[k]}: {eu(v)} €", "l") for i, (k, v) in enumerate(filas)]
+    if f.disposicion == "derecha":
+        out = []
+        for i, (k, v) in enumerate(filas):
+            out += [(300, y + 15 * i, etiqueta[k], "l"), (540, y + 15 * i, f"{eu(v)} €", "r")]
+        return out
+    # columnas: cabecera y valores debajo, alineados a la derecha de cada columna
+    cabeceras = [("BASE IMPONIBLE", f.base, 130), ("% IVA", float(f.tipo_iva), 225),
+                 ("CUOTA IVA", f.iva, 335), ("TOTAL", f.total, 450)]
+    out = []
+    for cab, v, x in cabeceras:
+        out += [(x - 70, y, cab, "l"), (x, y + 15, str(f.tipo_iva) if cab == "% IVA" else eu(v), "r")]
+    return out
+
+
+def factura(rnd: random.Random, i: int, paginas: int = 1, disposicion: Optional[str] = None) -> Factura:
+    """Factura i-ésima: cabecera en la primera página, partidas repartidas y totales al final."""
+    disposicion = disposicion or rnd.choice(DISPOSICIONES)
+    base = round(rnd.uniform(100, 50000), 2)
+    tipo_iva = rnd.choice([21, 21, 21, 10, 4])
+    iva = round(base * tipo_iva / 100, 2)
+    # La tabla en columnas no lleva retención
+    tipo_irpf = 15 if disposicion != "columnas" and rnd.random() < 0.3 else 0
+    irpf = round(base * tipo_irpf / 100, 2)
+    fecha = date(2024, 1, 1) + timedelta(days=rnd.randrange(365))
+    numero = rnd.choice([f"2024/{10000 + i}", f"FV-{rnd.randint(100, 99999)}", f"A{rnd.randint(1000, 9999)}-{i}"])
+    f = Factura(
+        nombre=f"Factura_{numero.replace('/', '_')}.pdf", proveedor=rnd.choice(_proveedores()), numero=numero,
+        fecha=fecha, base=base, tipo_iva=tipo_iva, iva=iva, tipo_irpf=tipo_irpf, irpf=irpf,
+        total=round(base + iva - irpf, 2), disposicion=disposicion, paginas=[],
+    )
+
+    cabecera = [(50, 60, f.proveedor, "l"), (50, 75, f"CIF: B{rnd.randint(10**7, 10**8 - 1)}", "l"),
+                (50, 100, f"Factura nº: {numero}", "l"), (50, 115, f"Fecha: {fecha:%d/%m/%Y}", "l"),
+                (50, 140, "Concepto", "l"), (50, 155, "Servicios según presupuesto aceptado", "l")]
+    # Partidas por página: en la primera caben menos (cabecera) y en la última van los totales
+    por_pagina = [rnd.randint(2, 8)] if paginas <= 1 else [30] + [45] * (paginas - 2) + [5]
+    partidas = iter(_partidas(rnd, base, sum(por_pagina)))
+    hojas: List[List[Tuple[float, float, str, str]]] = []
+    for p, n in enumerate(por_pagina):
+        hoja = list(cabecera) if p == 0 else [(50, 40, f"Página {p + 1}", "l")]
+        y = 200 if p == 0 else 60
+        for _ in range(n):
+            concepto, imp = next(partidas)
+            hoja += [(50, y, concepto, "l"), (530, y, eu(imp), "r")]
+            y += 15
+        hojas.append(hoja)
+    hojas[-1] += _totales(rnd, f, y + 20)
+    f.paginas = hojas
+    return f
+
+
+def facturas(rnd: random.Random, n: int, paginas: int = 1) -> List[Factura]:
+    return [factura(rnd, i, paginas) for i in range(n)]
+
+
+# =========================
+# Extractos y detalle de remesas (BankFlow)
+# =========================
+
+VARIANTES_EXTRACTO = ("importe", "signo", "cargo_abono")
+
+_CONCEPTOS = ["RECIBO LUZ IBERDROLA", "TRANSFERENCIA A PROVEEDOR", "PAGO TARJETA", "INGRESO CLIENTE",
+              "COMISION MANTENIMIENTO", "TRASPASO A CTA PROPIA", "RECIBO TELEFONICA", "NOMINA",
+              "HONORARIOS PROFESIONALES", "ALQUILER OFICINA", "SEGURO RESPONSABILIDAD CIVIL"]
+_BENEFICIARIOS = ["GARCIA LOPEZ SL", "SUMINISTROS NORTE SA", "TRANSPORTES RUIZ", "OFICINAS MARTIN",
+                  "LIMPIEZAS DEL SUR", "CONSULTORES ASOCIADOS", "ARQUITECTURA MOMENTUM"]
+
+
+@dataclass
+class Movimiento:
+    fecha: date
+    concepto: str
+    importe: float
+
+
+def movimientos(rnd: random.Random, filas: int, remesas: float = 0.03) -> Tuple[List[Movimiento], List[Tuple[date, str, str, float]]]:
+    """
+    Movimientos de un extracto (~`remesas` de ellos son remesas de transferencias)
+    y las líneas de detalle (fecha, beneficiario, concepto, importe) de cada remesa,
+    que suman su importe; algunas caen al día siguiente (ventana ±1 día).
+    """
+    inicio = date(2024, 1, 1)
+    movs: List[Movimiento] = []
+    detalle: List[Tuple[date, str, str, float]] = []
+    for i in range(filas):
+        fecha = inicio + timedelta(days=i * 365 // max(1, filas))
+        if rnd.random() < remesas:
+            lineas = [round(rnd.uniform(50, 3000), 2) for _ in range(rnd.randint(3, 8))]
+            movs.append(Movimiento(fecha, f"REMESA TRANSFERENCIAS {i}", -round(sum(lineas), 2)))
+            for imp in lineas:
+                dia = fecha + timedelta(days=rnd.choice([0, 0, 0, 1]))
+                detalle.append((dia, rnd.choice(_BENEFICIARIOS), f"FRA {rnd.randint(100, 9999)}", imp))
+        else:
+            imp = round(rnd.uniform(-5000, 5000), 2)
+            movs.append(Movimiento(fecha, f"{rnd.choice(_CONCEPTOS)} {rnd.randint(1000, 99999)}", imp))
+    return movs, detalle
+
+
+_METADATOS = [["BANCO SINTETICO S.A."], ["Titular: DEPARTAMENTO FINANCIERO S.L."],
+              ["Cuenta: ES00 0000 0000 0000 0000 0000"], ["Periodo: 01/01/2024 - 31/12/2024"], []]
+
+
+def _xlsx(filas: List[list], metadatos: List[list]) -> bytes:
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Movimientos")
+    for fila in metadatos + filas:
+        ws.append(fila)
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def _csv(filas: List[list]) -> bytes:
+    return "\n".join(";".join(str(c) for c in fila) for fila in filas).encode("utf-8")
+
+
+def extracto(movs: List[Movimiento], formato: str = "csv", variante: str = "importe") -> Tuple[str, bytes]:
+    """
+    Extracto como lo exporta un banco: (nombre, bytes).
+    xlsx: filas de metadatos (banco, titular, cuenta, periodo) antes de la cabecera
+    y celdas de fecha/número nativas. csv: ";" con importes europeos en texto.
+    variante: importe (un solo importe con signo) | signo (importe + D/H) | cargo_abono.
+    """
+    xlsx = formato == "xlsx"
+    cabecera = ["Fecha operación", "Fecha valor", "Concepto"]
+    cabecera += {"importe": ["Importe"], "signo": ["Importe", "D/H"], "cargo_abono": ["Cargo", "Abono"]}[variante]
+    filas = []
+    for m in movs:
+        fecha = datetime(m.fecha.year, m.fecha.month, m.fecha.day) if xlsx else m.fecha.strftime("%d/%m/%Y")
+        num = (lambda v: v) if xlsx else eu
+        if variante == "importe":
+            cols = [num(m.importe)]
+        elif variante == "signo":
+            cols = [num(abs(m.importe)), "D" if m.importe < 0 else "H"]
+        else:
+            cols = [num(-m.importe) if m.importe < 0 else "", num(m.importe) if m.importe >= 0 else ""]
+        filas.append([fecha, fecha, m.concepto] + cols)
+    if xlsx:
+        return "extracto.xlsx", _xlsx([cabecera] + filas, _METADATOS)
+    return "extracto.csv", _csv([cabecera] + filas)
+
+
+def detalle_remesas(detalle: List[Tuple[date, str, str, float]], formato: str = "csv") -> Tuple[str, bytes]:
+    """Detalle de remesas (Fecha, Beneficiario, Concepto, Importe): (nombre, bytes)."""
+    xlsx = formato == "xlsx"
+    cabecera = ["Fecha envío", "Beneficiario", "Concepto", "Importe"]
+    filas = [[datetime(d.year, d.month, d.day) if xlsx else d.strftime("%d/%m/%Y"), b, c, imp if xlsx else eu(imp)]
+             for d, b, c, imp in detalle]
+    if xlsx:
+        return "detalle.xlsx", _xlsx([cabecera] + filas, [["DETALLE DE REMESAS"], []])
+    return "detalle.csv", _csv([cabecera] + filas)
+
+
+# =========================
+# Pendientes (contraste de facturas)
+# =========================
+
+
+def pendientes(rnd: random.Random, filas: int, facturas_: List[Factura], presentes: float = 0.7) -> Tuple[str, bytes]:
+    """
+    Excel de facturas pendientes: `filas` filas de relleno más ~`presentes` de
+    las facturas dadas (con su nº, proveedor e importe), en orden aleatorio.
+    """
+    datos = [[f.proveedor, f.numero, f.fecha.strftime("%d/%m/%Y"), eu(f.total)]
+             for f in facturas_ if rnd.random() < presentes]
+    for i in range(filas):
+        datos.append([rnd.choice(_BENEFICIARIOS), rnd.choice([f"2023/{i}", f"R-{rnd.randint(10, 999999)}"]),
+                      f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/2023", eu(rnd.uniform(10, 20000))])
+    rnd.shuffle(datos)
+    return "pendientes.xlsx", _xlsx([["Proveedor", "S/Fra. Número", "Fecha", "Importe"]] + datos,
+                                    [["FACTURAS PENDIENTES DE RECIBIR"], []])
@@ -0,0 +1,310 @@
+# eu_parsing.py
+# Parseo de números y fechas "a la europea" compartido por main.py (extractos,
+# contraste), bankflow_rules.py (detalle de remesas) y extractor.py (facturas).
+#
+# Dos entradas por cada conversión:
+#   - escalar (to_float_eu, to_date_ddmmyyyy...): un valor; memoizada con LRU,
+#     porque en un extracto los mismos importes y fechas se repiten mucho;
+#   - por columna (to_float_eu_col, to_date_ddmmyyyy_col): Series / ndarray /
+#     lista entera, con operaciones vectorizadas y el mismo resultado que la
+#     escalar aplicada valor a valor.
+#
+# Inferencia de formato en las columnas: se mira una muestra de valores
+# distintos, se elige el formato dominante (p. ej. "dd/mm/aaaa" o "1.234,56") y
+# se convierte primero toda la columna con él en un solo paso; solo lo que no
+# encaja pasa por el camino general. Los formatos candidatos son excluyentes
+# entre sí, así que el orden no cambia el resultado, solo el coste.
+
+from __future__ import annotations
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Optional, Sequence, Union
+import re
+import numpy as np
+import pandas as pd
+
+Columna = Union[pd.Series, np.ndarray, Sequence[Any]]
+
+# =========================
+# Formatos
+# =========================
+
+# Orden de prueba de to_date_ddmmyyyy. El último es cómo llegan las fechas de
+# un Excel (tabular_reader); antes caían en pd.to_datetime(dayfirst=True), que
+# en pandas actual daba la vuelta a día y mes (2024-03-12 -> 03/12/2024).
+FORMATOS_FECHA = ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S")
+# Forma de cada formato, para contar en la muestra sin parsear
+_FORMA_FECHA = {
+    "%d/%m/%Y": re.compile(r"\d{1,2}/\d{1,2}/\d{4}"),
+    "%d-%m-%Y": re.compile(r"\d{1,2}-\d{1,2}-\d{4}"),
+    "%Y-%m-%d": re.compile(r"\d{4}-\d{1,2}-\d{1,2}"),
+    "%Y-%m-%d %H:%M:%S": re.compile(r"\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{1,2}:\d{1,2}"),
+}
+
+# Formatos de número que se convierten directamente (sin limpieza previa):
+#   plano: lo que float() lee igual que to_float_eu ("1234.56", "-12", "1.234")
+#   eu:    coma decimal, con o sin miles con punto ("1.234,56", "-12,5")
+_FORMA_NUMERO = {
+    "plano": re.compile(r"[+-]?\d+(?:\.\d+)?"),
+    "eu": re.compile(r"[+-]?(?:\d{1,3}(?:\.\d{3})+|\d+),\d+"),
+}
+# Lo que float() lee igual que siempre (el resto del camino general pasa por to_float_eu)
+_RE_NUM_PLANO = r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?"
+
+# Valores distintos que se miran para inferir el formato de una columna
+MUESTRA_FORMATO = 64
+
+# =========================
+# Escalares (memoizados)
+# =========================
+
+
+@lru_cache(maxsize=8192)
+def _float_eu(s: str) -> Optional[float]:
+    s = s.strip().replace("€", "").replace("EUR", "").replace(" ", "")
+    # 1.234,56 -> 1234.56
+    if "." in s and "," in s and s.rfind(",") > s.rfind("."):
+        s = s.replace(".", "").replace(",", ".")
+    else:
+        s = s.replace(",", ".")
+    try:
+        return float(s)
+    except Exception:
+        try:
+            return float(s.replace(".", "").replace(",", "."))
+        except Exception:
+            return None
+
+
+def to_float_eu(txt: Any) -> Optional[float]:
+    """Importe de una celda ('1.234,56 €', '12,5', '1234.56'...) -> float (None si no se lee)."""
+    if txt is None:
+        return None
+    return _float_eu(txt if isinstance(txt, str) else str(txt))
+
+
+@lru_cache(maxsize=8192)
+def to_float_importe(s: str) -> Optional[float]:
+    """
+    Importe impreso en una factura -> float. A diferencia de to_float_eu, una
+    coma que no es decimal se toma como separador de miles (2,500.00 -> 2500.0).
+    """
+    if not s:
+        return None
+    s = s.strip().replace(" ", "")
+    # 1.234.567,89 -> 1234567.89 ; 2,500.00 -> 2500.00 ; 525,00 -> 525.00
+    if "," in s and s.rfind(",") > s.rfind("."):
+        s = s.replace(".", "").replace(",", ".")
+    else:
+        s = s.replace(",", "")
+    try:
+        return float(s)
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=8192)
+def _fecha_ddmmyyyy(t: str) -> str:
+    for fmt in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(t, fmt).strftime("%d/%m/%Y")
+        except Exception:
+            continue
+    try:
+        d = pd.to_datetime(t, dayfirst=True, errors="coerce")
+        if pd.notna(d):
+            return d.strftime("%d/%m/%Y")
+    except Exception:
+        pass
+    return t
+
+
+def to_date_ddmmyyyy(txt: Any) -> str:
+    """Fecha de una celda -> 'dd/mm/aaaa' ('' si está vacía; el texto tal cual si no se lee)."""
+    if not txt or str(txt).strip() == "":
+        return ""
+    return _fecha_ddmmyyyy(str(txt).strip())
+
+
+def parsing_cache_stats() -> dict:
+    """Aciertos/fallos de las memos escalares (para /api/cache/stats)."""
+    def _info(fn) -> dict:
+        ci = fn.cache_info()
+        total = ci.hits + ci.misses
+        return {
+            "hits": ci.hits,
+            "misses": ci.misses,
+            "ratio_hits": round(ci.hits / total, 4) if total else 0.0,
+            "entradas": ci.currsize,
+            "max_entradas": ci.maxsize,
+        }
+    return {"numeros": _info(_float_eu), "importes_factura": _info(to_float_importe), "fechas": _info(_fecha_ddmmyyyy)}
+
+
+# =========================
+# Fechas dentro de un texto (facturas)
+# =========================
+
+_MONTHS_EN = {
+    "jan":1,"january":1,"feb":2,"february":2,"mar":3,"march":3,"apr":4,"april":4,
+    "may":5,"jun":6,"june":6,"jul":7,"july":7,"aug":8,"august":8,"sep":9,"sept":9,
+    "september":9,"oct":10,"october":10,"nov":11,"november":11,"dec":12,"december":12
+}
+_MONTHS_ES = {
+    "ene":1,"enero":1,"feb":2,"febrero":2,"mar":3,"marzo":3,"abr":4,"abril":4,
+    "may":5,"jun":6,"junio":6,"jul":7,"julio":7,"ago":8,"agosto":8,"sep":9,"sept":9,
+    "septiembre":9,"oct":10,"octubre":10,"nov":11,"noviembre":11,"dic":12,"diciembre":12
+}
+
+_RE_DMY = re.compile(r"\b(\d{1,2})[\/\-](\d{1,2})[\/\-](20\d{2})\b")
+_RE_YMD = re.compile(r"\b(20\d{2})[\/\-](\d{1,2})[\/\-](\d{1,2})\b")
+_RE_DMY_PUNTO = re.compile(r"\b(\d{1,2})[.\-](\d{1,2})[.\-](20\d{2})\b")
+_RE_D_MES_EN = re.compile(r"\b(\d{1,2})\s+([a-z]{3,9})\s+(20\d{2})\b")
+_RE_D_MES_ES = re.compile(r"\b(\d{1,2})\s+de\s+([a-záéíóú]{3,12})\s+(?:de|del\s+año)\s+(20\d{2})\b", re.I)
+
+
+def _fmt_dmy(d: int, m: int, y: int) -> str:
+    return f"{d:02d}/{m:02d}/{y:04d}"
+
+
+def busca_fecha(text: str) -> Optional[str]:
+    """Primera fecha reconocible de un texto libre -> 'dd/mm/aaaa' (None si no hay)."""
+    t = text.lower()
+    m = _RE_DMY.search(t)
+    if m:
+        return _fmt_dmy(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    m = _RE_YMD.search(t)
+    if m:
+        return _fmt_dmy(int(m.group(3)), int(m.group(2)), int(m.group(1)))
+    m = _RE_DMY_PUNTO.search(t)
+    if m:
+        return _fmt_dmy(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    m = _RE_D_MES_EN.search(t)
+    if m:
+        mon = _MONTHS_EN.get(m.group(2)[:3], None)
+        if mon:
+            return _fmt_dmy(int(m.group(1)), mon, int(m.group(3)))
+    m = _RE_D_MES_ES.search(t)
+    if m:
+        name = m.group(2)
+        mon = None
+        for k, v in _MONTHS_ES.items():
+            if name.startswith(k):
+                mon = v
+                break
+        if mon:
+            return _fmt_dmy(int(m.group(1)), mon, int(m.group(3)))
+    return None
+
+
+# =========================
+# Columnas (Series / ndarray / lista)
+# =========================
+
+
+def columna_texto(df: pd.DataFrame, col: str) -> pd.Series:
+    """df[col] como texto (si el nombre está repetido, la primera)."""
+    s = df[col]
+    if isinstance(s, pd.DataFrame):
+        s = s.iloc[:, 0]
+    return s.fillna("").astype(str)
+
+
+def _como_texto(col: Columna) -> pd.Series:
+    if not isinstance(col, pd.Series):
+        col = pd.Series(np.asarray(col, dtype=object), dtype=object)
+    return col.fillna("").astype(str)
+
+
+def _muestra(t: pd.Series) -> list:
+    """Hasta MUESTRA_FORMATO valores distintos no vacíos del principio de la columna."""
+    distintos = pd.unique(t.iloc[: MUESTRA_FORMATO * 8].to_numpy(dtype=object))
+    return [v for v in distintos if v != ""][:MUESTRA_FORMATO]
+
+
+def _dominante(muestra: list, formas: dict) -> Optional[str]:
+    """Forma con más aciertos en la muestra (a igualdad, la primera; None si ninguna)."""
+    cuentas = {nombre: sum(1 for v in muestra if forma.fullmatch(v)) for nombre, forma in formas.items()}
+    nombre = max(cuentas, key=cuentas.get) if cuentas else None
+    return nombre if nombre is not None and cuentas[nombre] else None
+
+
+def formato_fecha(col: Columna) -> Optional[str]:
+    """Formato de FORMATOS_FECHA dominante en una muestra de la columna (None si ninguno)."""
+    return _dominante(_muestra(_como_texto(col).str.strip()), _FORMA_FECHA)
+
+
+def formato_numero(col: Columna) -> Optional[str]:
+    """Formato de número dominante en una muestra de la columna ("plano", "eu" o None)."""
+    return _dominante(_muestra(_como_texto(col)), _FORMA_NUMERO)
+
+
+def to_date_ddmmyyyy_col(col: Columna) -> np.ndarray:
+    """
+    to_date_ddmmyyyy de toda una columna. Cada valor distinto se convierte una
+    sola vez: primero con el formato dominante (formato_fecha), después con los
+    demás de FORMATOS_FECHA, vectorizados; lo que quede, con la escalar.
+    """
+    codigos, unicos = pd.factorize(_como_texto(col), sort=False)
+    t = pd.Series(unicos, dtype=object).str.strip()
+    salida = pd.Series("", index=t.index, dtype=object)
+    pendiente = (t != "").to_numpy(dtype=bool, copy=True)
+    dominante = _dominante(_muestra(t), _FORMA_FECHA)
+    orden = ((dominante,) if dominante else ()) + tuple(f for f in FORMATOS_FECHA if f != dominante)
+    for fmt in orden:
+        if not pendiente.any():
+            break
+        fechas = pd.to_datetime(t[pendiente], format=fmt, errors="coerce")
+        ok = fechas.notna()
+        salida[ok.index[ok]] = fechas[ok].dt.strftime("%d/%m/%Y")
+        pendiente[ok.index[ok]] = False
+    if pendiente.any():
+        salida[pendiente] = [to_date_ddmmyyyy(v) for v in unicos[pendiente]]
+    return salida.to_numpy()[codigos] if len(codigos) else np.array([], dtype=object)
+
+
+def _float_eu_general(col: pd.Series) -> np.ndarray:
+    """
+    `to_float_eu(v) or 0.0` con limpieza de texto vectorizada y float() (vía
+    numpy) de los números planos; los raros (vacíos, "1.234.56", textos...)
+    con la escalar, una vez por valor distinto.
+    """
+    s = (col.str.strip().str.replace("€", "", regex=False)
+         .str.replace("EUR", "", regex=False).str.replace(" ", "", regex=False))
+    # 1.234,56 -> 1234.56 ; el resto, coma -> punto (como to_float_eu)
+    eu = (s.str.contains(".", regex=False) & s.str.contains(",", regex=False)
+          & (s.str.rfind(",") > s.str.rfind(".")))
+    s = s.str.replace(",", ".", regex=False).where(
+        ~eu, s.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    )
+    plano = s.str.fullmatch(_RE_NUM_PLANO).to_numpy(dtype=bool)
+    valores = np.zeros(len(s))
+    valores[plano] = s[plano].to_numpy(dtype=object).astype(np.float64)
+    if not plano.all():
+        codigos, unicos = pd.factorize(col[~plano], sort=False)
+        raros = np.array([to_float_eu(v) or 0.0 for v in unicos], dtype=np.float64)
+        valores[~plano] = raros[codigos]
+    return valores
+
+
+def to_float_eu_col(col: Columna) -> np.ndarray:
+    """
+    `to_float_eu(v) or 0.0` de toda una columna (float64). Los valores con el
+    formato dominante (formato_numero) se convierten de golpe; el resto, por el
+    camino general.
+    """
+    t = _como_texto(col)
+    dominante = _dominante(_muestra(t), _FORMA_NUMERO)
+    if dominante is None:
+        valores = _float_eu_general(t)
+    else:
+        encaja = t.str.fullmatch(_FORMA_NUMERO[dominante].pattern).to_numpy(dtype=bool)
+        directos = t[encaja]
+        if dominante == "eu":
+            directos = directos.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+        valores = np.zeros(len(t))
+        valores[encaja] = directos.to_numpy(dtype=object).astype(np.float64)
+        if not encaja.all():
+            valores[~encaja] = _float_eu_general(t[~encaja])
+    # `x or 0.0`: -0.0 también sale como 0.0
+    return np.where(valores == 0.0, 0.0, valores)
@@ -0,0 +1,225 @@
+# extraction_cache.py
+# Caché de extracciones de PDF direccionada por contenido.
+# Clave = SHA-256 de los bytes del PDF + motor (texto/layout/auto) + versión de
+# las reglas del extractor, así un PDF repetido no vuelve a pasar por pdfplumber
+# y, si cambian las reglas, las entradas viejas dejan de casar solas.
+#
+# Dos niveles:
+#   1) memoria: LRU (OrderedDict) de tamaño acotado
+#   2) disco:   SQLite con expulsión por TTL y por nº máximo de entradas
+#
+# Las operaciones de disco son síncronas: quien llame desde el event loop debe
+# hacerlo vía asyncio.to_thread (como pdf_pool.py). Un hit de disco solo
+# reescribe la fecha de uso si tiene más de PDF_CACHE_USADO_S segundos: para la
+# expulsión por antigüedad de uso basta con esa precisión y así las lecturas
+# repetidas no son una escritura + commit cada una.
+
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Archivos cuyo contenido define la "versión" de las reglas de extracción
+RULE_FILES = ["extractor.py", "layout_extractor.py", "eu_parsing.py", "pdf_parser.py", "supplier_matcher.py", "proveedores.json"]
+# Variables de entorno que también cambian el resultado de la extracción
+RULE_ENV = ["PDF_PEREZOSA_MIN_PAGINAS", "PDF_LAYOUT_PROVEEDORES"]
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# PDF_CACHE_DB:       ruta del SQLite ("" desactiva el nivel de disco)
+# PDF_CACHE_MEMORY:   nº máximo de entradas en memoria
+# PDF_CACHE_DISK:     nº máximo de entradas en disco
+# PDF_CACHE_TTL_DAYS: días que vive una entrada
+# PDF_CACHE_USADO_S:  segundos antes de volver a anotar en disco el uso de una entrada
+PDF_CACHE_DB = os.environ.get("PDF_CACHE_DB", os.path.join(_BASE_DIR, "cache", "extracciones.sqlite3"))
+PDF_CACHE_MEMORY = int(os.environ.get("PDF_CACHE_MEMORY", "512"))
+PDF_CACHE_DISK = int(os.environ.get("PDF_CACHE_DISK", "20000"))
+PDF_CACHE_TTL_DAYS = float(os.environ.get("PDF_CACHE_TTL_DAYS", "30"))
+PDF_CACHE_USADO_S = float(os.environ.get("PDF_CACHE_USADO_S", "600"))
+
+
+def rules_version() -> str:
+    """Hash corto del código/datos del extractor (cambia si cambian las reglas)."""
+    h = hashlib.sha256()
+    for name in RULE_FILES:
+        path = os.path.join(_BASE_DIR, name)
+        h.update(name.encode("utf-8"))
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except OSError:
+            h.update(b"<missing>")
+    for name in RULE_ENV:
+        h.update(f"{name}={os.environ.get(name, '')}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class ExtractionCache:
+    """
+    Caché LRU en memoria + SQLite en disco para filas extraídas de PDFs.
+    Las filas son dicts JSON-serializables (las de pdf_parser.parse_pdf_fields).
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_memory: Optional[int] = None,
+        max_disk: Optional[int] = None,
+        ttl_days: Optional[float] = None,
+        version: Optional[str] = None,
+    ):
+        self.db_path = PDF_CACHE_DB if db_path is None else db_path
+        self.max_memory = PDF_CACHE_MEMORY if max_memory is None else max_memory
+        self.max_disk = PDF_CACHE_DISK if max_disk is None else max_disk
+        self.ttl = (PDF_CACHE_TTL_DAYS if ttl_days is None else ttl_days) * 86400.0
+        self.version = version or rules_version()
+
+        self._mem: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_count = 0
+        self._puts_since_purge = 0
+        self._stats = {
+            "hits_memoria": 0,
+            "hits_disco": 0,
+            "misses": 0,
+            "escrituras": 0,
+            "expulsiones_memoria": 0,
+            "expulsiones_disco": 0,
+        }
+        if self.db_path:
+            self._open_db()
+
+    # ---------- SQLite ----------
+
+    def _open_db(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS extracciones ("
+                " clave TEXT PRIMARY KEY, fila TEXT NOT NULL,"
+                " creado REAL NOT NULL, usado REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS ix_extracciones_usado ON extracciones(usado)")
+            db.commit()
+            self._db = db
+            self._purge_disk()
+        except sqlite3.Error:
+            # Sin disco (permisos, ruta inválida...): seguimos solo con memoria
+            self._db = None
+
+    def _purge_disk(self) -> None:
+        """Borra expirados y, si sobra, las entradas usadas hace más tiempo."""
+        if self._db is None:
+            return
+        cur = self._db.execute("DELETE FROM extracciones WHERE creado < ?", (time.time() - self.ttl,))
+        self._stats["expulsiones_disco"] += max(cur.rowcount, 0)
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM extracciones").fetchone()[0]
+        sobra = self._disk_count - self.max_disk
+        if sobra > 0:
+            self._db.execute(
+                "DELETE FROM extracciones WHERE clave IN"
+                " (SELECT clave FROM extracciones ORDER BY usado LIMIT ?)",
+                (sobra,),
+            )
+            self._stats["expulsiones_disco"] += sobra
+            self._disk_count -= sobra
+        self._db.commit()
+        self._puts_since_purge = 0
+
+    # ---------- API ----------
+
+    def key_for(self, contenido: bytes, modo: str = "texto") -> str:
+        return f"{hashlib.sha256(contenido).hexdigest()}:{modo}:{self.version}"
+
+    def get(self, clave: str) -> Optional[Dict[str, Any]]:
+        ahora = time.time()
+        with self._lock:
+            hit = self._mem.get(clave)
+            if hit is not None:
+                creado, fila = hit
+                if ahora - creado <= self.ttl:
+                    self._mem.move_to_end(clave)
+                    self._stats["hits_memoria"] += 1
+                    return dict(fila)
+                del self._mem[clave]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT fila, creado, usado FROM extracciones WHERE clave = ?", (clave,)
+                ).fetchone()
+                if row is not None and ahora - row[1] <= self.ttl:
+                    if ahora - row[2] > PDF_CACHE_USADO_S:
+                        self._db.execute("UPDATE extracciones SET usado = ? WHERE clave = ?", (ahora, clave))
+                        self._db.commit()
+                    fila = json.loads(row[0])
+                    self._mem_put(clave, row[1], fila)
+                    self._stats["hits_disco"] += 1
+                    return dict(fila)
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, clave: str, fila: Dict[str, Any]) -> None:
+        ahora = time.time()
+        with self._lock:
+            self._mem_put(clave, ahora, dict(fila))
+            self._stats["escrituras"] += 1
+            if self._db is None:
+                return
+            valores = (json.dumps(fila, ensure_ascii=False), ahora, ahora, clave)
+            cur = self._db.execute(
+                "UPDATE extracciones SET fila = ?, creado = ?, usado = ? WHERE clave = ?", valores
+            )
+            if cur.rowcount == 0:  # clave nueva (si ya estaba, el nº de entradas no cambia)
+                self._db.execute(
+                    "INSERT INTO extracciones (fila, creado, usado, clave) VALUES (?, ?, ?, ?)", valores
+                )
+                self._disk_count += 1
+            self._db.commit()
+            self._puts_since_purge += 1
+            if self._disk_count > self.max_disk or self._puts_since_purge >= 200:
+                self._purge_disk()
+
+    def _mem_put(self, clave: str, creado: float, fila: Dict[str, Any]) -> None:
+        self._mem[clave] = (creado, fila)
+        self._mem.move_to_end(clave)
+        while len(self._mem) > self.max_memory:
+            self._mem.popitem(last=False)
+            self._stats["expulsiones_memoria"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM extracciones")
+                self._db.commit()
+                self._disk_count = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            consultas = self._stats["hits_memoria"] + self._stats["hits_disco"] + self._stats["misses"]
+            hits = self._stats["hits_memoria"] + self._stats["hits_disco"]
+            return {
+                **self._stats,
+                "ratio_hits": round(hits / consultas, 4) if consultas else 0.0,
+                "entradas_memoria": len(self._mem),
+                "entradas_disco": self._disk_count if self._db is not None else 0,
+                "version_reglas": self.version,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,20 +1,16 @@
 import re
-from typing import Optional, Dict, Any, List
-import json, os
+from bisect import bisect_right
+from typing import Optional, Dict, Any, List, Tuple
+import os
+from eu_parsing import busca_fecha, to_float_importe
+from supplier_matcher import SupplierMatcher
 
 # =========================
 # Proveedores conocidos (palabras clave -> nombre completo)
 # =========================
-KNOWN_SUPPLIERS: dict[str, str] = {}
-
-try:
-    # Carga desde un archivo externo "proveedores.json" si existe
-    path_json = os.path.join(os.path.dirname(__file__), "proveedores.json")
-    if os.path.exists(path_json):
-        with open(path_json, "r", encoding="utf-8") as f:
-            KNOWN_SUPPLIERS = json.load(f)
-except Exception:
-    KNOWN_SUPPLIERS = {}
+# Se cargan de "proveedores.json" en un autómata Aho-Corasick (supplier_matcher.py)
+# que se reconstruye solo si el archivo cambia en disco.
+SUPPLIER_MATCHER = SupplierMatcher(os.path.join(os.path.dirname(__file__), "proveedores.json"))
 
 
 # =========================
@@ -102,19 +98,8 @@ def _line_before(label: str, text: str) -> Optional[str]:
 CUR = r"(?:€|EUR|Euros?)"
 _M_AMT = r"([\(\-]?\s*\d{1,3}(?:[.\s]\d{3})*(?:[.,]\d{2})?\s*\)?)"
 
-def _to_float(s: str) -> Optional[float]:
-    if not s:
-        return None
-    s = s.strip().replace(" ", "")
-    # 1.234.567,89 -> 1234567.89 ; 2,500.00 -> 2500.00 ; 525,00 -> 525.00
-    if "," in s and s.rfind(",") > s.rfind("."):
-        s = s.replace(".", "").replace(",", ".")
-    else:
-        s = s.replace(",", "")
-    try:
-        return float(s)
-    except Exception:
-        return None
+# Importes impresos: eu_parsing.to_float_importe (memoizado; coma de miles o decimal)
+_to_float = to_float_importe
 
 def _clean_amount(m: str) -> Optional[float]:
     if not m:
@@ -129,46 +114,186 @@ def _clean_amount(m: str) -> Optional[float]:
         val = -abs(val)
     return val
 
+# =========================
+# Escáner de etiquetas: patrones precompilados + índice de apariciones
+# =========================
+# Antes cada _find_amount_* montaba su regex con f-string y recorría el texto
+# entero con re.I; con ~20 etiquetas eran decenas de pasadas por factura. Ahora:
+#   1) los patrones de cada etiqueta se compilan una sola vez (al importar);
+#   2) el texto se pasa a minúsculas y se trocea en líneas UNA vez por factura;
+#   3) las apariciones de cada etiqueta se localizan sobre esa copia en
+#      minúsculas con un patrón SIN re.I (≈10x más rápido) y se confirman
+#      con el patrón original en esa posición;
+#   4) cada búsqueda de importe solo prueba su patrón anclado en esas
+#      apariciones, con la misma semántica (y resultado) que el re.search de antes.
+
+LABELS_TOTAL = [
+    "Total", "Total factura", "Importe total", "Total bruto", "Total a pagar",
+    "Total amount", "TOTAL EUROS", "SUMAN", "TOTAL FACTURA", "TOTAL A PAGAR",
+    "Total Factura Euros"  # <- aparece así en tu PDF
+]
+
+LABELS_BASE = ["Base imponible", "Base", "Subtotal", "Neto", "Taxable base", "TOTAL BASE"]
+
+LABELS_IVA = [
+    "IVA",
+    r"I\.?\s*V\.?\s*A\.?",          # I.V.A / IVA con puntos/espacios
+    r"TOTAL\s+IVA",
+    r"TOTAL\s+I\.?\s*V\.?\s*A\.?",  # TOTAL I.V.A.
+    "VAT",
+    "Impuesto",
+    "TOTAL I.V.A.",                 # literal exacto por si acaso
+    "TIPO DE I.V.A."                # (por si algún proveedor pone solo el %)
+]
+
+LABELS_IRPF = ["IRPF", "Retención", "Withholding"]
+
+
+class _LabelPatterns:
+    """Patrones compilados de una etiqueta (equivalentes a los f-string de antes)."""
+
+    __slots__ = ("label", "label_re", "folded_re", "line_start_re", "after_re", "below_re")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.label_re = re.compile(label, re.I)
+        # Versión para el texto ya en minúsculas (sin re.I). Solo si pasar la
+        # etiqueta a minúsculas no cambia su significado (p. ej. \S, \W, \D).
+        self.folded_re = None if re.search(r"\\[A-Z]", label) else re.compile(label.lower())
+        # _find_amount_line_start sin el '^': se prueba con .match() en el inicio de línea
+        self.line_start_re = re.compile(rf"\s*{label}.*?{_M_AMT}(?!\s*%)\s*(?:{CUR})?", re.I)
+        # _find_amount_after: se prueba con .match() en cada aparición de la etiqueta
+        self.after_re = re.compile(rf"{label}[^\n\r]*?{_M_AMT}(?!\s*%)\s*(?:{CUR})?", re.I)
+        # _find_amount_below: línea completa que contiene la etiqueta
+        self.below_re = re.compile(rf"(?m)^\s*.*{label}.*$", re.I)
+
+
+_LABEL_PATTERNS: Dict[str, _LabelPatterns] = {}
+
+
+def _label_patterns(label: str) -> _LabelPatterns:
+    pats = _LABEL_PATTERNS.get(label)
+    if pats is None:
+        pats = _LABEL_PATTERNS[label] = _LabelPatterns(label)
+    return pats
+
+
+for _lab in LABELS_TOTAL + LABELS_BASE + LABELS_IVA + LABELS_IRPF:
+    _label_patterns(_lab)
+
+# Caracteres que re.I iguala a una letra ASCII pero cuyo lower() no es esa letra
+# (İ además cambia de longitud al pasar a minúsculas)
+_FOLD_FIXES = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s"})
+_NEWLINE_RE = re.compile("\n")
+_RE_M_AMT = re.compile(_M_AMT)
+
+
+class _LabelIndex:
+    """
+    Índice de un texto: inicios de línea + posiciones candidatas de etiquetas.
+    Se construye una vez por factura y responde a las tres búsquedas de importe.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        if "\u0130" in text or "\u0131" in text or "\u017f" in text:
+            text_fold = text.translate(_FOLD_FIXES)  # translate es lento: solo si hace falta
+        else:
+            text_fold = text
+        self.folded = text_fold.lower()
+        self._line_starts = [0] + [m.end() for m in _NEWLINE_RE.finditer(text)]
+        self._occurrences: Dict[str, List[int]] = {}
+
+    def _line_start(self, pos: int) -> int:
+        return self._line_starts[bisect_right(self._line_starts, pos) - 1]
+
+    def occurrences(self, label: str) -> List[int]:
+        """Todas las posiciones (también solapadas) donde empieza `label`."""
+        occ = self._occurrences.get(label)
+        if occ is None:
+            pats = _label_patterns(label)
+            occ = []
+            if pats.folded_re is not None and len(self.folded) == len(self.text):
+                # Candidatas sobre el texto en minúsculas; se confirman con re.I
+                m = pats.folded_re.search(self.folded)
+                while m:
+                    p = m.start()
+                    if pats.label_re.match(self.text, p):
+                        occ.append(p)
+                    m = pats.folded_re.search(self.folded, p + 1)
+            else:
+                m = pats.label_re.search(self.text)
+                while m:
+                    occ.append(m.start())
+                    m = pats.label_re.search(self.text, m.start() + 1)
+            self._occurrences[label] = occ
+        return occ
+
+    def amount_line_start(self, label: str) -> Optional[float]:
+        """Línea que EMPIEZA por `label` (tras espacios) y contiene un importe (no %)."""
+        text = self.text
+        pats = _label_patterns(label)
+        for p in self.occurrences(label):
+            ls = self._line_start(p)
+            if text[ls:p].strip():
+                continue
+            m = pats.line_start_re.match(text, ls)
+            if m:
+                return _clean_amount(m.group(1))
+        return None
+
+    def amount_after(self, label: str) -> Optional[float]:
+        """Primer importe (no %) en la misma línea tras cualquier aparición de `label`."""
+        pats = _label_patterns(label)
+        for p in self.occurrences(label):
+            m = pats.after_re.match(self.text, p)
+            if m:
+                return _clean_amount(m.group(1))
+        return None
+
+    def amount_below(self, label: str) -> Optional[float]:
+        """
+        Busca una línea que contenga `label` y examina 1–3 líneas siguientes.
+        Devuelve el importe más pequeño encontrado (evita confundir la base con el IVA),
+        ignorando líneas con '%'.
+        """
+        occ = self.occurrences(label)
+        if not occ:
+            return None
+        m = _label_patterns(label).below_re.search(self.text, self._line_start(occ[0]))
+        if not m:
+            return None
+        tail = self.text[m.end():].splitlines()
+        found: List[float] = []
+        for i in range(min(3, len(tail))):
+            line = tail[i]
+            if "%" in line:
+                continue
+            for g in _RE_M_AMT.findall(line):
+                amt = _clean_amount(g)
+                if amt is not None:
+                    found.append(amt)
+        if not found:
+            return None
+        return min(found)
+
+
 def _find_amount_after(label: str, text: str) -> Optional[float]:
     # evita porcentajes (21 %) como importes
-    pat = rf"{label}[^\n\r]*?{_M_AMT}(?!\s*%)\s*(?:{CUR})?"
-    m = re.search(pat, text, flags=re.I)
-    return _clean_amount(m.group(1)) if m else None
+    return _LabelIndex(text).amount_after(label)
+
 
 def _find_amount_line_start(label: str, text: str) -> Optional[float]:
     """
     Línea que empieza con `label` y contiene un importe; ignora porcentajes (ej. '21 %').
     Nota: sin \b tras label para casar 'TOTAL I.V.A.' / 'TOTAL IVA'.
     """
-    # Captura el primer importe de la línea cuyo label coincide, excluyendo valores seguidos de '%'
-    pat = rf"(?m)^\s*{label}.*?{_M_AMT}(?!\s*%)\s*(?:{CUR})?"
-    m = re.search(pat, text, flags=re.I)
-    return _clean_amount(m.group(1)) if m else None
-
+    return _LabelIndex(text).amount_line_start(label)
 
 
 def _find_amount_below(label: str, text: str) -> Optional[float]:
-    """
-    Busca una línea que contenga `label` y examina 1–3 líneas siguientes.
-    Devuelve el importe más pequeño encontrado (evita confundir la base con el IVA),
-    ignorando líneas con '%'.
-    """
-    m = re.search(rf"(?m)^\s*.*{label}.*$", text, flags=re.I)
-    if not m:
-        return None
-    tail = text[m.end():].splitlines()
-    found: List[float] = []
-    for i in range(min(3, len(tail))):
-        line = tail[i]
-        if "%" in line:
-            continue
-        for g in re.findall(_M_AMT, line):
-            amt = _clean_amount(g)
-            if amt is not None:
-                found.append(amt)
-    if not found:
-        return None
-    return min(found)
+    """Versión suelta de _LabelIndex.amount_below (una sola etiqueta)."""
+    return _LabelIndex(text).amount_below(label)
 
 def _find_all_amounts(text: str) -> List[float]:
     nums = re.findall(r"(?<![\d,\.])\d{1,3}(?:[.\s]\d{3})*(?:,\d{2})?", text)
@@ -183,47 +308,8 @@ def _find_all_amounts(text: str) -> List[float]:
 # Fechas
 # =========================
 
-_MONTHS_EN = {
-    "jan":1,"january":1,"feb":2,"february":2,"mar":3,"march":3,"apr":4,"april":4,
-    "may":5,"jun":6,"june":6,"jul":7,"july":7,"aug":8,"august":8,"sep":9,"sept":9,
-    "september":9,"oct":10,"october":10,"nov":11,"november":11,"dec":12,"december":12
-}
-_MONTHS_ES = {
-    "ene":1,"enero":1,"feb":2,"febrero":2,"mar":3,"marzo":3,"abr":4,"abril":4,
-    "may":5,"jun":6,"junio":6,"jul":7,"julio":7,"ago":8,"agosto":8,"sep":9,"sept":9,
-    "septiembre":9,"oct":10,"octubre":10,"nov":11,"noviembre":11,"dic":12,"diciembre":12
-}
-
-def _fmt_dmy(d: int, m: int, y: int) -> str:
-    return f"{d:02d}/{m:02d}/{y:04d}"
-
 def _parse_date(text: str) -> Optional[str]:
-    t = text.lower()
-    m = re.search(r"\b(\d{1,2})[\/\-](\d{1,2})[\/\-](20\d{2})\b", t)
-    if m:
-        return _truncate(_fmt_dmy(int(m.group(1)), int(m.group(2)), int(m.group(3))))
-    m = re.search(r"\b(20\d{2})[\/\-](\d{1,2})[\/\-](\d{1,2})\b", t)
-    if m:
-        return _truncate(_fmt_dmy(int(m.group(3)), int(m.group(2)), int(m.group(1))))
-    m = re.search(r"\b(\d{1,2})[.\-](\d{1,2})[.\-](20\d{2})\b", t)
-    if m:
-        return _truncate(_fmt_dmy(int(m.group(1)), int(m.group(2)), int(m.group(3))))
-    m = re.search(r"\b(\d{1,2})\s+([a-z]{3,9})\s+(20\d{2})\b", t)
-    if m:
-        mon = _MONTHS_EN.get(m.group(2)[:3], None)
-        if mon:
-            return _truncate(_fmt_dmy(int(m.group(1)), mon, int(m.group(3))))
-    m = re.search(r"\b(\d{1,2})\s+de\s+([a-záéíóú]{3,12})\s+(?:de|del\s+año)\s+(20\d{2})\b", t, flags=re.I)
-    if m:
-        name = m.group(2)
-        mon = None
-        for k, v in _MONTHS_ES.items():
-            if name.startswith(k):
-                mon = v
-                break
-        if mon:
-            return _truncate(_fmt_dmy(int(m.group(1)), mon, int(m.group(3))))
-    return None
+    return _truncate(busca_fecha(text))
 
 # =========================
 # Proveedor/Invoice simples
@@ -263,14 +349,20 @@ def _guess_supplier(text: str) -> Optional[str]:
         return detected_name
 
     # 3) Si no se detectó proveedor por heurística, buscar coincidencia parcial en lista externa
-    if not detected_name and KNOWN_SUPPLIERS:
-        for needle, full in KNOWN_SUPPLIERS.items():
-            if needle.lower() in text.lower():
-                return full
+    #    (una sola pasada; si casan varias claves, gana la más larga)
+    if not detected_name:
+        hit = SUPPLIER_MATCHER.match(text)
+        if hit:
+            return hit[1]
 
     return None
 
 
+def supplier_of(text: str) -> Optional[str]:
+    """Proveedor (nombre completo) que detectaría extract_fields_from_text en `text`."""
+    return _guess_supplier(_clean_text(text))
+
+
 def _guess_invoice(text: str) -> Optional[str]:
     for p in [
         r"factura\s*(?:nº|n\.|no|number|#)?\s*[:\-]?\s*([A-Z0-9\/\.\-]*\d[A-Z0-9\/\.\-]*)",
@@ -291,7 +383,69 @@ def _guess_invoice(text: str) -> Optional[str]:
 # Extracción principal
 # =========================
 
-def extract_fields_from_text(text: str, filename: str = "") -> Dict[str, Any]:
+_RE_IVA_LINEA = re.compile(
+    rf"(?im)^\s*(?:total\s+)?i\W*v\W*a\W*[:\-]?\s*{_M_AMT}(?!\s*%)\s*(?:{CUR})?\s*$"
+)
+_RE_IVA_PCT = re.compile(
+    r"(?:IVA|I\.?\s*V\.?\s*A\.?|TIPO\s+DE\s+I\.?\s*V\.?\s*A\.?)"
+    r"[^\n\r]{0,60}?(\d{1,2}(?:[.,]\d{1,2})?)\s*%",
+    re.I,
+)
+
+
+def _amounts_from_text(t: str) -> Tuple[Optional[float], Optional[float], Optional[float], Optional[float]]:
+    """(Total, Base, IVA, IRPF) tal cual aparecen en el texto (sin deducir nada)."""
+    idx = _LabelIndex(t)
+
+    total_bruto = None
+    for L in LABELS_TOTAL:
+        total_bruto = idx.amount_line_start(L) or idx.amount_after(L)
+        if total_bruto is not None:
+            break
+
+    neto_base = None
+    for L in LABELS_BASE:
+        neto_base = idx.amount_line_start(L) or idx.amount_after(L)
+        if neto_base is not None:
+            break
+
+    iva_eur = None
+
+    # Captura directa en la misma línea (soporta I.V.A. / TOTAL I.V.A.)
+    if iva_eur is None:
+        m_iva = _RE_IVA_LINEA.search(t)
+        if m_iva:
+            iva_eur = _clean_amount(m_iva.group(1))
+
+    # Si no lo pillamos arriba, probamos con las heurísticas habituales
+    if iva_eur is None:
+        for L in LABELS_IVA:
+            iva_eur = (idx.amount_line_start(L) or
+                       idx.amount_after(L) or
+                       idx.amount_below(L))
+            if iva_eur is not None:
+                break
+
+
+    irpf = None
+    for L in LABELS_IRPF:
+        irpf = idx.amount_line_start(L) or idx.amount_after(L)
+        if irpf is not None:
+            break
+
+    return total_bruto, neto_base, iva_eur, irpf
+
+
+def extract_fields_from_text(
+    text: str,
+    filename: str = "",
+    importes: Optional[Tuple[Optional[float], Optional[float], Optional[float], Optional[float]]] = None,
+) -> Dict[str, Any]:
+    """
+    Campos de una factura a partir de su texto. `importes` = (Total, Base, IVA, IRPF)
+    ya localizados por otro motor (layout_extractor.py): entonces no se buscan en
+    el texto, pero los fallbacks y las reglas de coherencia son los mismos.
+    """
     t = _clean_text(text)
 
     # --- Proveedor / Invoice (versiones "full") ---
@@ -321,75 +475,20 @@ def extract_fields_from_text(text: str, filename: str = "") -> Dict[str, Any]:
             if concepto_full:
                 break
 
-    # --- Importes (igual que antes) ---
-    labels_total = [
-    "Total", "Total factura", "Importe total", "Total bruto", "Total a pagar",
-    "Total amount", "TOTAL EUROS", "SUMAN", "TOTAL FACTURA", "TOTAL A PAGAR",
-    "Total Factura Euros"  # <- aparece así en tu PDF
-    ]
+    # --- Importes (igual que antes, sobre el índice de etiquetas) ---
+    if importes is None:
+        importes = _amounts_from_text(t)
+    total_bruto, neto_base, iva_eur, irpf = importes
 
-    labels_base  = ["Base imponible", "Base", "Subtotal", "Neto", "Taxable base", "TOTAL BASE"]
-
-    labels_iva   = [
-        "IVA",
-        r"I\.?\s*V\.?\s*A\.?",          # I.V.A / IVA con puntos/espacios
-        r"TOTAL\s+IVA",
-        r"TOTAL\s+I\.?\s*V\.?\s*A\.?",  # TOTAL I.V.A.
-        "VAT",
-        "Impuesto",
-        "TOTAL I.V.A.",                 # literal exacto por si acaso
-        "TIPO DE I.V.A."                # (por si algún proveedor pone solo el %)
+    # Lo que no aparece tal cual en el texto (antes de deducirlo con los fallbacks)
+    faltan = [
+        campo for campo, valor in (("Total", total_bruto), ("Base", neto_base), ("Invoice", invoice_full))
+        if valor is None
     ]
 
-
-    labels_irpf  = ["IRPF", "Retención", "Withholding"]
-
-    total_bruto = None
-    for L in labels_total:
-        total_bruto = _find_amount_line_start(L, t) or _find_amount_after(L, t)
-        if total_bruto is not None:
-            break
-
-    neto_base = None
-    for L in labels_base:
-        neto_base = _find_amount_line_start(L, t) or _find_amount_after(L, t)
-        if neto_base is not None:
-            break
-
-    iva_eur = None
-
-    # Captura directa en la misma línea (soporta I.V.A. / TOTAL I.V.A.)
-    if iva_eur is None:
-        m_iva = re.search(
-            rf"(?im)^\s*(?:total\s+)?i\W*v\W*a\W*[:\-]?\s*{_M_AMT}(?!\s*%)\s*(?:{CUR})?\s*$",
-            t
-        )
-        if m_iva:
-            iva_eur = _clean_amount(m_iva.group(1))
-
-    # Si no lo pillamos arriba, probamos con las heurísticas habituales
-    if iva_eur is None:
-        for L in labels_iva:
-            iva_eur = (_find_amount_line_start(L, t) or
-                       _find_amount_after(L, t) or
-                       _find_amount_below(L, t))
-            if iva_eur is not None:
-                break
-
-
-    irpf = None
-    for L in labels_irpf:
-        irpf = _find_amount_line_start(L, t) or _find_amount_after(L, t)
-        if irpf is not None:
-            break
-
     # --- Fallback 1: si hay % de IVA cerca pero no valor en €, calcula desde Base ---
     if iva_eur is None and neto_base is not None:
-        pct_match = re.search(
-            r"(?:IVA|I\.?\s*V\.?\s*A\.?|TIPO\s+DE\s+I\.?\s*V\.?\s*A\.?)"
-            r"[^\n\r]{0,60}?(\d{1,2}(?:[.,]\d{1,2})?)\s*%",
-            t, flags=re.I
-        )
+        pct_match = _RE_IVA_PCT.search(t)
         if pct_match:
             try:
                 pct_str = pct_match.group(1).replace(",", ".")
@@ -472,6 +571,9 @@ def extract_fields_from_text(text: str, filename: str = "") -> Dict[str, Any]:
         "IVA": iva_eur,
         "IRPF": irpf,
         "Neto": neto_base,
+
+        # Campos necesarios no encontrados en el texto (lectura perezosa de páginas)
+        "Faltan": faltan,
     }
 
     return fields
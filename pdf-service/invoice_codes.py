@@ -0,0 +1,504 @@
+# invoice_codes.py
+# Códigos de factura para /api/contraste-facturas: normalización, índice del
+# Excel de pendientes, motor de códigos por nombre de PDF y coincidencia por
+# contenido (nº factura / importe / proveedor extraídos del PDF).
+#
+# InvoiceIndex: índice invertido código normalizado -> TODAS las celdas en las
+# que aparece (antes una fila posterior pisaba a la anterior), más un índice de
+# trigramas para buscar códigos contenidos en otros ("137090" dentro de
+# "2025137090") sin recorrer todas las claves.
+
+from __future__ import annotations
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+import re
+import unicodedata
+import pandas as pd
+
+# =========================
+# Normalización
+# =========================
+
+_RE_RUIDO = re.compile(r"\b(FACTURA|FAC|N[ºO]?|INVOICE|NO|NUMERO|NÚMERO|DOC|DOCUMENTO|S/FRA\.?)\b")
+_RE_NO_CODIGO = re.compile(r"[^A-Z0-9\-/]")
+_RE_SEPARADORES = re.compile(r"[-/]{2,}")
+_RE_LETRAS_NUM = re.compile(r"([A-Z]{1,5})[-/]?(\d{2,6})")
+_RE_DIGITOS_LARGOS = re.compile(r"\d{6,}")
+
+
+@lru_cache(maxsize=65536)
+def norm_invoice_code(s: str | None) -> str:
+    """
+    Normaliza códigos de factura sin destruir su estructura.
+    - Conserva dígitos largos (3020014885)
+    - Une letras+números (MA1391)
+    - Quita solo ruido textual tipo 'Factura', 'Nº', 'Invoice', etc.
+    """
+    if not s:
+        return ""
+    t = str(s).upper().strip()
+
+    # 1️⃣ Eliminar prefijos inútiles
+    t = _RE_RUIDO.sub("", t)
+
+    # 2️⃣ Mantener solo letras, números y separadores simples
+    t = _RE_NO_CODIGO.sub("", t)
+
+    # 3️⃣ Simplificar secuencias repetidas de separadores
+    t = _RE_SEPARADORES.sub("-", t)
+
+    # 4️⃣ Eliminar separadores iniciales o finales
+    t = t.strip("-/")
+
+    # 5️⃣ Casos comunes: “MA-1391”, “MA 1391”, “24-25/MA//1391” → MA1391, 1391, 2425MA1391
+    m = _RE_LETRAS_NUM.search(t)
+    if m:
+        return f"{m.group(1)}{m.group(2)}"
+
+    # 6️⃣ Si son solo dígitos largos
+    if _RE_DIGITOS_LARGOS.fullmatch(t):
+        return t
+
+    # 7️⃣ Si nada cuadra, devuélvelo limpio
+    return t
+
+
+# =========================
+# Índice del Excel de pendientes
+# =========================
+
+
+@dataclass(frozen=True)
+class CeldaFactura:
+    fila: int       # fila en Excel (cabecera = 1)
+    columna: str
+    valor: str
+
+    def as_dict(self) -> dict:
+        return {"fila": self.fila, "columna": self.columna, "valor": self.valor}
+
+
+class InvoiceIndex:
+    """
+    Código normalizado -> celdas del Excel donde aparece (en orden de lectura).
+    Las claves conservan el orden en que se vieron por primera vez.
+    """
+
+    NGRAM = 3
+
+    def __init__(self):
+        self._celdas: Dict[str, List[CeldaFactura]] = {}
+        self._ngramas: Dict[str, Set[int]] = {}
+        self._claves: List[str] = []
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, columnas: Optional[Iterable[str]] = None) -> "InvoiceIndex":
+        """Indexa las `columnas` indicadas (todas si None), fila a fila."""
+        idx = cls()
+        cols = list(df.columns) if columnas is None else [c for c in columnas if c in df.columns]
+        if not cols or df.empty:
+            return idx
+        valores = [df[c].tolist() for c in cols]
+        for pos, fila in enumerate(df.index):
+            for c, vals in zip(cols, valores):
+                val = str(vals[pos] or "")
+                if val.strip():
+                    idx.add(norm_invoice_code(val), CeldaFactura(fila=fila + 2, columna=c, valor=val))
+        return idx
+
+    def add(self, clave: str, celda: CeldaFactura) -> None:
+        if not clave:
+            return
+        celdas = self._celdas.get(clave)
+        if celdas is None:
+            celdas = self._celdas[clave] = []
+            k = len(self._claves)
+            self._claves.append(clave)
+            for g in self._ngramas_de(clave):
+                self._ngramas.setdefault(g, set()).add(k)
+        celdas.append(celda)
+
+    def _ngramas_de(self, s: str) -> Set[str]:
+        n = self.NGRAM
+        return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+    def __len__(self) -> int:
+        return len(self._claves)
+
+    def __contains__(self, clave: str) -> bool:
+        return clave in self._celdas
+
+    def get(self, clave: str) -> List[CeldaFactura]:
+        """Celdas cuyo código normalizado es exactamente `clave` ([] si ninguna)."""
+        return self._celdas.get(clave, [])
+
+    def first(self, clave: str) -> Optional[CeldaFactura]:
+        celdas = self._celdas.get(clave)
+        return celdas[0] if celdas else None
+
+    def keys_containing(self, sub: str) -> List[str]:
+        """Claves que contienen `sub` (o son iguales), en orden de inserción."""
+        if not sub:
+            return []
+        if len(sub) < self.NGRAM:
+            return [k for k in self._claves if sub in k]
+        candidatos: Optional[Set[int]] = None
+        # Primero los trigramas más raros: la intersección se queda pequeña antes
+        for g in sorted(self._ngramas_de(sub), key=lambda g: len(self._ngramas.get(g, ()))):
+            posting = self._ngramas.get(g)
+            if not posting:
+                return []
+            candidatos = posting if candidatos is None else candidatos & posting
+            if not candidatos:
+                return []
+        return [self._claves[k] for k in sorted(candidatos or ()) if sub in self._claves[k]]
+
+    def first_containing(self, sub: str) -> Optional[CeldaFactura]:
+        """Primera celda (por orden de clave) cuyo código contiene `sub`."""
+        claves = self.keys_containing(sub)
+        return self._celdas[claves[0]][0] if claves else None
+
+
+# =========================
+# Motor de extracción de códigos desde el nombre del PDF
+# =========================
+# Un nombre de archivo se tokeniza UNA vez (patrones precompilados) y sobre esos
+# tokens se aplican, en orden, las pasadas de búsqueda en el índice:
+#   primaria   -> códigos "con forma de factura" (INV123, 3020014885, MA-1391...)
+#   secundaria -> cualquier bloque de ≥4 alfanuméricos
+#   terciaria  -> bloques numéricos puros (solo si nada casó) y bloques
+#                 aislados separando letras/números ("84927TRAVI" -> 84927, TRAVI)
+#   subcadena  -> último recurso: número del nombre contenido en algún código
+# Los duplicados se descartan por código normalizado (conjunto, no bucles).
+
+_RE_PRIMARIO = re.compile(
+    r"(?:INV\d{3,}|\b\d{6,}\b|\d{4}[-_/]\d{3,}|[A-Z]{1,5}[\s\-_/]*\d{2,6}|\d{2,6}[\s\-_/]*[A-Z]{1,5})"
+)
+_RE_ANIO = re.compile(r"20[2-3]\d")
+_RE_BLOQUE = re.compile(r"[A-Z0-9]{4,}")
+_RE_NUMERICO = re.compile(r"\d{4,}")
+_RE_NO_ALNUM = re.compile(r"[^A-Z0-9]")
+_RE_DIGITO_LETRA = re.compile(r"(?<=\d)(?=[A-Z])|(?<=[A-Z])(?=\d)")
+_RE_BLOQUE_AISLADO = re.compile(r"\b[A-Z0-9]{4,}\b")
+
+# Años que nunca se toman como nº de factura en las pasadas terciarias
+ANIOS_IGNORADOS = frozenset(str(a) for a in range(2020, 2027))
+
+PRIMARIA, SECUNDARIA, TERCIARIA, SUBCADENA = "primaria", "secundaria", "terciaria", "subcadena"
+
+
+@dataclass(frozen=True)
+class FilenameTokens:
+    """Tokens de un nombre de archivo (en mayúsculas) para todas las pasadas."""
+    codigos: tuple      # primarios normalizados, sin años ni duplicados (= CodigosDetectados)
+    bloques: tuple      # ≥4 alfanuméricos seguidos
+    numericos: tuple    # ≥4 dígitos seguidos (incluye años; se filtran al buscar)
+    aislados: tuple     # bloques tras separar letras/números contiguos
+
+
+@lru_cache(maxsize=16384)
+def tokenize_filename(nombre: str) -> FilenameTokens:
+    nombre = nombre.upper()
+
+    # ➤ Códigos principales: sin años (2020–2039) ni duplicados, normalizados
+    matches = [m for m in _RE_PRIMARIO.findall(nombre) if not _RE_ANIO.fullmatch(m)]
+    codigos = [nm for nm in dict.fromkeys(norm_invoice_code(m) for m in dict.fromkeys(matches)) if nm]
+
+    # ➤ Rescate: separa letras y números adyacentes (para evitar "84927TRAVI")
+    base_clean = _RE_DIGITO_LETRA.sub(" ", _RE_NO_ALNUM.sub(" ", nombre))
+
+    return FilenameTokens(
+        codigos=tuple(codigos),
+        bloques=tuple(_RE_BLOQUE.findall(nombre)),
+        numericos=tuple(_RE_NUMERICO.findall(nombre)),
+        aislados=tuple(_RE_BLOQUE_AISLADO.findall(base_clean)),
+    )
+
+
+@dataclass(frozen=True)
+class CodeMatch:
+    code: str            # texto tal cual salió del nombre
+    clave: str           # código buscado en el índice
+    celda: CeldaFactura  # primera celda del Excel con esa clave
+    origen: str          # primaria / secundaria / terciaria / subcadena
+
+
+@dataclass(frozen=True)
+class FilenameMatch:
+    nombre: str
+    tokens: FilenameTokens
+    coincidencias: tuple  # CodeMatch, en el orden en que se encontraron
+
+    @property
+    def codigos_detectados(self) -> List[str]:
+        return list(self.tokens.codigos)
+
+    @property
+    def coincide(self) -> bool:
+        return bool(self.coincidencias)
+
+    @property
+    def celda(self) -> Optional[CeldaFactura]:
+        return self.coincidencias[0].celda if self.coincidencias else None
+
+    @property
+    def razon(self) -> str:
+        if not self.coincidencias:
+            return (
+                f"Ningún código del archivo ({', '.join(self.codigos_detectados + list(self.tokens.numericos))}) "
+                f"se encontró en el Excel"
+            )
+        ultima = self.coincidencias[-1]
+        if ultima.origen == SUBCADENA:
+            c = ultima.celda
+            return (
+                f"'{ultima.code}' (vía numérica pura) coincide con celda "
+                f"(columna '{c.columna}', fila {c.fila}) → {c.valor}"
+            )
+        return " / ".join(
+            f"'{m.code}' coincide con celda (columna '{m.celda.columna}', fila {m.celda.fila}) → {m.celda.valor}'"
+            for m in self.coincidencias
+        )
+
+
+def match_filename(nombre: str, index: InvoiceIndex) -> FilenameMatch:
+    """Busca en `index` los códigos del nombre de archivo (pasadas en orden)."""
+    tok = tokenize_filename(nombre)
+    encontrados: List[CodeMatch] = []
+    vistos: Set[str] = set()  # claves normalizadas ya encontradas
+
+    def _anota(code: str, clave: str, origen: str) -> None:
+        encontrados.append(CodeMatch(code, clave, index.first(clave), origen))
+        vistos.add(norm_invoice_code(code))
+
+    # ➤ Primera pasada: códigos principales normalizados
+    for code in tok.codigos:
+        clave = norm_invoice_code(code)
+        if clave in index:
+            _anota(code, clave, PRIMARIA)
+
+    # ➤ Segunda pasada: bloques genéricos (solo si no estaban ya)
+    for eb in tok.bloques:
+        clave = norm_invoice_code(eb)
+        if clave in index and clave not in vistos:
+            _anota(eb, clave, SECUNDARIA)
+
+    # ➤ Tercera pasada: numérico puro (sin normalizar), solo si aún no hay nada
+    if not encontrados:
+        for nb in tok.numericos:
+            if nb not in ANIOS_IGNORADOS and nb in index:
+                _anota(nb, nb, TERCIARIA)
+
+    # ➤ Tercera pasada (rescate): bloques aislados
+    for rb in tok.aislados:
+        if rb in ANIOS_IGNORADOS:
+            continue
+        clave = norm_invoice_code(rb)
+        if clave in index and clave not in vistos:
+            _anota(rb, clave, TERCIARIA)
+
+    # ➤ Último recurso: número contenido dentro de algún código del Excel
+    # (gana el último número del nombre que encuentre algo)
+    if not encontrados:
+        sub: Optional[CodeMatch] = None
+        for mt in tok.numericos:
+            if mt in ANIOS_IGNORADOS:
+                continue
+            claves = index.keys_containing(mt)
+            if claves:
+                sub = CodeMatch(mt, claves[0], index.first(claves[0]), SUBCADENA)
+        if sub is not None:
+            encontrados.append(sub)
+
+    return FilenameMatch(nombre=nombre, tokens=tok, coincidencias=tuple(encontrados))
+
+
+def match_filenames(nombres: Iterable[str], index: InvoiceIndex) -> List[FilenameMatch]:
+    """Versión por lotes: un resultado por nombre (los nombres repetidos se resuelven una vez)."""
+    hechos: Dict[str, FilenameMatch] = {}
+    out: List[FilenameMatch] = []
+    for nombre in nombres:
+        res = hechos.get(nombre)
+        if res is None:
+            res = hechos[nombre] = match_filename(nombre, index)
+        out.append(res)
+    return out
+
+
+# =========================
+# Coincidencia por contenido del PDF
+# =========================
+# Para PDFs cuyo nombre no dice nada ("scan_0001.pdf"): se usan los campos que
+# saca el extractor (los mismos de /api/pdf2excel, cacheados por contenido).
+#   1) nº de factura del PDF en el índice (y se confirma importe / proveedor)
+#   2) si no, importe (± tolerancia) + proveedor contra las filas del Excel
+
+CONTENIDO = "contenido"
+
+_STOP_PROVEEDOR = frozenset([
+    "sl", "slu", "sa", "sau", "sll", "scp", "cb", "sociedad", "limitada", "anonima",
+    "de", "del", "la", "las", "los", "el", "y", "e", "and", "the", "ltd", "gmbh",
+])
+_RE_NO_PALABRA = re.compile(r"[^a-z0-9]+")
+
+
+@lru_cache(maxsize=8192)
+def _tokens_proveedor(s: str) -> frozenset:
+    s = unicodedata.normalize("NFD", str(s or "").lower())
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
+    return frozenset(t for t in _RE_NO_PALABRA.split(s) if len(t) >= 3 and t not in _STOP_PROVEEDOR)
+
+
+def proveedores_coinciden(a: str | None, b: str | None) -> bool:
+    """True si comparten alguna palabra significativa ("Momentum Arq." ~ "MOMENTUM ARQUITECTURA, S.L.")."""
+    if not a or not b:
+        return False
+    return bool(_tokens_proveedor(a) & _tokens_proveedor(b))
+
+
+@dataclass(frozen=True)
+class FilaImporte:
+    fila: int
+    importe: float
+    columna: str
+    valor: str
+    proveedor: str
+
+
+class AmountIndex:
+    """Importe en céntimos -> filas del Excel (para buscar con tolerancia)."""
+
+    def __init__(self):
+        self._por_centimos: Dict[int, List[FilaImporte]] = {}
+        self._por_fila: Dict[int, FilaImporte] = {}
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df: pd.DataFrame,
+        columnas: List[str],
+        parse_importe: Callable[[Any], Optional[float]],
+        col_proveedor: Optional[str] = None,
+    ) -> "AmountIndex":
+        """Primer importe legible de cada fila (en el orden de `columnas`)."""
+        idx = cls()
+        cols = [c for c in columnas if c in df.columns]
+        if not cols or df.empty:
+            return idx
+        valores = [df[c].tolist() for c in cols]
+        proveedores = df[col_proveedor].tolist() if col_proveedor in df.columns else None
+        for pos, fila in enumerate(df.index):
+            for c, vals in zip(cols, valores):
+                v = vals[pos]
+                n = parse_importe(v) if v is not None else None
+                if n is not None:
+                    prov = str(proveedores[pos] or "") if proveedores is not None else ""
+                    idx.add(FilaImporte(fila=fila + 2, importe=n, columna=c, valor=str(v), proveedor=prov))
+                    break
+        return idx
+
+    def add(self, f: FilaImporte) -> None:
+        self._por_centimos.setdefault(int(round(abs(f.importe) * 100)), []).append(f)
+        self._por_fila[f.fila] = f
+
+    def fila(self, fila: int) -> Optional[FilaImporte]:
+        return self._por_fila.get(fila)
+
+    def near(self, importe: float, tolerancia: float) -> List[FilaImporte]:
+        """Filas cuyo importe (en valor absoluto) está a ±tolerancia de `importe`."""
+        c = int(round(abs(importe) * 100))
+        t = int(round(abs(tolerancia) * 100))
+        out: List[FilaImporte] = []
+        for k in range(c - t, c + t + 1):
+            out.extend(self._por_centimos.get(k, ()))
+        out.sort(key=lambda f: f.fila)
+        return out
+
+
+@dataclass(frozen=True)
+class ContentMatch:
+    criterio: str                  # "nº factura" / "importe + proveedor"
+    fila: int
+    celda: CeldaFactura
+    invoice: Optional[str]
+    importe: Optional[float]
+    proveedor: Optional[str]
+    importe_ok: bool
+    proveedor_ok: bool
+
+    @property
+    def razon(self) -> str:
+        c = self.celda
+        if self.criterio == "nº factura":
+            extra = []
+            if self.importe_ok:
+                extra.append(f"importe {self.importe:.2f} confirmado")
+            if self.proveedor_ok:
+                extra.append("proveedor confirmado")
+            return (
+                f"Contenido del PDF: nº factura '{self.invoice}' coincide con celda "
+                f"(columna '{c.columna}', fila {c.fila}) → {c.valor}"
+                + (f" [{', '.join(extra)}]" if extra else "")
+            )
+        return (
+            f"Contenido del PDF: importe {self.importe:.2f} y proveedor '{self.proveedor}' coinciden con celda "
+            f"(columna '{c.columna}', fila {c.fila}) → {c.valor}"
+        )
+
+
+def _sin_recorte(s: Any) -> Optional[str]:
+    """Quita el " (...)" que pone el extractor a los textos largos (vista previa)."""
+    s = str(s or "").strip()
+    if s.endswith(" (...)"):
+        s = s[: -len(" (...)")].rstrip()
+    return s or None
+
+
+def match_content(
+    campos: Dict[str, Any],
+    index: InvoiceIndex,
+    importes: AmountIndex,
+    tolerancia: float = 0.05,
+) -> Optional[ContentMatch]:
+    """Busca la factura por los campos extraídos del PDF (fila de pdf_parser.parse_pdf_fields)."""
+    # Los *_full van sin recortar; Invoice/Proveedor solo como respaldo (filas antiguas)
+    invoice = _sin_recorte(campos.get("Invoice_full") or campos.get("Invoice"))
+    proveedor = _sin_recorte(campos.get("Proveedor_full") or campos.get("Proveedor"))
+    importe = campos.get("Importe Bruto")
+    if importe is None:
+        importe = campos.get("Neto")
+
+    def _importe_ok(fila: int) -> bool:
+        f = importes.fila(fila)
+        return importe is not None and f is not None and abs(abs(f.importe) - abs(importe)) <= tolerancia + 1e-9
+
+    def _proveedor_ok(fila: int) -> bool:
+        f = importes.fila(fila)
+        return f is not None and proveedores_coinciden(proveedor, f.proveedor)
+
+    # 1) Nº de factura del PDF: vale si la clave lleva a una sola fila; si lleva
+    #    a varias (claves normalizadas que colisionan), solo la que cuadra en importe
+    celdas = index.get(norm_invoice_code(invoice)) if invoice else []
+    celda = next((c for c in celdas if _importe_ok(c.fila)), None)
+    if celda is None and len({c.fila for c in celdas}) == 1:
+        celda = celdas[0]
+    if celda is not None:
+        return ContentMatch(
+            criterio="nº factura", fila=celda.fila, celda=celda, invoice=invoice,
+            importe=importe, proveedor=proveedor,
+            importe_ok=_importe_ok(celda.fila), proveedor_ok=_proveedor_ok(celda.fila),
+        )
+
+    # 2) Importe ± tolerancia confirmado por proveedor (solo si es inequívoco)
+    if importe is not None and proveedor:
+        candidatas = [f for f in importes.near(importe, tolerancia) if proveedores_coinciden(proveedor, f.proveedor)]
+        if len(candidatas) == 1:
+            f = candidatas[0]
+            return ContentMatch(
+                criterio="importe + proveedor", fila=f.fila,
+                celda=CeldaFactura(fila=f.fila, columna=f.columna, valor=f.valor),
+                invoice=invoice, importe=importe, proveedor=proveedor,
+                importe_ok=True, proveedor_ok=True,
+            )
+    return None
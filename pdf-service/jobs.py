@@ -0,0 +1,363 @@
+# jobs.py
+# Trabajos en segundo plano para las subidas grandes (pdf2excel, bankflowpro,
+# contraste-facturas).
+#
+# Antes todo se hacía dentro de la petición HTTP y un lote grande acababa en
+# timeout en las páginas Blazor, sin saber por dónde iba. Ahora:
+#   - cada petición es un Job con id, estado y progreso (archivos / pasos hechos);
+#   - los Jobs esperan en una cola acotada y solo se procesan N a la vez;
+#   - la respuesta final (Excel/JSON + cabeceras) se guarda en disco y caduca
+#     pasado un tiempo (se borra sola);
+#   - los endpoints de siempre siguen siendo síncronos: crean el Job, esperan a
+#     que termine y devuelven la misma respuesta que antes; su resultado no se
+#     queda en disco, solo la vista previa (X-Preview-Url), ver entrega();
+#   - quien quiera ir viendo resultados parciales se suscribe a los eventos del
+#     Job (escucha/emite), p. ej. /api/pdf2excel/stream.
+#
+# Todo vive en el proceso del servidor (event loop de FastAPI): si se reinicia,
+# los Jobs en curso se pierden.
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, List, Optional
+import asyncio
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+from fastapi import HTTPException, Response
+from fastapi.responses import JSONResponse
+
+import metrics
+import profiling
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# JOBS_DIR:             carpeta donde se guardan entradas y resultados
+# JOBS_MAX_CONCURRENTES: Jobs procesándose a la vez
+# JOBS_MAX_EN_COLA:     Jobs admitidos esperando/procesando (más -> 429)
+# JOBS_TTL_S:           segundos que se conserva un resultado terminado
+JOBS_DIR = os.environ.get("JOBS_DIR", os.path.join(tempfile.gettempdir(), "departamento-financiero-jobs"))
+JOBS_MAX_CONCURRENTES = int(os.environ.get("JOBS_MAX_CONCURRENTES", "2"))
+JOBS_MAX_EN_COLA = int(os.environ.get("JOBS_MAX_EN_COLA", "20"))
+JOBS_TTL_S = float(os.environ.get("JOBS_TTL_S", "3600"))
+
+# Estados de un Job
+EN_COLA = "en_cola"
+PROCESANDO = "procesando"
+TERMINADO = "terminado"
+ERROR = "error"
+
+# Cabeceras de la respuesta original que se conservan con el resultado
+_CABECERAS_GUARDADAS = ("content-disposition", "x-preview", "server-timing", "x-profile-id", "x-profile-url")
+
+_RX_NOMBRE_SEGURO = re.compile(r"[^\w.\-]+")
+
+
+class ColaLlena(Exception):
+    """No caben más Jobs en la cola (el llamador responde 429)."""
+
+
+@dataclass
+class Job:
+    id: str
+    tipo: str
+    estado: str = EN_COLA
+    hechos: int = 0
+    total: int = 0
+    paso: str = ""
+    creado: float = field(default_factory=time.time)
+    iniciado: Optional[float] = None
+    terminado: Optional[float] = None
+    error: Optional[str] = None
+    # Ejecutar perfilado (cabecera X-Profile con PROFILING_ACTIVO=1, ver profiling.py)
+    perfilar: bool = False
+    # Resultado ya devuelto por un endpoint síncrono y borrado (solo queda la vista previa)
+    entregado: bool = False
+    # Respuesta guardada (el cuerpo está en disco, ver JobManager.ruta_resultado)
+    status_code: int = 200
+    media_type: Optional[str] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    _fin: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    _oyentes: List[asyncio.Queue] = field(default_factory=list, repr=False)
+
+    def avanza(self, hechos: int, total: Optional[int] = None, paso: Optional[str] = None) -> None:
+        """Callback de progreso: se puede llamar desde el event loop o desde un hilo."""
+        if total is not None:
+            self.total = total
+        self.hechos = hechos
+        if paso is not None:
+            self.paso = paso
+
+    def escucha(self) -> asyncio.Queue:
+        """Cola con los eventos (nombre, datos) que emita el Job; el último es 'fin'."""
+        cola: asyncio.Queue = asyncio.Queue()
+        self._oyentes.append(cola)
+        return cola
+
+    def deja_de_escuchar(self, cola: asyncio.Queue) -> None:
+        if cola in self._oyentes:
+            self._oyentes.remove(cola)
+
+    def emite(self, evento: str, datos: Dict[str, Any]) -> None:
+        """Envía un evento a los oyentes (solo desde el event loop, no desde hilos)."""
+        for cola in self._oyentes:
+            cola.put_nowait((evento, datos))
+
+    @property
+    def progreso(self) -> float:
+        if self.estado in (TERMINADO, ERROR):
+            return 1.0
+        return min(1.0, self.hechos / self.total) if self.total else 0.0
+
+    @property
+    def acabado(self) -> bool:
+        return self.estado in (TERMINADO, ERROR)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "progreso": round(self.progreso, 4),
+            "hechos": self.hechos,
+            "total": self.total,
+            "paso": self.paso,
+            "creado": self.creado,
+            "iniciado": self.iniciado,
+            "terminado": self.terminado,
+            "error": self.error,
+            "url_estado": f"/api/jobs/{self.id}",
+            "url_resultado": None if self.entregado else f"/api/jobs/{self.id}/resultado",
+            "url_preview": f"/api/jobs/{self.id}/preview",
+        }
+
+
+# Trabajo a ejecutar: recibe el Job (para informar progreso) y devuelve la Response final
+Tarea = Callable[[Job], Awaitable[Response]]
+
+
+class JobManager:
+    """
+    Cola acotada de Jobs con límite de concurrencia y resultados en disco.
+    submit() encola y devuelve el Job al momento; wait() espera a que acabe.
+    """
+
+    def __init__(
+        self,
+        carpeta: Optional[str] = None,
+        max_concurrentes: Optional[int] = None,
+        max_en_cola: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+    ):
+        self.carpeta = JOBS_DIR if carpeta is None else carpeta
+        self.max_concurrentes = JOBS_MAX_CONCURRENTES if max_concurrentes is None else max_concurrentes
+        self.max_en_cola = JOBS_MAX_EN_COLA if max_en_cola is None else max_en_cola
+        self.ttl_s = JOBS_TTL_S if ttl_s is None else ttl_s
+        self._jobs: Dict[str, Job] = {}
+        self._tareas: Dict[str, asyncio.Task] = {}
+        self._semaforo: Optional[tuple] = None
+        os.makedirs(self.carpeta, exist_ok=True)
+        self._purga_carpeta_huerfana()
+
+    # ---------- rutas en disco ----------
+
+    def _dir_job(self, job_id: str) -> str:
+        return os.path.join(self.carpeta, job_id)
+
+    def dir_entrada(self, job_id: str) -> str:
+        return os.path.join(self._dir_job(job_id), "entrada")
+
+    def ruta_resultado(self, job_id: str) -> str:
+        return os.path.join(self._dir_job(job_id), "resultado.bin")
+
+    def ruta_preview(self, job_id: str) -> str:
+        return os.path.join(self._dir_job(job_id), "preview.json")
+
+    def guarda_preview(self, job: Job, preview: Dict[str, Any]) -> None:
+        """Vista previa del resultado (ver preview.py); se sirve en /api/jobs/{id}/preview."""
+        with open(self.ruta_preview(job.id), "w", encoding="utf-8") as fh:
+            json.dump(preview, fh, ensure_ascii=False)
+
+    def lee_preview(self, job: Job) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.ruta_preview(job.id), "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+
+    def guarda_entrada(self, job: Job, nombre: str, origen: BinaryIO) -> str:
+        """
+        Copia un archivo subido (p. ej. UploadFile.file, ya en disco si es grande)
+        a la carpeta de entrada del Job por trozos de 1 MB, sin tenerlo entero en
+        memoria; devuelve su ruta. Es E/S bloqueante: llamarla en un hilo.
+        """
+        carpeta = self.dir_entrada(job.id)
+        os.makedirs(carpeta, exist_ok=True)
+        n = len(os.listdir(carpeta))
+        ruta = os.path.join(carpeta, f"{n:05d}_{_RX_NOMBRE_SEGURO.sub('_', nombre or 'archivo')[:80]}")
+        origen.seek(0)
+        with open(ruta, "wb") as fh:
+            shutil.copyfileobj(origen, fh, 1 << 20)
+        return ruta
+
+    # ---------- ciclo de vida ----------
+
+    def nuevo(self, tipo: str, limitar: bool = True, perfilar: bool = False) -> Job:
+        """
+        Crea un Job (todavía sin tarea) para ir guardando sus entradas.
+        limitar=False: no cuenta el tope de la cola (peticiones síncronas).
+        perfilar=True: la tarea se ejecuta con profiling.perfila (id del perfil = id del Job).
+        """
+        self.purga()
+        if limitar and self.pendientes() >= self.max_en_cola:
+            raise ColaLlena(f"Hay {self.max_en_cola} trabajos pendientes; prueba en unos minutos")
+        job = Job(id=uuid.uuid4().hex, tipo=tipo, perfilar=perfilar)
+        os.makedirs(self._dir_job(job.id), exist_ok=True)
+        self._jobs[job.id] = job
+        return job
+
+    def descarta(self, job: Job) -> None:
+        """Olvida un Job que no llegó a lanzarse (p. ej. subida inválida)."""
+        self._jobs.pop(job.id, None)
+        shutil.rmtree(self._dir_job(job.id), ignore_errors=True)
+
+    def submit(self, job: Job, tarea: Tarea) -> Job:
+        """Lanza la tarea del Job en segundo plano (espera turno en el semáforo)."""
+        self._tareas[job.id] = asyncio.get_running_loop().create_task(self._ejecuta(job, tarea))
+        return job
+
+    async def wait(self, job: Job) -> Job:
+        await job._fin.wait()
+        return job
+
+    def _semaforo_del_loop(self) -> asyncio.Semaphore:
+        # Un semáforo por event loop (el de uvicorn; en tests puede haber varios)
+        loop = asyncio.get_running_loop()
+        if self._semaforo is None or self._semaforo[0] is not loop:
+            self._semaforo = (loop, asyncio.Semaphore(max(1, self.max_concurrentes)))
+        return self._semaforo[1]
+
+    def pendientes(self) -> int:
+        return sum(1 for j in self._jobs.values() if not j.acabado)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.purga()
+        return self._jobs.get(job_id)
+
+    async def _ejecuta(self, job: Job, tarea: Tarea) -> None:
+        try:
+            async with self._semaforo_del_loop():
+                job.estado = PROCESANDO
+                job.iniciado = time.time()
+                cola_s = job.iniciado - job.creado
+                metrics.observa("df_cola_segundos", cola_s, endpoint=job.tipo)
+                # Las etapas (metrics.etapa) de la tarea, también en hilos, se anotan en esta traza
+                with metrics.traza(job.tipo) as traza, profiling.perfila(job.id, job.tipo, job.perfilar) as perfil:
+                    try:
+                        resp = await tarea(job)
+                    except HTTPException as e:
+                        # Igual que la respuesta que generaría FastAPI
+                        resp = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+                    except Exception as e:
+                        resp = Response(
+                            content=f"Error interno: {type(e).__name__}: {e}",
+                            media_type="text/plain",
+                            status_code=500,
+                        )
+                if metrics.METRICS_SERVER_TIMING:
+                    resp.headers["Server-Timing"] = traza.server_timing(cola=cola_s)
+                if perfil is not None:
+                    resp.headers["X-Profile-Id"] = perfil.id
+                    resp.headers["X-Profile-Url"] = f"/api/perfiles/{perfil.id}"
+                self._guarda_resultado(job, resp)
+                estado = "ok" if resp.status_code < 400 else str(resp.status_code)
+                metrics.observa("df_job_segundos", time.time() - job.iniciado, endpoint=job.tipo, estado=estado)
+                metrics.cuenta("df_jobs_total", endpoint=job.tipo, estado=estado)
+        except asyncio.CancelledError:
+            job.estado, job.error = ERROR, "cancelado"
+            raise
+        finally:
+            job.terminado = time.time()
+            if not job.acabado:
+                job.estado = ERROR
+            shutil.rmtree(self.dir_entrada(job.id), ignore_errors=True)
+            self._tareas.pop(job.id, None)
+            job._fin.set()
+            job.emite("fin", job.as_dict())
+
+    def _guarda_resultado(self, job: Job, resp: Response) -> None:
+        with open(self.ruta_resultado(job.id), "wb") as fh:
+            fh.write(bytes(resp.body))
+        job.status_code = resp.status_code
+        job.media_type = resp.media_type
+        job.headers = {k: v for k, v in resp.headers.items() if k.lower() in _CABECERAS_GUARDADAS}
+        if resp.status_code >= 400:
+            job.estado = ERROR
+            job.error = bytes(resp.body).decode("utf-8", errors="replace")
+        else:
+            job.estado = TERMINADO
+            job.hechos, job.paso = job.total, "terminado"
+
+    # ---------- resultado ----------
+
+    def respuesta(self, job: Job) -> Response:
+        """La Response guardada del Job (mismo cuerpo, tipo y cabeceras que la original)."""
+        if job.entregado:
+            raise HTTPException(status_code=410, detail="El resultado ya se entregó en la respuesta síncrona")
+        with open(self.ruta_resultado(job.id), "rb") as fh:
+            contenido = fh.read()
+        headers = dict(job.headers)
+        headers["X-Job-Id"] = job.id
+        if os.path.exists(self.ruta_preview(job.id)):
+            headers["X-Preview-Url"] = f"/api/jobs/{job.id}/preview"
+        return Response(
+            content=contenido, media_type=job.media_type, status_code=job.status_code, headers=headers
+        )
+
+    def entrega(self, job: Job) -> Response:
+        """
+        Para los endpoints síncronos: la Response del Job (ya terminado) y se
+        borra su resultado del disco (el cliente se lo lleva en la propia
+        respuesta; no se guarda el Excel/JSON hasta que caduque). La vista previa
+        (X-Preview-Url, preview.json) se conserva y caduca con el Job (JOBS_TTL_S).
+        """
+        try:
+            return self.respuesta(job)
+        finally:
+            job.entregado = True
+            try:
+                os.remove(self.ruta_resultado(job.id))
+            except OSError:
+                pass
+
+    # ---------- caducidad ----------
+
+    def purga(self) -> List[str]:
+        """Borra los Jobs terminados hace más de ttl_s; devuelve sus ids."""
+        limite = time.time() - self.ttl_s
+        caducados = [j.id for j in self._jobs.values() if j.acabado and (j.terminado or 0) < limite]
+        for job_id in caducados:
+            self._jobs.pop(job_id, None)
+            shutil.rmtree(self._dir_job(job_id), ignore_errors=True)
+        return caducados
+
+    def _purga_carpeta_huerfana(self) -> None:
+        """Restos de ejecuciones anteriores del servidor (sus Jobs ya no existen)."""
+        limite = time.time() - self.ttl_s
+        for nombre in os.listdir(self.carpeta):
+            ruta = os.path.join(self.carpeta, nombre)
+            try:
+                if os.path.isdir(ruta) and os.path.getmtime(ruta) < limite:
+                    shutil.rmtree(ruta, ignore_errors=True)
+            except OSError:
+                pass
+
+    def shutdown(self) -> None:
+        for tarea in list(self._tareas.values()):
+            tarea.cancel()
@@ -0,0 +1,339 @@
+# layout_extractor.py
+# Motor de extracción "layout": importes emparejados por la posición de las
+# palabras en la página (pdfplumber extract_words) en vez de por regex.
+#
+# El motor de siempre ("texto") trabaja sobre extract_text() y reconstruye la
+# estructura con regex: importe tras la etiqueta en la misma línea o, para el
+# IVA, en las 3 líneas siguientes (_find_amount_below). Con los totales en
+# columnas eso falla:
+#     BASE IMPONIBLE    % IVA    CUOTA IVA    TOTAL
+#     10.000,00         21       2.100,00     12.100,00
+# (el texto solo ve "IVA" y una línea de números: sale IVA = 21). Aquí:
+#   1) cada página se lee UNA vez con extract_words() y se agrupa en renglones
+#      igual que lo hace extract_text(), así que el texto es idéntico y sirve a
+#      los dos motores (lee_pagina);
+#   2) índice espacial por página: renglones de arriba abajo, palabras ordenadas
+#      por x (bisect para ver qué cae bajo una columna);
+#   3) las etiquetas se reconocen palabra a palabra y gana la más larga ("TOTAL
+#      IVA" es IVA, no Total; "Subtotal" no es "Total"); cada una se empareja con
+#      el primer importe a su derecha en el mismo renglón o, si no hay, con el que
+#      tiene debajo en su misma columna (hasta 3 renglones);
+#   4) Proveedor, Fecha, nº de factura, Concepto, los fallbacks y las reglas de
+#      coherencia son los del extractor (extract_fields_from_text con importes=...).
+#
+# El motor se elige por petición (modo = texto | layout | auto) o por proveedor:
+# en "auto" van por layout solo los proveedores de PDF_LAYOUT_PROVEEDORES.
+
+from __future__ import annotations
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import re
+import unicodedata
+
+from pdfplumber.utils import DEFAULT_Y_TOLERANCE, cluster_objects
+
+from extractor import extract_fields_from_text, supplier_of
+
+MODOS = ("texto", "layout", "auto")
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# PDF_MODO_EXTRACCION:    motor por defecto (texto | layout | auto)
+# PDF_LAYOUT_PROVEEDORES: proveedores que en modo auto van por layout, separados
+#                         por ';' y escritos como salen en la columna Proveedor
+#                         (p. ej. "MOMENTUM ARQUITECTURA S.L.;TAUW IBERIA")
+PDF_MODO_EXTRACCION = os.environ.get("PDF_MODO_EXTRACCION", "auto").strip().lower()
+PDF_LAYOUT_PROVEEDORES = frozenset(
+    p.strip().upper() for p in os.environ.get("PDF_LAYOUT_PROVEEDORES", "").split(";") if p.strip()
+)
+if PDF_MODO_EXTRACCION not in MODOS:
+    raise ValueError(f"PDF_MODO_EXTRACCION debe ser uno de {', '.join(MODOS)}")
+
+
+# =========================
+# Páginas
+# =========================
+
+# (x0, x1, top, bottom, texto) de una palabra, en puntos desde arriba a la izquierda
+Palabra = Tuple[float, float, float, float, str]
+
+
+@dataclass
+class PaginaLayout:
+    """Palabras de una página agrupadas en renglones (de arriba abajo, en orden de lectura)."""
+    renglones: List[List[Palabra]]
+    texto: str = field(init=False)  # el mismo texto que daría page.extract_text()
+
+    def __post_init__(self) -> None:
+        self.texto = "\n".join(" ".join(p[4] for p in r) for r in self.renglones)
+
+
+def lee_pagina(page) -> PaginaLayout:
+    """Página de pdfplumber -> PaginaLayout (renglones agrupados como en extract_text)."""
+    palabras = page.extract_words()
+    renglones = cluster_objects(palabras, itemgetter("top"), DEFAULT_Y_TOLERANCE)
+    return PaginaLayout([[(w["x0"], w["x1"], w["top"], w["bottom"], w["text"]) for w in r] for r in renglones])
+
+
+# =========================
+# Etiquetas e importes
+# =========================
+
+# Por campo, de más a menos específica (el orden es la prioridad)
+ETIQUETAS: List[Tuple[Optional[str], List[str]]] = [
+    ("Total", ["Total factura euros", "Total factura", "Importe total", "Total a pagar",
+               "Total euros", "Total bruto", "Total amount", "Suman", "Total"]),
+    ("Base", ["Base imponible", "Total base", "Taxable base", "Subtotal", "Base", "Neto"]),
+    ("IVA", ["Total IVA", "Cuota IVA", "Importe IVA", "IVA", "VAT", "Impuesto"]),
+    ("IRPF", ["Retención IRPF", "Total IRPF", "Cuota IRPF", "IRPF", "Retención", "Withholding"]),
+    # Se reconocen para que no cuenten como otra etiqueta (su valor es un %)
+    (None, ["Tipo de IVA", "Tipo IVA", "Tipo de IRPF", "Tipo IRPF", "Tipo de retención"]),
+]
+CAMPOS = ("Total", "Base", "IVA", "IRPF")
+
+# Renglones por debajo de una etiqueta en los que se busca su valor (como _find_amount_below)
+_RENGLONES_DEBAJO = 3
+# Holgura horizontal (pt) al mirar si una palabra cae bajo la columna de una etiqueta
+_HOLGURA_COLUMNA = 2.0
+
+
+_RE_NO_ALNUM = re.compile(r"[^a-z0-9]+")
+_NEWLINE_RE = re.compile("\n")
+
+
+def _clave(texto: str) -> str:
+    """'Retención:' -> 'retencion'; 'I.V.A.' -> 'iva' (solo letras/dígitos, sin acentos)."""
+    t = texto.lower()
+    if not t.isascii():
+        t = unicodedata.normalize("NFKD", t).encode("ascii", "ignore").decode("ascii")
+    return _RE_NO_ALNUM.sub("", t)
+
+
+# clave -> (campo, prioridad dentro del campo)
+_ETIQUETAS: Dict[str, Tuple[Optional[str], int]] = {}
+for _campo, _lista in ETIQUETAS:
+    for _prio, _etq in enumerate(_lista):
+        _ETIQUETAS.setdefault(_clave(_etq), (_campo, _prio))
+# Prefijos de las claves, para dejar de alargar una etiqueta en cuanto no puede casar
+_PREFIJOS = {k[:i] for k in _ETIQUETAS for i in range(1, len(k) + 1)}
+# Renglones candidatos: una sola pasada de regex por página con el comienzo de
+# cada etiqueta ("tot", "i.v.a", ...); el resto de renglones ni se ordenan
+_RE_CANDIDATO = re.compile("|".join(sorted({r"\W*".join(map(re.escape, k[:3])) for k in _ETIQUETAS})))
+
+_RE_MONEDA = re.compile(r"(?i)^(?:€|eur(?:os?)?)|(?:€|eur(?:os?)?)$")
+_RE_IMPORTE = re.compile(r"^[\(\-]?\d+(?:[.,]\d{3})*(?:[.,]\d{1,2})?\)?$")
+_RE_MILES_CABEZA = re.compile(r"^[\(\-]?\d{1,3}$")
+_RE_MILES_COLA = re.compile(r"^\d{3}(?:[.,]\d{3})*(?:[.,]\d{1,2})?\)?$")
+
+
+def _a_float(texto: str) -> Optional[float]:
+    """'1.234,56' / '1,234.56' / '(1.234,56)' / '12.100' -> float (None si no es un importe)."""
+    s = _RE_MONEDA.sub("", texto.strip()).strip()
+    if not _RE_IMPORTE.match(s):
+        return None
+    negativo = s.startswith("-") or (s.startswith("(") and s.endswith(")"))
+    s = s.strip("()-")
+    coma, punto = s.rfind(","), s.rfind(".")
+    if coma >= 0 and punto >= 0:
+        # El último separador es el decimal
+        s = s.replace(".", "").replace(",", ".") if coma > punto else s.replace(",", "")
+    elif coma >= 0 or punto >= 0:
+        sep = "," if coma >= 0 else "."
+        partes = s.split(sep)
+        if len(partes) > 2 or len(partes[-1]) == 3:
+            s = "".join(partes)  # solo separador de miles: 12.100 / 1,234,567
+        else:
+            s = s.replace(",", ".")
+    valor = float(s)
+    return -valor if negativo else valor
+
+
+@dataclass
+class _Aparicion:
+    campo: Optional[str]
+    prioridad: int
+    pagina: int
+    renglon: int
+    ini: int  # palabras [ini, fin) del renglón
+    fin: int
+    x0: float
+    x1: float
+
+    @property
+    def orden(self) -> Tuple[int, int, int, int]:
+        # Primero las que abren renglón (como _find_amount_line_start), luego en orden de lectura
+        return (0 if self.ini == 0 else 1, self.pagina, self.renglon, self.ini)
+
+
+def _es_porcentaje(texto: str) -> bool:
+    """'%' / '(%)' sueltos (cabecera o sufijo de un número)."""
+    return "%" in texto and not any(c.isdigit() for c in texto)
+
+
+# =========================
+# Índice espacial
+# =========================
+
+class IndiceLayout:
+    """
+    Índice de las páginas de una factura: por página, renglones de arriba abajo
+    con sus palabras ordenadas por x (y sus x0 para bisect), más las apariciones
+    de etiquetas por campo. Se construye una vez y responde a los cuatro importes.
+    Solo se ordenan y se miran palabra a palabra los renglones candidatos
+    (_RE_CANDIDATO) y los que tienen debajo; sus importes, al consultarlos.
+    """
+
+    def __init__(self, paginas: List[PaginaLayout]):
+        self.paginas = paginas
+        self.apariciones: Dict[str, List[_Aparicion]] = {c: [] for c in CAMPOS}
+        self._ordenados: Dict[Tuple[int, int], List[Palabra]] = {}
+        self._inicios: Dict[Tuple[int, int], Dict[int, _Aparicion]] = {}
+        self._valores: Dict[Tuple[int, int], List[Optional[float]]] = {}
+        self._x0s: Dict[Tuple[int, int], List[float]] = {}
+        for p, pagina in enumerate(paginas):
+            texto = pagina.texto.lower()
+            inicios_renglon = [0] + [m.end() for m in _NEWLINE_RE.finditer(texto)]
+            candidatos = sorted({bisect_right(inicios_renglon, m.start()) - 1 for m in _RE_CANDIDATO.finditer(texto)})
+            for r in candidatos:
+                self._busca_etiquetas(p, r, self._palabras(p, r))
+
+    def _palabras(self, p: int, r: int) -> List[Palabra]:
+        """Palabras del renglón r de la página p, ordenadas por x."""
+        palabras = self._ordenados.get((p, r))
+        if palabras is None:
+            palabras = self._ordenados[(p, r)] = sorted(self.paginas[p].renglones[r], key=itemgetter(0))
+        return palabras
+
+    def _busca_etiquetas(self, p: int, r: int, palabras: List[Palabra]) -> None:
+        i = 0
+        n = len(palabras)
+        while i < n:
+            mejor: Optional[Tuple[int, Tuple[Optional[str], int]]] = None
+            clave = ""
+            for j in range(i, n):
+                c = _clave(palabras[j][4])
+                if not c:
+                    break
+                clave += c
+                if clave not in _PREFIJOS:
+                    break
+                if clave in _ETIQUETAS:
+                    mejor = (j + 1, _ETIQUETAS[clave])
+            if mejor is None:
+                i += 1
+                continue
+            fin, (campo, prioridad) = mejor
+            # "% IVA" / "IVA (%)": cabecera de un porcentaje, no de un importe
+            if (i > 0 and _es_porcentaje(palabras[i - 1][4])) or (fin < n and _es_porcentaje(palabras[fin][4])):
+                campo = None
+            ap = _Aparicion(campo, prioridad, p, r, i, fin, palabras[i][0], palabras[fin - 1][1])
+            self._inicios.setdefault((p, r), {})[i] = ap
+            if campo is not None:
+                self.apariciones[campo].append(ap)
+            i = fin
+
+    def _importes(self, p: int, r: int) -> List[Optional[float]]:
+        """Importe (no %) de cada palabra del renglón o None; '10' + '000,00' muy juntos = 10000."""
+        valores = self._valores.get((p, r))
+        if valores is None:
+            palabras = self._palabras(p, r)
+            valores = [None] * len(palabras)
+            k = 0
+            while k < len(palabras):
+                x0, x1, top, bottom, texto = palabras[k]
+                siguiente = palabras[k + 1] if k + 1 < len(palabras) else None
+                if "%" in texto or (siguiente is not None and _es_porcentaje(siguiente[4])):
+                    k += 1  # porcentaje, no importe
+                    continue
+                if (siguiente is not None and _RE_MILES_CABEZA.match(texto) and _RE_MILES_COLA.match(siguiente[4])
+                        and siguiente[0] - x1 < (bottom - top) * 0.6):
+                    valores[k] = _a_float(texto + siguiente[4])
+                    k += 2
+                    continue
+                valores[k] = _a_float(texto)
+                k += 1
+            self._valores[(p, r)] = valores
+        return valores
+
+    def a_la_derecha(self, ap: _Aparicion) -> Optional[float]:
+        """Primer importe (no %) a la derecha de la etiqueta, antes de la siguiente etiqueta."""
+        inicios = self._inicios[(ap.pagina, ap.renglon)]
+        valores = self._importes(ap.pagina, ap.renglon)
+        for k in range(ap.fin, len(valores)):
+            if k in inicios:
+                return None
+            if valores[k] is not None:
+                return valores[k]
+        return None
+
+    def debajo(self, ap: _Aparicion) -> Optional[float]:
+        """Importe (no %) bajo la columna de la etiqueta en los renglones siguientes."""
+        n_renglones = len(self.paginas[ap.pagina].renglones)
+        izq, der = ap.x0 - _HOLGURA_COLUMNA, ap.x1 + _HOLGURA_COLUMNA
+        for r in range(ap.renglon + 1, min(ap.renglon + 1 + _RENGLONES_DEBAJO, n_renglones)):
+            palabras = self._palabras(ap.pagina, r)
+            x0s = self._x0s.get((ap.pagina, r))
+            if x0s is None:
+                x0s = self._x0s[(ap.pagina, r)] = [w[0] for w in palabras]
+            # Palabras que solapan [izq, der]: las de x0 <= der, hacia atrás mientras x1 >= izq
+            hasta = bisect_right(x0s, der)
+            desde = hasta
+            while desde > 0 and palabras[desde - 1][1] >= izq:
+                desde -= 1
+            if desde == hasta:
+                continue
+            inicios = self._inicios.get((ap.pagina, r), {})
+            valores = self._importes(ap.pagina, r)
+            for k in range(desde, hasta):
+                if k in inicios:
+                    return None  # empieza otro bloque de etiquetas
+                if valores[k] is not None:
+                    return valores[k]
+        return None
+
+    def importe(self, campo: str) -> Optional[float]:
+        """Por prioridad de etiqueta: primero valores en el mismo renglón; si no, debajo."""
+        candidatas = sorted(self.apariciones[campo], key=lambda a: (a.prioridad, a.orden))
+        for buscar in (self.a_la_derecha, self.debajo):
+            for ap in candidatas:
+                valor = buscar(ap)
+                if valor is not None:
+                    return valor
+        return None
+
+
+def importes_layout(paginas: List[PaginaLayout]) -> Tuple[Optional[float], ...]:
+    """(Total, Base, IVA, IRPF) localizados por geometría (None si no aparecen)."""
+    indice = IndiceLayout(paginas)
+    return tuple(indice.importe(c) for c in CAMPOS)
+
+
+# =========================
+# Selección de motor
+# =========================
+
+def valida_modo(modo: Optional[str]) -> str:
+    """None / "" -> PDF_MODO_EXTRACCION; ValueError si no es un modo conocido."""
+    modo = (modo or PDF_MODO_EXTRACCION).strip().lower()
+    if modo not in MODOS:
+        raise ValueError(f"modo debe ser uno de {', '.join(MODOS)}")
+    return modo
+
+
+def extract_fields(paginas: List[PaginaLayout], filename: str, modo: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Como extractor.extract_from_pages, pero con el motor de `modo`:
+    texto (regex sobre el texto), layout (importes por geometría) o auto
+    (layout si el proveedor detectado está en PDF_LAYOUT_PROVEEDORES).
+    """
+    modo = valida_modo(modo)
+    texto = "\n".join(t for t in (p.texto for p in paginas) if t.strip())
+    if modo == "auto":
+        proveedor = supplier_of(texto) if PDF_LAYOUT_PROVEEDORES else None
+        modo = "layout" if proveedor and proveedor.strip().upper() in PDF_LAYOUT_PROVEEDORES else "texto"
+    importes = importes_layout(paginas) if modo == "layout" else None
+    return extract_fields_from_text(texto, filename, importes=importes)
@@ -1,19 +1,51 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Response, Request
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Response, Request
 
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import BinaryIO, List
 from urllib.parse import quote
-import io
+import asyncio
 import json
+import os
+import numpy as np
 import pandas as pd
-import pdfplumber
-from extractor import extract_from_pages
-from datetime import datetime
-from bankflow_rules import process_bankflow  # ← Usamos el pipeline completo
+from bankflow_rules import classifier_cache_stats, process_bankflow, remesa_row_mask  # ← Usamos el pipeline completo
+from eu_parsing import columna_texto, parsing_cache_stats, to_date_ddmmyyyy_col, to_float_eu, to_float_eu_col
+from extraction_cache import ExtractionCache
+from invoice_codes import AmountIndex, InvoiceIndex, match_content, match_filenames
+from jobs import ColaLlena, Job, JobManager
+from layout_extractor import valida_modo
+import metrics
+import profiling
+from pdf_parser import COLUMNAS_FACTURA
+from pdf_pool import ExtractionPool, PdfExtractionError
+from preview import PREVIEW_MAX_FILAS, cabecera as preview_cabecera, formatea as preview_formatea
+from tabular_reader import read_csv_stream, read_excel_stream
+from xlsx_writer import SheetStyle, column_widths, eu_number_width, text_width, to_xlsx_bytes
 import uvicorn
 
 app = FastAPI()
 
+# Pool de procesos para extraer PDFs en paralelo (ver pdf_pool.py)
+pdf_pool = ExtractionPool()
+# Caché por contenido (SHA-256 del PDF + versión de reglas) (ver extraction_cache.py)
+pdf_cache = ExtractionCache()
+# Peticiones perfiladas (ver profiling.py): sus PDFs se extraen en un hilo del
+# servidor y sin caché, para que ese trabajo quede dentro del perfil
+pdf_pool_perfil = ExtractionPool(max_workers=0)
+
+
+# Trabajos en segundo plano: cola, progreso y resultados en disco (ver jobs.py)
+jobs = JobManager()
+
+
+@app.on_event("shutdown")
+def _shutdown_pdf_pool():
+    jobs.shutdown()
+    pdf_pool.shutdown()
+    pdf_pool_perfil.shutdown()
+    pdf_cache.close()
+
 # CORS para que Blazor pueda llamar al servicio en local
 app.add_middleware(
     CORSMiddleware,
@@ -40,7 +72,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition", "X-Preview"],
+    expose_headers=["Content-Disposition", "X-Preview", "X-Preview-Url", "X-Job-Id", "Server-Timing", "X-Profile-Id", "X-Profile-Url"],
 )
 
 
@@ -82,98 +114,44 @@ def _fmt_eur(v):
     except Exception:
         return str(v) if v is not None else "—"
 
+def _fila_preview_pdf(nombre: str, fila: dict) -> dict:
+    """Fila de la vista previa de pdf2excel (X-Preview y eventos del streaming)."""
+    return {
+        "Archivo": _clip(_short_name(nombre, 27), 27),     # <= 27
+        "OCR": "—",
+        "Proveedor": _clip(fila.get("Proveedor"), 27),     # <= 27
+        "Fecha": fila.get("Fecha"),
+        "Invoice": fila.get("Invoice"),
+        "Concepto": fila.get("Concepto"),
+        "Total Neto": _fmt_eur(fila.get("Neto")),
+        "IVA €": _fmt_eur(fila.get("IVA")),
+        "IRPF": _fmt_eur(fila.get("IRPF")),
+        "Total Bruto": _fmt_eur(fila.get("Importe Bruto")),
+    }
+
 # ==== Helpers BankFlow Pro ====
 
 
-def _read_tabular(upload: UploadFile) -> pd.DataFrame:
+def _read_tabular(filename: str, fh: BinaryIO) -> pd.DataFrame:
     """
     Lee CSV o Excel y devuelve un DataFrame (todo en str).
-    CSV: prueba separador ';' y luego ','.
-    Excel: detecta la fila de encabezados por contenido,
-           para saltar metadatos (logo, titular, cuenta, etc.).
+    CSV: deduce codificación y separador y lo lee por bloques (tabular_reader).
+    Excel: detecta la fila de encabezados por contenido (primeras 30 filas),
+           para saltar metadatos (logo, titular, cuenta, etc.), en streaming.
     """
-    name = (upload.filename or "").lower()
-    raw = upload.file.read()
-    bio = io.BytesIO(raw)
+    name = (filename or "").lower()
 
     if name.endswith(".csv"):
-        try:
-            df = pd.read_csv(bio, sep=";", dtype=str, encoding="utf-8", engine="python")
-        except Exception:
-            bio.seek(0)
-            df = pd.read_csv(bio, sep=",", dtype=str, encoding="utf-8", engine="python")
-        return df.fillna("")
+        return read_csv_stream(fh)
     else:
         # Excel con posibles filas de metadatos arriba
-        try:
-            xls = pd.ExcelFile(bio, engine="openpyxl")
-        except Exception as e:
-            raise RuntimeError(f"Lectura Excel falló: {type(e).__name__}: {e}")
-
-        import unicodedata
-
-        def _norm_cell(x: str) -> str:
-            s = str(x or "").strip().lower()
-            s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
-            return s.replace("\n", " ").replace("\r", " ")
-
-        def _find_header_row(df_nohdr: pd.DataFrame) -> int | None:
-            """
-            Busca la fila de cabecera detectando patrones:
-            1. Extracto: (fecha + concepto + importe)
-            2. Remesa: (importe + (beneficiario/proveedor/nombre o concepto))
-            """
-            MAX_SCAN = min(30, len(df_nohdr))
-            for i in range(MAX_SCAN):
-                row_vals = [_norm_cell(v) for v in df_nohdr.iloc[i].tolist()]
-                if not any(row_vals):
-                    continue
-                
-                # --- Detectar palabras clave ---
-                has_fecha = any("fecha" in v for v in row_vals)
-                has_concepto = any("concepto" in v for v in row_vals)
-                has_importe = any("importe" in v for v in row_vals)
-                
-                # Palabras clave de Remesa (Beneficiario/Proveedor)
-                has_beneficiario = any(
-                    any(k in v for k in ["beneficiario", "proveedor", "nombre", "destinatario"]) 
-                    for v in row_vals
-                )
-                
-                # --- Comprobar patrones ---
-                
-                # Patrón 1: Extracto bancario
-                if has_fecha and has_concepto and has_importe:
-                    return i
-                    
-                # Patrón 2: Detalle de remesa
-                if has_importe and (has_beneficiario or has_concepto):
-                    return i
-                    
-            return None # No se encontró ninguna cabecera conocida
-
-        # Recorre hojas y detecta cabecera por contenido
-        for sheet in xls.sheet_names:
-            try:
-                tmp = xls.parse(sheet_name=sheet, header=None, dtype=str)
-            except Exception:
-                continue
-
-            hdr_row = _find_header_row(tmp)
-            if hdr_row is not None:
-                try:
-                    # Lee el archivo usando la fila de cabecera detectada
-                    df = xls.parse(sheet_name=sheet, header=hdr_row, dtype=str)
-                    if df.shape[1] >= 2: # Solo necesita 2+ columnas
-                        return df.fillna("") # Devuelvefillna("") aquí
-                except Exception:
-                    continue
+        return read_excel_stream(fh)
 
-        # Fallback: primera hoja tal cual (probablemente fallará pero es el último recurso)
-        try:
-            return xls.parse(xls.sheet_names[0], dtype=str).fillna("")
-        except Exception as e:
-            raise RuntimeError(f"Excel parse sin cabecera también falló: {type(e).__name__}: {e}")
+
+def _read_tabular_ruta(filename: str, ruta: str) -> pd.DataFrame:
+    """_read_tabular de un archivo ya guardado en disco (entrada de un Job)."""
+    with open(ruta, "rb") as fh:
+        return _read_tabular(filename, fh)
 
 
 def _norm_colnames(df: pd.DataFrame) -> pd.DataFrame:
@@ -197,40 +175,52 @@ def _find_col(df: pd.DataFrame, candidates: list[str]) -> str | None:
     return None
 
 
-def _to_date_ddmmyyyy(txt: str) -> str:
-    if not txt or str(txt).strip() == "":
-        return ""
-    t = str(txt).strip()
-    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d"):
-        try:
-            return datetime.strptime(t, fmt).strftime("%d/%m/%Y")
-        except Exception:
-            continue
-    try:
-        d = pd.to_datetime(t, dayfirst=True, errors="coerce")
-        if pd.notna(d):
-            return d.strftime("%d/%m/%Y")
-    except Exception:
-        pass
-    return t
+# ==== Normalización del extracto (por columnas, ver eu_parsing.py) ====
+
+_SIGNO_NEG = ["d", "debe", "cargo", "-", "debito", "débito"]
+_SIGNO_POS = ["h", "haber", "abono", "+", "credito", "crédito"]
 
 
-def _to_float_eu(txt: str) -> float | None:
-    if txt is None:
-        return None
-    s = str(txt).strip().replace("€", "").replace("EUR", "").replace(" ", "")
-    # 1.234,56 -> 1234.56
-    if "." in s and "," in s and s.rfind(",") > s.rfind("."):
-        s = s.replace(".", "").replace(",", ".")
+def _normaliza_extracto(
+    ext_df: pd.DataFrame,
+    col_fecha: str,
+    col_concepto: str,
+    col_importe: str | None,
+    col_cargo: str | None,
+    col_abono: str | None,
+    col_signo: str | None,
+) -> pd.DataFrame:
+    """
+    Extracto leído -> DataFrame canónico de BankFlow (Fecha dd/mm/aaaa, Concepto,
+    Importe con signo, resto de columnas a 0) en un paso, por columnas:
+    Importe = abono - cargo si hay doble columna; si no, el importe con el
+    signo corregido según la columna de signo (D/H, cargo/abono, -/+...).
+    """
+    if col_cargo or col_abono:
+        cargo = to_float_eu_col(columna_texto(ext_df, col_cargo)) if col_cargo else 0.0
+        abono = to_float_eu_col(columna_texto(ext_df, col_abono)) if col_abono else 0.0
+        imp = abono - cargo
+    elif col_importe:
+        imp = to_float_eu_col(columna_texto(ext_df, col_importe))
+        if col_signo:
+            signo = columna_texto(ext_df, col_signo).str.strip().str.lower()
+            neg = signo.isin(_SIGNO_NEG).to_numpy(dtype=bool)
+            pos = signo.isin(_SIGNO_POS).to_numpy(dtype=bool)
+            imp = np.where(neg & (imp > 0), -imp, imp)
+            imp = np.where(pos & (imp < 0), -imp, imp)
     else:
-        s = s.replace(",", ".")
-    try:
-        return float(s)
-    except Exception:
-        try:
-            return float(s.replace(".", "").replace(",", "."))
-        except Exception:
-            return None
+        imp = np.zeros(len(ext_df))
+
+    return pd.DataFrame({
+        "Fecha": to_date_ddmmyyyy_col(columna_texto(ext_df, col_fecha)).tolist(),
+        "Concepto": columna_texto(ext_df, col_concepto).tolist(),
+        "Tipo": "",
+        "Importe": imp,
+        "Comisión": 0.0,
+        "IVA": 0.0,
+        "IRPF": 0.0,
+        "Importe Neto": imp,  # <-- Nueva columna final es Importe Neto
+    }, columns=["Fecha", "Concepto", "Tipo", "Importe", "Comisión", "IVA", "IRPF", "Importe Neto"])
 
 
 def _fmt_eu(v: float | None) -> str:
@@ -238,168 +228,253 @@ def _fmt_eu(v: float | None) -> str:
         return ""
     return f"{v:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
-# =========================
-# Parser
-# =========================
-def parse_pdf_to_df(pdf_bytes: bytes, nombre_archivo: str) -> pd.DataFrame:
-    """
-    Usa el extractor estable (Neto + IVA + IRPF = Importe Bruto, tolerancia ±0,05),
-    corrige el patrón “21,00 % I.V.A. s/…”, y limpia incoherencias.
-    """
-    # Extraer textos de todas las páginas
-    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-        pages_texts = []
-        for p in pdf.pages:
-            t = p.extract_text() or ""
-            if t.strip():
-                pages_texts.append(t)
-
-    # Pasar por el extractor
-    fields = extract_from_pages(pages_texts, nombre_archivo)
-
-    # Normalizar nombres
-    row = {
-        "Proveedor": fields.get("Proveedor"),
-        "Fecha": fields.get("Fecha"),
-        "Invoice": fields.get("Invoice") or fields.get("Factura") or fields.get("Nº factura"),
-        "Concepto": fields.get("Concepto"),
-        "Neto": fields.get("Neto"),
-        "IVA": fields.get("IVA"),
-        "IRPF": fields.get("IRPF"),
-        "Importe Bruto": fields.get("Importe bruto") or fields.get("Total Bruto") or fields.get("Bruto"),
-    }
+# ==== Helpers Jobs ====
+
+
+async def _guarda_subida(job: Job, upload: UploadFile) -> tuple[str, str]:
+    """Copia un archivo subido a la entrada del Job (por trozos, en un hilo): (nombre, ruta)."""
+    return upload.filename, await asyncio.to_thread(jobs.guarda_entrada, job, upload.filename, upload.file)
+
 
-    cols = ["Proveedor", "Fecha", "Invoice", "Concepto", "Neto", "IVA", "IRPF", "Importe Bruto"]
-    return pd.DataFrame([row], columns=cols)
+def _pon_cabecera_preview(headers: dict, preview: dict) -> None:
+    """X-Preview (primeras filas que quepan); la vista previa completa está en /api/jobs/{id}/preview."""
+    # ensure_ascii=True evita problemas de codificación en cabeceras
+    texto = preview_cabecera(preview)
+    if texto is not None:
+        headers["X-Preview"] = texto
+
+
+def _lee_bytes(ruta: str) -> bytes:
+    with open(ruta, "rb") as fh:
+        return fh.read()
+
+
+def _lee_archivos(rutas: list[tuple[str, str]]) -> list[tuple[str, bytes]]:
+    """[(nombre, ruta), ...] guardadas con el Job -> [(nombre, bytes), ...]."""
+    return [(nombre, _lee_bytes(ruta)) for nombre, ruta in rutas]
 
 # =========================
 # Endpoint principal
 # =========================
 @app.post("/api/pdf2excel")
-async def pdf2excel(file: List[UploadFile] = File(...)):
+async def pdf2excel(
+    file: List[UploadFile] = File(...),
+    modo: str | None = Form(None),
+    x_profile: str | None = Header(None),
+):
     """
     Acepta uno o varios PDFs y devuelve un Excel + cabecera 'X-Preview'.
+    `modo` = motor de extracción: texto | layout | auto (ver layout_extractor.py).
+    Cabecera 'X-Profile: 1' (con PROFILING_ACTIVO=1): ejecuta perfilado (ver profiling.py).
+    (Versión síncrona de /api/jobs/pdf2excel: espera a que acabe el Job.)
     """
-    if not file:
-        raise HTTPException(status_code=400, detail="Sube al menos un PDF")
+    job = await _crea_job_pdf2excel(file, modo, limitar=False, perfilar=profiling.pedido(x_profile))
+    return jobs.entrega(await jobs.wait(job))
 
-    dfs: list[pd.DataFrame] = []
-    for f in file:
-        if not f.filename.lower().endswith(".pdf"):
-            raise HTTPException(status_code=400, detail=f"'{f.filename}' no es un PDF")
 
-        contenido = await f.read()
-        if not contenido:
-            raise HTTPException(status_code=400, detail=f"'{f.filename}' está vacío")
+@app.post("/api/pdf2excel/stream")
+async def pdf2excel_stream(file: List[UploadFile] = File(...), modo: str | None = Form(None)):
+    """
+    Como /api/pdf2excel, pero en streaming (Server-Sent Events, text/event-stream):
+      event: inicio  -> {"id", "Archivos"}
+      event: fila    -> {"Indice", ...mismos campos que una fila de X-Preview}
+      event: error   -> {"Indice", "Archivo", "Error"} (ese PDF no se pudo leer)
+      event: fin     -> estado del Job; el Excel se descarga de "url_resultado"
+    Cada 'fila' sale en cuanto termina su PDF (orden de finalización; "Indice"
+    es la posición en la subida).
+    """
+    job = await _crea_job_pdf2excel(file, modo, limitar=False)
+    cola = job.escucha()  # sin await desde submit: no se pierde ningún evento
 
+    async def eventos():
         try:
-            df = parse_pdf_to_df(contenido, f.filename)
-            # Añadimos columna Archivo (nombre completo) para Excel;
-            # y versión recortada para vista previa
-            df["Archivo"] = f.filename
-            df["ArchivoPreview"] = _short_name(f.filename, 27)
-            dfs.append(df)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error leyendo '{f.filename}': {e}")
+            yield _sse("inicio", {"id": job.id, "Archivos": len(file)})
+            while True:
+                evento, datos = await cola.get()
+                yield _sse(evento, datos)
+                if evento == "fin":
+                    break
+        finally:
+            job.deja_de_escuchar(cola)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Job-Id": job.id},
+    )
+
+
+def _sse(evento: str, datos: dict) -> bytes:
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def _crea_job_pdf2excel(
+    file: List[UploadFile], modo: str | None, limitar: bool, perfilar: bool = False
+) -> Job:
+    if not file:
+        raise HTTPException(status_code=400, detail="Sube al menos un PDF")
+    try:
+        modo = valida_modo(modo)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = jobs.nuevo("pdf2excel", limitar=limitar, perfilar=perfilar)
+    archivos: list[tuple[str, str]] = []
+    try:
+        for f in file:
+            if not f.filename.lower().endswith(".pdf"):
+                raise HTTPException(status_code=400, detail=f"'{f.filename}' no es un PDF")
+
+            nombre, ruta = await _guarda_subida(job, f)
+            if os.path.getsize(ruta) == 0:
+                raise HTTPException(status_code=400, detail=f"'{f.filename}' está vacío")
+            archivos.append((nombre, ruta))
+    except BaseException:
+        jobs.descarta(job)
+        raise
+    return jobs.submit(job, lambda j: _pdf2excel_job(j, archivos, modo))
+
+
+async def _pdf2excel_job(job: Job, rutas: list[tuple[str, str]], modo: str) -> Response:
+    with metrics.etapa("lectura_entrada"):
+        archivos = await asyncio.to_thread(profiling.en_hilo(_lee_archivos), rutas)
+    metrics.cuenta("df_archivos_total", len(archivos))
+
+    # Extracción en paralelo (pool de procesos); cada archivo se anuncia (evento
+    # 'fila' o 'error') según termina, y las filas se colocan en orden de subida
+    total = len(archivos) + 1
+    job.avanza(0, total, "extrayendo PDFs")
+    filas: list = [None] * len(archivos)
+    hechos = 0
+    pool, cache = _extraccion()
+    with metrics.etapa("extraccion"):
+        async for i, fila in pool.iter_extract(archivos, cache=cache, modo=modo):
+            filas[i] = fila
+            hechos += 1
+            job.avanza(hechos, total)
+            nombre = archivos[i][0]
+            if isinstance(fila, PdfExtractionError):
+                job.emite("error", {"Indice": i, "Archivo": nombre, "Error": str(fila)})
+            else:
+                job.emite("fila", {"Indice": i, **_fila_preview_pdf(nombre, fila)})
+
+    for e in filas:
+        if isinstance(e, PdfExtractionError):
+            raise HTTPException(status_code=500, detail=f"Error leyendo '{e.nombre}': {e}")
+    job.avanza(len(archivos), total, "generando Excel")
+
+    # Excel y vista previa son CPU (pandas/xlsxwriter): en un hilo, para no bloquear el event loop
+    return await asyncio.to_thread(
+        profiling.en_hilo(_pdf2excel_resultado), job, [nombre for nombre, _ in archivos], filas
+    )
 
-    df_total = pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
+
+def _pdf2excel_resultado(job: Job, nombres: list[str], filas: list[dict]) -> Response:
+    df_total = pd.DataFrame(filas, columns=COLUMNAS_FACTURA)
+    # Añadimos columna Archivo (nombre completo) para Excel
+    df_total["Archivo"] = nombres
 
     # ====== Generar Excel ======
-    out = io.BytesIO()
-    with pd.ExcelWriter(out, engine="openpyxl") as w:
-        # Orden de columnas para Excel (incluimos Archivo completo)
-        cols = [
-            "Archivo",
-            "Proveedor",
-            "Fecha",
-            "Invoice",
-            "Concepto",
-            "Neto",
-            "IVA",
-            "IRPF",
-            "Importe Bruto",
+    # Orden de columnas para Excel (incluimos Archivo completo)
+    cols = [
+        "Archivo",
+        "Proveedor",
+        "Fecha",
+        "Invoice",
+        "Concepto",
+        "Neto",
+        "IVA",
+        "IRPF",
+        "Importe Bruto",
+    ]
+    df_excel = df_total.reindex(columns=cols)
+
+    # Formato bonito: cabecera azul, bordes finos, números a la derecha y
+    # formato europeo (€ con punto de miles y coma decimal) en Neto..Importe Bruto
+    euro_fmt = '#,##0.00 [$€-40C]'
+    celda = {"border": 1, "valign": "vcenter"}
+    estilo = SheetStyle(
+        header={**celda, "bold": True, "font_color": "#FFFFFF", "pattern": 1, "bg_color": "#4F81BD", "align": "left"},
+        number_formats=[
+            {**celda, "align": "right", **({"num_format": euro_fmt} if c in ("Neto", "IVA", "IRPF", "Importe Bruto") else {})}
+            for c in cols
+        ],
+        text_formats=[{**celda, "align": "left"} for _ in cols],
+        widths=column_widths(df_excel, text_width, extra=4),
+    )
+    with metrics.etapa("excel"):
+        xlsx_bytes = to_xlsx_bytes([(df_excel, "Facturas", estilo)])
+
+    # ====== Vista previa (se guarda con el Job; X-Preview lleva las primeras filas) ======
+    with metrics.etapa("preview"):
+        preview_rows = [
+            _fila_preview_pdf(nombre, fila) for nombre, fila in zip(nombres[:PREVIEW_MAX_FILAS], filas)
         ]
-        df_excel = df_total.reindex(columns=cols)
-        df_excel.to_excel(w, index=False, sheet_name="Facturas")
-
-        # Formato bonito
-        from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-
-        wb = w.book
-        ws = wb["Facturas"]
-
-        # Formato numérico europeo (€ con punto de miles y coma decimal)
-        euro_fmt = '#,##0.00 [$€-40C]'
-        for col in ["F", "G", "H", "I"]:  # Neto, IVA, IRPF, Importe Bruto
-            for cell in ws[col]:
-                if isinstance(cell.value, (int, float)):
-                    cell.number_format = euro_fmt
-
-        # Quitar cuadrícula
-        ws.sheet_view.showGridLines = False
-
-        # Estilos encabezado
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill("solid", fgColor="4F81BD")
-        center_align = Alignment(horizontal="center", vertical="center")
-        thin_border = Border(
-            left=Side(style="thin"), right=Side(style="thin"),
-            top=Side(style="thin"), bottom=Side(style="thin")
-        )
-        for cell in ws[1]:
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = center_align
-            cell.border = thin_border
-
-        # Ajuste de ancho y bordes/alineación general
-        for col_cells in ws.columns:
-            max_len = 0
-            col_letter = col_cells[0].column_letter
-            for cell in col_cells:
-                val = "" if cell.value is None else str(cell.value)
-                if len(val) > max_len:
-                    max_len = len(val)
-                # Bordes + alineación por tipo
-                cell.border = thin_border
-                if isinstance(cell.value, (int, float)):
-                    cell.alignment = Alignment(horizontal="right", vertical="center")
-                else:
-                    cell.alignment = Alignment(horizontal="left", vertical="center")
-            ws.column_dimensions[col_letter].width = max_len + 4
-
-    xlsx_bytes = out.getvalue()
-
-    # ====== Vista previa (máx. 50 filas) ======
-    preview_rows = []
-    for _, r in df_total.head(50).iterrows():
-        preview_rows.append({
-            "Archivo": _clip(r.get("ArchivoPreview"), 27),     # <= 27
-            "OCR": "—",
-            "Proveedor": _clip(r.get("Proveedor"), 27),        # <= 27
-            "Fecha": r.get("Fecha"),
-            "Invoice": r.get("Invoice"),
-            "Concepto": r.get("Concepto"),
-            "Total Neto": _fmt_eur(r.get("Neto")),
-            "IVA €": _fmt_eur(r.get("IVA")),
-            "IRPF": _fmt_eur(r.get("IRPF")),
-            "Total Bruto": _fmt_eur(r.get("Importe Bruto")),
-        })
-
-    preview = {"Filas": int(len(df_total)), "Muestra": preview_rows}
+
+        preview = {"Filas": int(len(df_total)), "Muestra": preview_rows}
+        jobs.guarda_preview(job, preview)
 
     # ====== Nombre de salida ======
-    base = (file[0].filename if file else "archivo.pdf").rsplit(".", 1)[0]
+    base = (nombres[0] if nombres else "archivo.pdf").rsplit(".", 1)[0]
     out_name = f"Desglose_{base}.xlsx"
     content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
     headers = {
         "Content-Disposition": f'attachment; filename="{out_name}"; filename*=UTF-8\'\'{quote(out_name)}',
-        # ensure_ascii=True evita problemas de codificación en cabeceras
-        "X-Preview": json.dumps(preview, ensure_ascii=True),
     }
+    _pon_cabecera_preview(headers, preview)
 
     return Response(content=xlsx_bytes, media_type=content_type, headers=headers)
+
+
+def _extraccion() -> tuple[ExtractionPool, ExtractionCache | None]:
+    """Pool y caché para extraer PDFs (sin caché y en el propio proceso si se está perfilando)."""
+    if profiling.perfil_actual() is not None:
+        return pdf_pool_perfil, None
+    return pdf_pool, pdf_cache
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Contadores de las cachés: extracción de PDFs, clasificador de BankFlow y parseo de importes/fechas."""
+    return {"extraccion": pdf_cache.stats(), "clasificador": classifier_cache_stats(), "parseo": parsing_cache_stats()}
+
+
+def _metricas_servicio() -> list:
+    """Cachés y cola de Jobs para /metrics (se leen al exportar, no se duplican contadores)."""
+    ext = pdf_cache.stats()
+    muestras = [
+        ("df_cache_extraccion_hits_total", "counter", "Aciertos de la caché de extracción de PDFs",
+         {"nivel": "memoria"}, ext["hits_memoria"]),
+        ("df_cache_extraccion_hits_total", "counter", "Aciertos de la caché de extracción de PDFs",
+         {"nivel": "disco"}, ext["hits_disco"]),
+        ("df_cache_extraccion_misses_total", "counter", "Fallos de la caché de extracción de PDFs", {}, ext["misses"]),
+        ("df_cache_extraccion_entradas", "gauge", "Entradas en la caché de extracción de PDFs",
+         {"nivel": "memoria"}, ext["entradas_memoria"]),
+        ("df_cache_extraccion_entradas", "gauge", "Entradas en la caché de extracción de PDFs",
+         {"nivel": "disco"}, ext["entradas_disco"]),
+    ]
+    memos = {
+        **{f"clasificador_{k}": v for k, v in classifier_cache_stats().items()},
+        **{f"parseo_{k}": v for k, v in parsing_cache_stats().items()},
+    }
+    for campo, nombre, ayuda in (
+        ("hits", "df_cache_memo_hits_total", "Aciertos de las cachés en memoria (lru_cache)"),
+        ("misses", "df_cache_memo_misses_total", "Fallos de las cachés en memoria (lru_cache)"),
+    ):
+        muestras.extend((nombre, "counter", ayuda, {"cache": cache}, stats[campo]) for cache, stats in memos.items())
+    muestras.append(("df_jobs_pendientes", "gauge", "Jobs en cola o procesándose", {}, jobs.pendientes()))
+    return muestras
+
+
+metrics.registra_colector(_metricas_servicio)
+
+
+@app.get("/metrics")
+async def metricas():
+    """Métricas del servicio en formato texto de Prometheus (ver metrics.py)."""
+    return Response(content=metrics.exporta(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # =========================
 # Endpoint BankFlow Pro
 # =========================
@@ -411,42 +486,6 @@ async def pdf2excel(file: List[UploadFile] = File(...)):
 from fastapi import UploadFile
 import re
 
-def _norm_invoice_code(s: str | None) -> str:
-    """
-    Normaliza códigos de factura sin destruir su estructura.
-    - Conserva dígitos largos (3020014885)
-    - Une letras+números (MA1391)
-    - Quita solo ruido textual tipo 'Factura', 'Nº', 'Invoice', etc.
-    """
-    if not s:
-        return ""
-    import re
-    t = str(s).upper().strip()
-
-    # 1️⃣ Eliminar prefijos inútiles
-    t = re.sub(r"\b(FACTURA|FAC|N[ºO]?|INVOICE|NO|NUMERO|NÚMERO|DOC|DOCUMENTO|S/FRA\.?)\b", "", t)
-
-    # 2️⃣ Mantener solo letras, números y separadores simples
-    t = re.sub(r"[^A-Z0-9\-/]", "", t)
-
-    # 3️⃣ Simplificar secuencias repetidas de separadores
-    t = re.sub(r"[-/]{2,}", "-", t)
-
-    # 4️⃣ Eliminar separadores iniciales o finales
-    t = t.strip("-/")
-
-    # 5️⃣ Casos comunes: “MA-1391”, “MA 1391”, “24-25/MA//1391” → MA1391, 1391, 2425MA1391
-    m = re.search(r"([A-Z]{1,5})[-/]?(\d{2,6})", t)
-    if m:
-        return f"{m.group(1)}{m.group(2)}"
-
-    # 6️⃣ Si son solo dígitos largos
-    if re.fullmatch(r"\d{6,}", t):
-        return t
-
-    # 7️⃣ Si nada cuadra, devuélvelo limpio
-    return t
-
 def _pick_invoice_columns(df: pd.DataFrame) -> list[str]:
     """
     Detecta columnas que probablemente contengan números de factura:
@@ -487,7 +526,7 @@ def _pick_amount_columns(df: pd.DataFrame) -> list[str]:
 def _first_amount_in_row(row: pd.Series, cols: list[str]) -> float | None:
     for c in cols:
         v = row.get(c, None)
-        n = _to_float_eu(v) if v is not None else None
+        n = to_float_eu(v) if v is not None else None
         if n is not None:
             return n
     return None
@@ -497,13 +536,95 @@ def _first_amount_in_row(row: pd.Series, cols: list[str]) -> float | None:
 async def contraste_facturas(
     pendientes: UploadFile = File(...),
     facturas: List[UploadFile] = File(...),
+    todas_columnas: bool = Form(False),
+    por_contenido: bool = Form(False),
+    tolerancia_importe: float = Form(0.05),
+    x_profile: str | None = Header(None),
 ):
-    import re
+    """
+    Contrasta PDFs de facturas con el Excel de pendientes.
+    Por defecto solo mira el NOMBRE de cada PDF; con por_contenido=true, los que
+    no casen por nombre se abren (pool + caché de extracción) y se buscan por
+    nº de factura, importe (± tolerancia_importe) y proveedor.
+    (Versión síncrona de /api/jobs/contraste-facturas: espera a que acabe el Job.)
+    """
+    job = await _crea_job_contraste(
+        pendientes, facturas, todas_columnas, por_contenido, tolerancia_importe, limitar=False,
+        perfilar=profiling.pedido(x_profile),
+    )
+    return jobs.entrega(await jobs.wait(job))
+
+
+async def _crea_job_contraste(
+    pendientes: UploadFile,
+    facturas: List[UploadFile],
+    todas_columnas: bool,
+    por_contenido: bool,
+    tolerancia_importe: float,
+    limitar: bool,
+    perfilar: bool = False,
+) -> Job:
+    job = jobs.nuevo("contraste-facturas", limitar=limitar, perfilar=perfilar)
+    try:
+        pend = await _guarda_subida(job, pendientes)
+        pdfs = [await _guarda_subida(job, f) for f in facturas]
+    except BaseException:
+        jobs.descarta(job)
+        raise
+    return jobs.submit(
+        job, lambda j: _contraste_job(j, pend, pdfs, todas_columnas, por_contenido, tolerancia_importe)
+    )
+
+
+async def _contraste_job(
+    job: Job,
+    pendientes: tuple[str, str],
+    facturas: list[tuple[str, str]],
+    todas_columnas: bool,
+    por_contenido: bool,
+    tolerancia_importe: float,
+) -> Response:
+    # Lectura del Excel, índices y cotejos son CPU (pandas): en hilos, para no
+    # bloquear el event loop; aquí solo se espera a la extracción de los PDFs
+    previo = await asyncio.to_thread(
+        profiling.en_hilo(_contraste_por_nombre), job, pendientes, facturas, todas_columnas
+    )
+    if isinstance(previo, Response):
+        return previo
+    pend_df, amt_cols, excel_index, resultados = previo
+
+    # 4️⃣ bis Por contenido: solo los PDFs que no casaron por nombre
+    sin_nombre = [i for i, r in enumerate(resultados) if not r["Coincidencia"]] if por_contenido else []
+    filas: list = []
+    if sin_nombre:
+        job.avanza(0, len(sin_nombre), "leyendo contenido de los PDFs")
+        pool, cache = _extraccion()
+        with metrics.etapa("extraccion"):
+            archivos = await asyncio.to_thread(profiling.en_hilo(_lee_archivos), [facturas[i] for i in sin_nombre])
+            filas = await pool.extract_many(
+                archivos, cache=cache, return_exceptions=True, progreso=job.avanza
+            )
+
+    return await asyncio.to_thread(
+        profiling.en_hilo(_contraste_resultado),
+        job, pend_df, amt_cols, excel_index, resultados, sin_nombre, filas, tolerancia_importe,
+    )
+
 
+def _contraste_por_nombre(
+    job: Job,
+    pendientes: tuple[str, str],
+    facturas: list[tuple[str, str]],
+    todas_columnas: bool,
+) -> Response | tuple[pd.DataFrame, list[str], InvoiceIndex, list[dict]]:
+    """Pasos 1-4 del contraste: (pend_df, columnas de importe, índice, resultados) o Response de error."""
     # 1️⃣ Leer Excel
+    job.avanza(0, 1, "leyendo pendientes")
+    metrics.cuenta("df_archivos_total", len(facturas) + 1)
     try:
-        pend_df = _read_tabular(pendientes)
-        pend_df = _norm_colnames(pend_df)
+        with metrics.etapa("lectura_pendientes"):
+            pend_df = _read_tabular_ruta(*pendientes)
+            pend_df = _norm_colnames(pend_df)
     except Exception as e:
         return Response(
             content=f"Error leyendo pendientes: {e}",
@@ -522,223 +643,67 @@ async def contraste_facturas(
             status_code=400,
         )
 
-    # 3️⃣ Construir índice de facturas en Excel (busca en TODAS las columnas)
-    excel_index: dict[str, dict] = {}
-    for idx, row in pend_df.iterrows():
-        for col in pend_df.columns:
-            val = str(row.get(col, "") or "")
-            if not val.strip():
-                continue
-            val_norm = _norm_invoice_code(val)
-            if not val_norm:
-                continue
-            excel_index[val_norm] = {
-                "fila": idx + 2,
-                "columna": col,
-                "valor": val,
-            }
+    # 3️⃣ Construir índice de facturas en Excel
+    # (solo columnas de Nº de factura; todas_columnas=true para buscar en TODAS)
+    metrics.cuenta("df_filas_total", len(pend_df), tipo="pendientes")
+    with metrics.etapa("indice"):
+        excel_index = InvoiceIndex.from_dataframe(pend_df, None if todas_columnas else inv_cols)
 
     # 4️⃣ Procesar los PDFs SOLO por nombre de archivo
-    resultados = []
-    for f in facturas:
-        if not f.filename.lower().endswith(".pdf"):
+    for nombre, _ in facturas:
+        if not nombre.lower().endswith(".pdf"):
             return Response(
-                content=f"'{f.filename}' no es un PDF",
+                content=f"'{nombre}' no es un PDF",
                 media_type="text/plain",
                 status_code=400,
             )
-        nombre = f.filename.upper()
-
-           # 1️⃣ Extrae códigos principales normalizados
-        matches = re.findall(
-            r"(?:INV\d{3,}|\b\d{6,}\b|\d{4}[-_/]\d{3,}|[A-Z]{1,5}[\s\-_/]*\d{2,6}|\d{2,6}[\s\-_/]*[A-Z]{1,5})",
-            nombre.upper()
-        )
 
-        # Normaliza y separa letras/números pegados (ej: 84927TRAVI → 84927, TRAVI)
-        posibles_codigos = []
-        for m in matches:
-            nm = re.sub(r"[\s\-_/.]", "", m.strip().upper())
-            # Separar letras y números adyacentes
-            nm_split = re.split(r"(?<=\d)(?=[A-Z])|(?<=[A-Z])(?=\d)", nm)
-            for part in nm_split:
-                part = part.strip()
-                if part and part not in posibles_codigos:
-                    posibles_codigos.append(part)
-
-        coincidencia = None
-        razon = "No se detectó ningún código en el nombre del archivo"
-
-        # 2️⃣ Primera pasada: comparación normal con Excel
-        for code in posibles_codigos:
-            code_norm = _norm_invoice_code(code)
-            if code_norm in excel_index:
-                coincidencia = excel_index[code_norm]
-                razon = (
-                    f"'{code}' del archivo coincide con "
-                    f"celda (columna '{coincidencia['columna']}', fila {coincidencia['fila']}) → {coincidencia['valor']}"
-                )
-                break
-
-        # 3️⃣ Segunda pasada: solo si no hubo coincidencia, busca cualquier bloque de ≥4 alfanuméricos seguidos
-        if not coincidencia:
-            extra_blocks = re.findall(r"[A-Z0-9]{4,}", nombre.upper())
-            for eb in extra_blocks:
-                eb_norm = _norm_invoice_code(eb)
-                if eb_norm in excel_index and all(
-                    eb_norm != _norm_invoice_code(c["code"]) for c in coincidencias_encontradas
-                ):
-                    coincidencias_encontradas.append({
-                        "code": eb,
-                        "coincidencia": excel_index[eb_norm],
-                        "origen": "secundaria",
-                    })
-
-        if not coincidencia:
-            razon = f"Ningún código del archivo ({', '.join(posibles_codigos)}) se encontró en el Excel"
-
-        # ➤ Filtrar años (2020–2039)
-        matches = [m for m in matches if not re.fullmatch(r"20[2-3]\d", m)]
-
-        # ➤ Limpiar duplicados
-        matches = list(dict.fromkeys(matches))
-
-
-        # 3️⃣ Normaliza y elimina duplicados
-        posibles_codigos = []
-        for m in matches:
-            nm = _norm_invoice_code(m)
-            if nm and nm not in posibles_codigos:
-                posibles_codigos.append(nm)
-
-        # 4️⃣ Buscar coincidencias con el Excel (dos pasadas)
-        coincidencias_encontradas = []
-        razon = "No se detectó ningún código en el nombre del archivo"
-
-        # ➤ Primera pasada: códigos principales normalizados
-        for code in posibles_codigos:
-            code_norm = _norm_invoice_code(code)
-            if code_norm in excel_index:
-                coincidencias_encontradas.append({
-                    "code": code,
-                    "coincidencia": excel_index[code_norm],
-                    "origen": "primaria",
-                })
-
-        # ➤ Segunda pasada: bloques genéricos (solo si no estaban ya)
-        extra_blocks = re.findall(r"[A-Z0-9]{4,}", nombre.upper())
-        for eb in extra_blocks:
-            eb_norm = _norm_invoice_code(eb)
-            if eb_norm in excel_index and all(
-                eb_norm != _norm_invoice_code(c["code"]) for c in coincidencias_encontradas
-            ):
-                coincidencias_encontradas.append({
-                    "code": eb,
-                    "coincidencia": excel_index[eb_norm],
-                    "origen": "secundaria",
-                })
-
-        # 🟨 3️⃣ Tercera vía: rescate numérico puro — solo si NO hay coincidencias hasta ahora
-        if not coincidencias_encontradas:
-            numeric_blocks = re.findall(r"\d{4,}", nombre)
-            for nb in numeric_blocks:
-                # Ignorar años comunes
-                if nb in {"2020","2021","2022","2023","2024","2025","2026"}:
-                    continue
-                if nb in excel_index:
-                    coincidencias_encontradas.append({
-                        "code": nb,
-                        "coincidencia": excel_index[nb],
-                        "origen": "terciaria",
-                    })
-
-        # 🟨 3️⃣ Tercera vía: rescate — busca bloques aislados por separadores
-        # 🟨 3️⃣ Tercera vía: rescate mejorado — separa letras y números contiguos
-        base_clean = re.sub(r"[^A-Z0-9]", " ", nombre.upper())
-
-        # Separa letras y números adyacentes (para evitar "84927TRAVI")
-        base_clean = re.sub(r"(?<=\d)(?=[A-Z])", " ", base_clean)
-        base_clean = re.sub(r"(?<=[A-Z])(?=\d)", " ", base_clean)
-
-        rescue_blocks = re.findall(r"\b[A-Z0-9]{4,}\b", base_clean)
-
-        for rb in rescue_blocks:
-            if rb in {"2020", "2021", "2022", "2023", "2024", "2025", "2026"}:
-                continue
-            rb_norm = _norm_invoice_code(rb)
-            if rb_norm in excel_index and all(
-                rb_norm != _norm_invoice_code(c["code"]) for c in coincidencias_encontradas
-            ):
-                coincidencias_encontradas.append({
-                    "code": rb,
-                    "coincidencia": excel_index[rb_norm],
-                    "origen": "terciaria",
-                })
-
-        # ➤ Evaluar resultado combinado
-        if coincidencias_encontradas:
-            coincidencia = coincidencias_encontradas[0]["coincidencia"]  # toma la primera para mostrar
-            encontrados = [
-                f"{c['code']} → fila {c['coincidencia']['fila']} ({c['origen']})"
-                for c in coincidencias_encontradas
-            ]
-            razon = " / ".join(
-                [f"'{c['code']}' coincide con celda (columna '{c['coincidencia']['columna']}', fila {c['coincidencia']['fila']}) → {c['coincidencia']['valor']}'" for c in coincidencias_encontradas]
-            )
-        else:
-            coincidencia = None
-            razon = f"Ningún código del archivo ({', '.join(posibles_codigos)}) se encontró en el Excel"
-
-            # 🟨 3️⃣ Tercera vía: búsqueda separada SOLO para los no coincidentes
-            # Genera nueva lista de matches numéricos (solo dígitos, 4 o más)
-            matches_tercera = re.findall(r"\d{4,}", nombre)
-
-            for mt in matches_tercera:
-                # Ignorar años típicos
-                if mt in {"2020","2021","2022","2023","2024","2025","2026"}:
-                    continue
-
-                # Coincidencia directa con el Excel (sin normalizar)
-                if mt in excel_index:
-                    coincidencia = excel_index[mt]
-                    razon = (
-                        f"'{mt}' (vía numérica pura) coincide con celda "
-                        f"(columna '{coincidencia['columna']}', fila {coincidencia['fila']}) → {coincidencia['valor']}"
-                    )
-                    break
-
-            # Si sigue sin coincidencia, actualizar razón final
-            if not coincidencia:
-                razon = (
-                    f"Ningún código del archivo ({', '.join(posibles_codigos + matches_tercera)}) "
-                    f"se encontró en el Excel"
-                )
-
-
-            # 🟨 3️⃣ Tercera vía: nueva búsqueda exclusiva para los no coincidentes
-            matches_tercera = re.findall(r"\d{4,}", nombre)
-            for mt in matches_tercera:
-                # Ignorar años típicos
-                if mt in {"2020","2021","2022","2023","2024","2025","2026"}:
+    # Pasadas primaria / secundaria / terciaria sobre los nombres (invoice_codes.py)
+    job.avanza(0, 1, "comparando nombres")
+    resultados = []
+    with metrics.etapa("nombres"):
+        for (nombre, _), m in zip(facturas, match_filenames([nombre for nombre, _ in facturas], excel_index)):
+            resultados.append({
+                "Archivo": nombre,
+                "CodigosDetectados": m.codigos_detectados,
+                "Coincidencia": m.coincide,
+                "Razon": m.razon,
+            })
+    metrics.cuenta("df_coincidencias_total", sum(r["Coincidencia"] for r in resultados), metodo="nombre")
+    return pend_df, amt_cols, excel_index, resultados
+
+
+def _contraste_resultado(
+    job: Job,
+    pend_df: pd.DataFrame,
+    amt_cols: list[str],
+    excel_index: InvoiceIndex,
+    resultados: list[dict],
+    sin_nombre: list[int],
+    filas: list,
+    tolerancia_importe: float,
+) -> Response:
+    """Cotejo por contenido de los PDFs extraídos (`filas`, en el orden de `sin_nombre`) y respuesta JSON."""
+    if sin_nombre:
+        with metrics.etapa("contenido"):
+            col_prov = _find_col(pend_df, ["proveedor", "acreedor", "razon social", "tercero", "nombre"])
+            importes = AmountIndex.from_dataframe(pend_df, amt_cols, to_float_eu, col_prov)
+            por_contenido_ok = 0
+            for i, campos in zip(sin_nombre, filas):
+                if isinstance(campos, PdfExtractionError):
+                    resultados[i]["Razon"] += f" (no se pudo leer el PDF: {campos})"
                     continue
-                # Coincidencia directa o contenida dentro de una clave normalizada
-                for key, info in excel_index.items():
-                    if mt == key or mt in key:
-                        coincidencia = info
-                        razon = (
-                            f"'{mt}' (vía numérica pura) coincide con celda "
-                            f"(columna '{info['columna']}', fila {info['fila']}) → {info['valor']}"
-                        )
-                        break
-
-
-
-        resultados.append({
-            "Archivo": f.filename,
-            "CodigosDetectados": posibles_codigos,
-            "Coincidencia": bool(coincidencia),
-            "Razon": razon,
-        })
+                cm = match_content(campos, excel_index, importes, tolerancia_importe)
+                if cm is not None:
+                    resultados[i]["Coincidencia"] = True
+                    resultados[i]["Razon"] = cm.razon
+                    por_contenido_ok += 1
+                elif campos.get("Invoice_full") or campos.get("Invoice"):
+                    nro = campos.get("Invoice_full") or campos["Invoice"]
+                    resultados[i]["Razon"] += f" (ni el nº '{nro}' del contenido)"
+        metrics.cuenta("df_coincidencias_total", por_contenido_ok, metodo="contenido")
+
+    metrics.cuenta("df_coincidencias_total", sum(not r["Coincidencia"] for r in resultados), metodo="ninguno")
 
     # 5️⃣ Preparar preview
     preview = {
@@ -766,10 +731,12 @@ async def contraste_facturas(
         ],
     }
 
+    with metrics.etapa("preview"):
+        jobs.guarda_preview(job, preview)
+    # Sin X-Preview: el cuerpo ya es la vista previa (no mandar el mismo JSON dos veces)
     return Response(
         content=json.dumps(preview, ensure_ascii=False, indent=2),
         media_type="application/json",
-        headers={"X-Preview": json.dumps(preview, ensure_ascii=True)},
     )
 
 
@@ -778,11 +745,39 @@ async def contraste_facturas(
 async def bankflowpro(
     extracto: UploadFile = File(...),
     detalle_remesas: UploadFile | None = File(None),
+    x_profile: str | None = Header(None),
 ):
+    """
+    Extracto (CSV/XLSX) + detalle de remesas opcional -> Excel desglosado + 'X-Preview'.
+    Cabecera 'X-Profile: 1' (con PROFILING_ACTIVO=1): ejecuta perfilado (ver profiling.py).
+    (Versión síncrona de /api/jobs/bankflowpro: espera a que acabe el Job.)
+    """
+    job = await _crea_job_bankflowpro(extracto, detalle_remesas, limitar=False, perfilar=profiling.pedido(x_profile))
+    return jobs.entrega(await jobs.wait(job))
+
+
+async def _crea_job_bankflowpro(
+    extracto: UploadFile, detalle_remesas: UploadFile | None, limitar: bool, perfilar: bool = False
+) -> Job:
+    job = jobs.nuevo("bankflowpro", limitar=limitar, perfilar=perfilar)
+    try:
+        ext = await _guarda_subida(job, extracto)
+        rem = await _guarda_subida(job, detalle_remesas) if detalle_remesas else None
+    except BaseException:
+        jobs.descarta(job)
+        raise
+    # Todo el trabajo es CPU (pandas): en un hilo, para no bloquear el event loop
+    return jobs.submit(job, lambda j: asyncio.to_thread(profiling.en_hilo(_bankflowpro_job), j, ext, rem))
+
+
+def _bankflowpro_job(job: Job, extracto: tuple[str, str], detalle_remesas: tuple[str, str] | None) -> Response:
     # 1) Leer el extracto (CSV/XLSX)
+    job.avanza(0, 4, "leyendo extracto")
+    metrics.cuenta("df_archivos_total", 2 if detalle_remesas else 1)
     try:
-        ext_df = _read_tabular(extracto)
-        ext_df = _norm_colnames(ext_df)
+        with metrics.etapa("lectura_extracto"):
+            ext_df = _read_tabular_ruta(*extracto)
+            ext_df = _norm_colnames(ext_df)
     except Exception as e:
         return Response(
             content=f"Error leyendo el extracto: {e}",
@@ -816,184 +811,103 @@ async def bankflowpro(
             status_code=400,
         )
 
-    # 3) Construir salida base (Volvemos a usar "Total")
-    out_rows = []
-    
-    for _, r in ext_df.iterrows():
-        fecha = _to_date_ddmmyyyy(r.get(col_fecha, "")) if col_fecha else ""
-        concepto = str(r.get(col_concepto, "") or "") if col_concepto else ""
-
-        # --- Importe robusto ---
-        imp = 0.0
-        if col_cargo or col_abono:
-            cargo = _to_float_eu(r.get(col_cargo, "")) if col_cargo else 0.0
-            abono = _to_float_eu(r.get(col_abono, "")) if col_abono else 0.0
-            imp = (abono or 0.0) - (cargo or 0.0)
-        elif col_importe:
-            imp = _to_float_eu(r.get(col_importe, "")) or 0.0
-            if col_signo:
-                s = str(r.get(col_signo, "") or "").strip().lower()
-                neg = s in {"d", "debe", "cargo", "-", "debito", "débito"}
-                pos = s in {"h", "haber", "abono", "+", "credito", "crédito"}
-                if neg and imp > 0:
-                    imp = -imp
-                if pos and imp < 0:
-                    imp = -imp
-        
-        out_rows.append({
-            "Fecha": fecha,
-            "Concepto": concepto,
-            "Tipo": "",
-            "Importe": imp,
-            "Comisión": 0.0,
-            "IVA": 0.0,
-            "IRPF": 0.0,
-            "Importe Neto": imp, # <-- Nueva columna final es Importe Neto
-
-        })
+    # 3) Construir salida base (Volvemos a usar "Total"), por columnas
+    job.avanza(1, 4, "normalizando movimientos")
+    metrics.cuenta("df_filas_total", len(ext_df), tipo="extracto")
+    with metrics.etapa("normalizacion"):
+        out_df = _normaliza_extracto(ext_df, col_fecha, col_concepto, col_importe, col_cargo, col_abono, col_signo)
 
     # --- Leer detalle remesas (si existe) ---
     rem_df = None
     avisos = []
     if detalle_remesas:
         try:
-            rem_df = _read_tabular(detalle_remesas)
-            rem_df = _norm_colnames(rem_df)
+            with metrics.etapa("lectura_detalle"):
+                rem_df = _read_tabular_ruta(*detalle_remesas)
+                rem_df = _norm_colnames(rem_df)
+            metrics.cuenta("df_filas_total", len(rem_df), tipo="detalle_remesas")
         except Exception as e:
             avisos.append(f"Aviso: No se pudo leer el detalle de remesas: {e}")
 
-    # --- DataFrame con "Total" ---
-    out_df = pd.DataFrame(out_rows, columns=["Fecha", "Concepto", "Tipo", "Importe", "Comisión", "IVA", "IRPF", "Importe Neto"])
-
-
     # 3.1) Aplicar pipeline completo (Reglas + Remesas)
+    job.avanza(2, 4, "aplicando reglas y remesas")
     out_df, avisos_bankflow = process_bankflow(out_df, rem_df)
     avisos.extend(avisos_bankflow)
-
-        # 4) X-Preview (máx. 50 filas)
-    preview_rows = []
-
-    for _, r in out_df.head(50).iterrows():
-        concepto_preview = str(r.get("Concepto", "") or "")
-        if len(concepto_preview) > 30:
-            concepto_preview = concepto_preview[:30] + "…"
-
-        tipo_str = str(r.get("Tipo", "") or "")
-
-        # parseo robusto (EU) para números en preview
-        def _to_num(v):
-            if isinstance(v, (int, float)):
-                return float(v)
-            return _to_float_eu(v) or 0.0
-
-        imp      = _to_num(r.get("Importe", 0.0))
-        com_val  = _to_num(r.get("Comisión", r.get("Comision", 0)))  # ← tilde y fallback
-        iva_val  = _to_num(r.get("IVA", 0.0))
-        irpf_val = _to_num(r.get("IRPF", 0.0))
-        neto_val = _to_num(r.get("Importe Neto", 0.0))
-
-        # Caso especial: Comisión bancaria → comisión = importe, sin IVA/IRPF
-        if "comisión bancaria" in tipo_str.lower() or "comision bancaria" in tipo_str.lower():
-            com_val  = imp
-            iva_val  = 0.0
-            irpf_val = 0.0
-            neto_val = abs(imp)
-
-        preview_rows.append({
-            "Fecha": r.get("Fecha", ""),
-            "Concepto": concepto_preview,
-            "Tipo": tipo_str,
-            "Importe": _fmt_eur(imp),
-            "Comisión": _fmt_eu(com_val),
-            "Comision": _fmt_eu(com_val),
-
-            "IVA": _fmt_eur(iva_val),
-            "IRPF": _fmt_eur(irpf_val),
-            "Importe Neto": _fmt_eur(neto_val),
-        })
-
-    x_preview = json.dumps({"Filas": int(len(out_df)), "Muestra": preview_rows}, ensure_ascii=True)
+    metrics.cuenta("df_filas_total", len(out_df), tipo="salida")
+
+    # 4) Vista previa (se guarda con el Job; X-Preview lleva las primeras filas)
+    with metrics.etapa("preview"):
+        preview_rows = []
+
+        for _, r in out_df.head(PREVIEW_MAX_FILAS).iterrows():
+            concepto_preview = str(r.get("Concepto", "") or "")
+            if len(concepto_preview) > 30:
+                concepto_preview = concepto_preview[:30] + "…"
+
+            tipo_str = str(r.get("Tipo", "") or "")
+
+            # parseo robusto (EU) para números en preview
+            def _to_num(v):
+                if isinstance(v, (int, float)):
+                    return float(v)
+                return to_float_eu(v) or 0.0
+
+            imp      = _to_num(r.get("Importe", 0.0))
+            com_val  = _to_num(r.get("Comisión", r.get("Comision", 0)))  # ← tilde y fallback
+            iva_val  = _to_num(r.get("IVA", 0.0))
+            irpf_val = _to_num(r.get("IRPF", 0.0))
+            neto_val = _to_num(r.get("Importe Neto", 0.0))
+
+            # Caso especial: Comisión bancaria → comisión = importe, sin IVA/IRPF
+            if "comisión bancaria" in tipo_str.lower() or "comision bancaria" in tipo_str.lower():
+                com_val  = imp
+                iva_val  = 0.0
+                irpf_val = 0.0
+                neto_val = abs(imp)
+
+            preview_rows.append({
+                "Fecha": r.get("Fecha", ""),
+                "Concepto": concepto_preview,
+                "Tipo": tipo_str,
+                "Importe": _fmt_eur(imp),
+                "Comisión": _fmt_eu(com_val),
+                "Comision": _fmt_eu(com_val),
+
+                "IVA": _fmt_eur(iva_val),
+                "IRPF": _fmt_eur(irpf_val),
+                "Importe Neto": _fmt_eur(neto_val),
+            })
+
+        preview = {"Filas": int(len(out_df)), "Muestra": preview_rows}
+        if avisos:
+            # Remesas sin cuadrar o repartidas automáticamente: para revisarlas
+            preview["Avisos"] = avisos
+        jobs.guarda_preview(job, preview)
 
     # 5) Generar Excel (hoja única Movimientos_desglosados)
-    out = io.BytesIO()
-    with pd.ExcelWriter(out, engine="openpyxl") as w:
-        sheet = "Movimientos_desglosados"
-        out_df.to_excel(w, index=False, sheet_name=sheet)
-
-        from openpyxl.styles import Font, Alignment, PatternFill, Border
-        from openpyxl.utils import get_column_letter
-
-        wb = w.book
-        ws = wb[sheet]
-
-        ws.sheet_view.showGridLines = False
-
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill("solid", fgColor="1f3564")
-        left_align = Alignment(horizontal="left", vertical="center")
-
-        for cell in ws[1]:
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = left_align
-            cell.border = Border()
-
-        euro_fmt = '#,##0.00'
-        # D..H (Importe, Comisión, IVA, IRPF, Importe Neto)
-        for col_idx in range(4, 9):
-
-            col_letter = get_column_letter(col_idx)
-            for cell in ws[col_letter][1:]:
-                cell.number_format = euro_fmt
-                cell.alignment = left_align
-
-        for col_idx in range(1, 9):  # A..H
-            col_letter = get_column_letter(col_idx)
-            max_len = 10
-            for cell in ws[col_letter]:
-                v = cell.value
-                if v is None:
-                    l = 0
-                elif isinstance(v, (int, float)):
-                    l = len(f"{v:,.2f}")
-                else:
-                    l = len(str(v))
-                if l > max_len:
-                    max_len = l
-                if cell.row != 1:
-                    cell.border = Border()
-
-            ws.column_dimensions[col_letter].width = max(10, min(max_len + 2, 50))
-
-        # --- INICIO: Sombrear filas de remesa desglosada ---
-        
-        # Define el color de sombreado (Azul claro sutil)
-        remesa_fill = PatternFill("solid", fgColor="EAF2F8") # <-- NUEVO COLOR
-
-        for idx, row in out_df.iterrows():
-            try:
-                tipo_lower = str(row.get("Tipo", "") or "").lower()
-                comision_val = float(row.get("Comisión", 0.0) or 0.0)
-
-                es_traspaso = "traspaso" in tipo_lower
-                es_comision_banco = "comision" in tipo_lower
-                
-                is_remesa_line = (comision_val == 0.0) and not es_traspaso and not es_comision_banco
-
-                if is_remesa_line:
-                    ws_row = idx + 2 
-                    for cell in ws[ws_row]:
-                        cell.fill = remesa_fill
-            except Exception:
-                pass
-        # --- FIN: Sombreado ---
-
-    xlsx_bytes = out.getvalue()
+    job.avanza(3, 4, "generando Excel")
+    cols = list(out_df.columns)
+    izquierda = {"align": "left", "valign": "vcenter"}
+    # D..H (Importe, Comisión, IVA, IRPF, Importe Neto): formato numérico + izquierda
+    fmt_importes = [({**izquierda, "num_format": "#,##0.00"} if 3 <= i < 8 else None) for i in range(len(cols))]
+
+    with metrics.etapa("estilo_excel"):
+        estilo = SheetStyle(
+            header={**izquierda, "bold": True, "font_color": "#FFFFFF", "pattern": 1, "bg_color": "#1f3564"},
+            number_formats=fmt_importes,
+            text_formats=fmt_importes,
+            widths=column_widths(out_df, eu_number_width, extra=2, minimo=10, maximo=50),
+            # Filas de remesa desglosada sombreadas en azul claro sutil
+            row_fill=remesa_row_mask(out_df),
+            fill_color="#EAF2F8",
+        )
+    with metrics.etapa("excel"):
+        xlsx_bytes = to_xlsx_bytes([(out_df, "Movimientos_desglosados", estilo)])
 
     headers = {
         "Content-Disposition": 'attachment; filename*=UTF-8\'\'Movimientos_desglosados.xlsx',
-        "X-Preview": x_preview,
     }
+    _pon_cabecera_preview(headers, preview)
     return Response(
         content=xlsx_bytes,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
@@ -1001,6 +915,154 @@ async def bankflowpro(
     )
 
 
+# =========================
+# Endpoints: trabajos en segundo plano (subidas grandes)
+# =========================
+# Mismos formularios que los endpoints síncronos, pero responden al momento con
+# el id del Job (202). El cliente consulta /api/jobs/{id} hasta que el estado es
+# "terminado" (o "error") y descarga /api/jobs/{id}/resultado, que es la misma
+# respuesta (Excel/JSON + X-Preview) que daría el endpoint síncrono.
+
+
+def _aceptado(job: Job) -> JSONResponse:
+    return JSONResponse(job.as_dict(), status_code=202)
+
+
+def _cola_llena(e: ColaLlena) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e))
+
+
+@app.post("/api/jobs/pdf2excel")
+async def job_pdf2excel(
+    file: List[UploadFile] = File(...),
+    modo: str | None = Form(None),
+    x_profile: str | None = Header(None),
+):
+    try:
+        return _aceptado(await _crea_job_pdf2excel(file, modo, limitar=True, perfilar=profiling.pedido(x_profile)))
+    except ColaLlena as e:
+        raise _cola_llena(e)
+
+
+@app.post("/api/jobs/bankflowpro")
+async def job_bankflowpro(
+    extracto: UploadFile = File(...),
+    detalle_remesas: UploadFile | None = File(None),
+    x_profile: str | None = Header(None),
+):
+    try:
+        return _aceptado(
+            await _crea_job_bankflowpro(extracto, detalle_remesas, limitar=True, perfilar=profiling.pedido(x_profile))
+        )
+    except ColaLlena as e:
+        raise _cola_llena(e)
+
+
+@app.post("/api/jobs/contraste-facturas")
+async def job_contraste_facturas(
+    pendientes: UploadFile = File(...),
+    facturas: List[UploadFile] = File(...),
+    todas_columnas: bool = Form(False),
+    por_contenido: bool = Form(False),
+    tolerancia_importe: float = Form(0.05),
+    x_profile: str | None = Header(None),
+):
+    try:
+        job = await _crea_job_contraste(
+            pendientes, facturas, todas_columnas, por_contenido, tolerancia_importe, limitar=True,
+            perfilar=profiling.pedido(x_profile),
+        )
+    except ColaLlena as e:
+        raise _cola_llena(e)
+    return _aceptado(job)
+
+
+def _job_o_404(job_id: str) -> Job:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado (o ya caducado)")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def job_estado(job_id: str):
+    """Estado y progreso (0..1, archivos/pasos hechos) de un Job."""
+    return _job_o_404(job_id).as_dict()
+
+
+@app.get("/api/jobs/{job_id}/preview")
+async def job_preview(job_id: str, filas: int | None = None, formato: str = "filas"):
+    """
+    Vista previa del resultado: `filas` primeras filas (por defecto PREVIEW_FILAS,
+    máx. PREVIEW_MAX_FILAS); formato=columnas la da por columnas (más compacta).
+    """
+    job = _job_o_404(job_id)
+    if not job.acabado:
+        raise HTTPException(status_code=409, detail=f"El trabajo aún está en '{job.estado}'")
+    datos = jobs.lee_preview(job)
+    if datos is None:
+        raise HTTPException(status_code=404, detail="Este trabajo no tiene vista previa")
+    try:
+        return preview_formatea(datos, filas, formato)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/jobs/{job_id}/resultado")
+async def job_resultado(job_id: str):
+    """Respuesta final del Job (Excel/JSON + cabeceras). 409 si aún no ha acabado."""
+    job = _job_o_404(job_id)
+    if not job.acabado:
+        raise HTTPException(status_code=409, detail=f"El trabajo aún está en '{job.estado}'")
+    return jobs.respuesta(job)
+
+
+# =========================
+# Endpoints: perfiles de peticiones (solo con PROFILING_ACTIVO=1, ver profiling.py)
+# =========================
+
+
+def _perfilado_activo() -> None:
+    if not profiling.PROFILING_ACTIVO:
+        raise HTTPException(status_code=404, detail="Perfilado desactivado (PROFILING_ACTIVO=1 para activarlo)")
+
+
+@app.get("/api/perfiles")
+async def perfiles():
+    """Perfiles guardados (metadatos), del más reciente al más antiguo."""
+    _perfilado_activo()
+    return profiling.lista()
+
+
+@app.get("/api/perfiles/{perfil_id}")
+async def perfil_descarga(perfil_id: str, formato: str = "collapsed", filas: int = 60, orden: str = "cumulative"):
+    """
+    Descarga un perfil: formato=collapsed (pilas para flame graph), pstats
+    (volcado de cProfile), json (metadatos) o resumen (las `filas` funciones
+    más caras según `orden`, en texto).
+    """
+    _perfilado_activo()
+    if formato == "resumen":
+        try:
+            texto = profiling.resumen(perfil_id, filas, orden)
+        except KeyError:
+            raise HTTPException(status_code=400, detail=f"Orden no válido: '{orden}'")
+        if texto is None:
+            raise HTTPException(status_code=404, detail="Perfil no encontrado")
+        return Response(content=texto, media_type="text/plain; charset=utf-8")
+    if formato not in profiling.FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato no válido: '{formato}'")
+    ruta = profiling.ruta(perfil_id, formato)
+    if ruta is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    ext, media_type = profiling.FORMATOS[formato]
+    return Response(
+        content=_lee_bytes(ruta),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="perfil_{perfil_id}{ext}"'},
+    )
+
+
 if __name__ == "__main__":
     import uvicorn  # puedes quitar esta línea si ya lo importas arriba
     print("✅ FastAPI corriendo en http://127.0.0.1:8000")
@@ -0,0 +1,251 @@
+# metrics.py
+# Instrumentación ligera del servicio: tiempos por etapa de cada endpoint,
+# contadores (archivos, filas...) e histogramas de latencia.
+#
+#   - etapa("nombre"): context manager que mide un paso del pipeline. El tiempo
+#     va al histograma df_etapa_segundos{endpoint, etapa} y a la traza de la
+#     petición en curso, de la que sale la cabecera Server-Timing.
+#   - cuenta("df_..._total", n, **etiquetas): suma a un contador.
+#   - observa("df_..._segundos", s, **etiquetas): una observación de histograma.
+#   - registra_colector(fn): valores que ya llevan otros módulos (cachés, cola
+#     de Jobs); solo se leen al servir /metrics.
+#   - exporta(): todo en formato texto de Prometheus (GET /metrics).
+#
+# La traza de una petición es un ContextVar que abre jobs.py al ejecutar cada
+# Job (traza(tipo)), así que la ven también las etapas que corren en hilos
+# (asyncio.to_thread copia el contexto) y las que viven en otros módulos
+# (bankflow_rules.py). Fuera de una traza, etapa() no mide nada.
+#
+# Coste: medir una etapa es un perf_counter() y una actualización de dict bajo
+# un lock (unas pocas por petición, nunca por fila); formatear el texto solo
+# ocurre cuando alguien pide /metrics.
+
+from __future__ import annotations
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import math
+import os
+import threading
+import time
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# METRICS_ACTIVAS:       "0" desactiva toda la instrumentación (etapa/cuenta/observa no hacen nada)
+# METRICS_SERVER_TIMING: "0" no añade la cabecera Server-Timing a las respuestas
+METRICS_ACTIVAS = os.environ.get("METRICS_ACTIVAS", "1") != "0"
+METRICS_SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "1") != "0"
+
+# Límites (segundos) de los histogramas: de una etapa de milisegundos a un lote de minutos
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Métricas conocidas: nombre -> (tipo, ayuda)
+METRICAS: Dict[str, Tuple[str, str]] = {
+    "df_etapa_segundos": ("histogram", "Duración de cada etapa del pipeline por endpoint"),
+    "df_job_segundos": ("histogram", "Duración de un Job desde que empieza a procesarse"),
+    "df_cola_segundos": ("histogram", "Espera de un Job en la cola antes de procesarse"),
+    "df_jobs_total": ("counter", "Jobs terminados por endpoint y estado"),
+    "df_archivos_total": ("counter", "Archivos recibidos por endpoint"),
+    "df_filas_total": ("counter", "Filas procesadas por endpoint y tipo"),
+    "df_coincidencias_total": ("counter", "Resultados del contraste de facturas por método"),
+}
+
+Etiquetas = Tuple[Tuple[str, str], ...]
+
+
+# =========================
+# Registro
+# =========================
+
+
+class _Histograma:
+    __slots__ = ("cubos", "suma", "n")
+
+    def __init__(self):
+        self.cubos = [0] * (len(BUCKETS) + 1)  # el último es +Inf
+        self.suma = 0.0
+        self.n = 0
+
+    def observa(self, valor: float) -> None:
+        self.cubos[bisect_left(BUCKETS, valor)] += 1
+        self.suma += valor
+        self.n += 1
+
+
+_lock = threading.Lock()
+_contadores: Dict[Tuple[str, Etiquetas], float] = {}
+_histogramas: Dict[Tuple[str, Etiquetas], _Histograma] = {}
+_colectores: List[Callable[[], List[Tuple[str, str, str, Dict[str, Any], float]]]] = []
+
+
+def _etiquetas(etiquetas: Dict[str, Any]) -> Etiquetas:
+    if "endpoint" not in etiquetas:
+        t = _traza.get()
+        etiquetas = {"endpoint": t.endpoint if t is not None else "", **etiquetas}
+    return tuple((k, str(v)) for k, v in etiquetas.items())
+
+
+def cuenta(nombre: str, valor: float = 1, **etiquetas: Any) -> None:
+    """Suma `valor` al contador (endpoint = el de la traza en curso si no se indica)."""
+    if not METRICS_ACTIVAS:
+        return
+    clave = (nombre, _etiquetas(etiquetas))
+    with _lock:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def observa(nombre: str, segundos: float, **etiquetas: Any) -> None:
+    """Una observación del histograma `nombre`."""
+    if not METRICS_ACTIVAS:
+        return
+    clave = (nombre, _etiquetas(etiquetas))
+    with _lock:
+        h = _histogramas.get(clave)
+        if h is None:
+            h = _histogramas[clave] = _Histograma()
+        h.observa(segundos)
+
+
+def registra_colector(fn: Callable[[], List[Tuple[str, str, str, Dict[str, Any], float]]]) -> None:
+    """fn() -> [(nombre, tipo, ayuda, etiquetas, valor), ...], leído en cada exporta()."""
+    _colectores.append(fn)
+
+
+def reinicia() -> None:
+    """Vacía contadores e histogramas (los colectores se mantienen)."""
+    with _lock:
+        _contadores.clear()
+        _histogramas.clear()
+
+
+# =========================
+# Traza de una petición (Server-Timing)
+# =========================
+
+
+class Traza:
+    """Etapas medidas durante una petición/Job, en orden de aparición."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.inicio = time.perf_counter()
+        self._etapas: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def anota(self, etapa: str, segundos: float) -> None:
+        with self._lock:
+            self._etapas[etapa] = self._etapas.get(etapa, 0.0) + segundos
+
+    @property
+    def etapas(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._etapas)
+
+    def server_timing(self, **extra: float) -> str:
+        """'etapa;dur=ms, ..., total;dur=ms' (segundos de `extra` incluidos, p. ej. cola)."""
+        partes = {**self.etapas, **extra, "total": time.perf_counter() - self.inicio}
+        return ", ".join(f"{nombre};dur={s * 1000:.1f}" for nombre, s in partes.items())
+
+
+_traza: ContextVar[Optional[Traza]] = ContextVar("traza_metrics", default=None)
+
+
+@contextmanager
+def traza(endpoint: str) -> Iterator[Traza]:
+    """Abre la traza de una petición: las etapa() del mismo contexto se anotan en ella."""
+    t = Traza(endpoint)
+    token = _traza.set(t)
+    try:
+        yield t
+    finally:
+        _traza.reset(token)
+
+
+def traza_actual() -> Optional[Traza]:
+    return _traza.get()
+
+
+@contextmanager
+def etapa(nombre: str) -> Iterator[None]:
+    """Mide el bloque como etapa `nombre` de la petición en curso (nada fuera de una traza)."""
+    t = _traza.get()
+    if t is None or not METRICS_ACTIVAS:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        s = time.perf_counter() - t0
+        t.anota(nombre, s)
+        observa("df_etapa_segundos", s, endpoint=t.endpoint, etapa=nombre)
+
+
+# =========================
+# Exportación (texto de Prometheus)
+# =========================
+
+
+def _escapa(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_etiquetas(etiquetas: Etiquetas) -> str:
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapa(v)}"' for k, v in etiquetas) + "}"
+
+
+def _num(v: float) -> str:
+    v = float(v)
+    if math.isnan(v):
+        return "NaN"
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+def exporta() -> str:
+    """Formato de exposición de texto de Prometheus (0.0.4)."""
+    with _lock:
+        contadores = sorted(_contadores.items())
+        histos = sorted((k, (list(h.cubos), h.suma, h.n)) for k, h in _histogramas.items())
+
+    lineas: List[str] = []
+    vistos = set()
+
+    def _cabecera(nombre: str, tipo: str, ayuda: str) -> None:
+        if nombre not in vistos:
+            vistos.add(nombre)
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+
+    for (nombre, et), valor in contadores:
+        tipo, ayuda = METRICAS.get(nombre, ("counter", nombre))
+        _cabecera(nombre, tipo, ayuda)
+        lineas.append(f"{nombre}{_fmt_etiquetas(et)} {_num(valor)}")
+
+    for (nombre, et), (cubos, suma, n) in histos:
+        tipo, ayuda = METRICAS.get(nombre, ("histogram", nombre))
+        _cabecera(nombre, tipo, ayuda)
+        acumulado = 0
+        for limite, c in zip(BUCKETS + (float("inf"),), cubos):
+            acumulado += c
+            le = "+Inf" if limite == float("inf") else _num(limite)
+            lineas.append(f"{nombre}_bucket{_fmt_etiquetas(et + (('le', le),))} {acumulado}")
+        lineas.append(f"{nombre}_sum{_fmt_etiquetas(et)} {_num(suma)}")
+        lineas.append(f"{nombre}_count{_fmt_etiquetas(et)} {n}")
+
+    for fn in list(_colectores):
+        try:
+            muestras = fn()
+        except Exception:
+            continue  # un colector roto no tumba /metrics
+        for nombre, tipo, ayuda, etiquetas, valor in muestras:
+            _cabecera(nombre, tipo, ayuda)
+            et = tuple((k, str(v)) for k, v in etiquetas.items())
+            lineas.append(f"{nombre}{_fmt_etiquetas(et)} {_num(valor)}")
+
+    return "\n".join(lineas) + "\n"
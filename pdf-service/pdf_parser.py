@@ -0,0 +1,133 @@
+# pdf_parser.py
+# Lectura de PDFs de factura -> fila normalizada (Proveedor, Fecha, Importes...).
+# Vive fuera de main.py para que los procesos del pool puedan importarlo
+# sin arrancar la app FastAPI.
+#
+# Lectura perezosa de páginas: en documentos largos (certificaciones de 40-80
+# páginas) la cabecera y los totales están casi siempre en la primera y la
+# última página. Se extrae el texto de esas dos, se pasa el extractor y solo si
+# siguen faltando campos necesarios (total, base, nº de factura) se leen las
+# páginas intermedias; en ese caso el resultado es el mismo que leyendo todo.
+# El pool (pdf_pool.py) puede repartir esas páginas intermedias en trozos
+# entre sus workers (parse_pdf_extremos + read_pages + fila_desde_paginas).
+#
+# Las páginas se leen como palabras con posición (layout_extractor.PaginaLayout),
+# de las que sale el mismo texto que extract_text(); así el motor ("texto",
+# "layout" o "auto", ver layout_extractor.py) se elige sin releer el PDF.
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+import io
+import os
+import pandas as pd
+import pdfplumber
+from layout_extractor import PaginaLayout, extract_fields, lee_pagina
+
+COLUMNAS_FACTURA = ["Proveedor", "Fecha", "Invoice", "Concepto", "Neto", "IVA", "IRPF", "Importe Bruto"]
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# PDF_PEREZOSA_MIN_PAGINAS: a partir de cuántas páginas se leen primero solo la
+#                           primera y la última (0 = leer siempre todas)
+# PDF_PAGINAS_POR_TROZO:    páginas intermedias por tarea cuando el pool las reparte
+PDF_PEREZOSA_MIN_PAGINAS = int(os.environ.get("PDF_PEREZOSA_MIN_PAGINAS", "3"))
+PDF_PAGINAS_POR_TROZO = int(os.environ.get("PDF_PAGINAS_POR_TROZO", "8"))
+
+
+@dataclass
+class LecturaParcial:
+    """Primera y última página no bastaron: faltan las intermedias (1..n_paginas-2)."""
+    n_paginas: int
+    primera: PaginaLayout
+    ultima: PaginaLayout
+
+
+def _fila(fields: Dict[str, Any]) -> Dict[str, Any]:
+    # Normalizar nombres
+    invoice = fields.get("Invoice") or fields.get("Factura") or fields.get("Nº factura")
+    return {
+        "Proveedor": fields.get("Proveedor"),
+        "Fecha": fields.get("Fecha"),
+        "Invoice": invoice,
+        "Concepto": fields.get("Concepto"),
+        "Neto": fields.get("Neto"),
+        "IVA": fields.get("IVA"),
+        "IRPF": fields.get("IRPF"),
+        "Importe Bruto": fields.get("Importe bruto") or fields.get("Total Bruto") or fields.get("Bruto"),
+        # Sin recortar a 22 caracteres: el contraste por contenido busca con estos
+        # (no son COLUMNAS_FACTURA, así que no salen en el Excel)
+        "Proveedor_full": fields.get("Proveedor_full") or fields.get("Proveedor"),
+        "Invoice_full": fields.get("Invoice_full") or invoice,
+    }
+
+
+def _paginas(pdf, desde: int, hasta: int) -> List[PaginaLayout]:
+    """Páginas [desde, hasta) como palabras con posición (texto = extract_text())."""
+    return [lee_pagina(pdf.pages[i]) for i in range(desde, hasta)]
+
+
+def fila_desde_paginas(paginas: List[PaginaLayout], nombre_archivo: str, modo: Optional[str] = None) -> Dict[str, Any]:
+    """Páginas (en orden) -> fila normalizada (dict con COLUMNAS_FACTURA)."""
+    return _fila(extract_fields(paginas, nombre_archivo, modo))
+
+
+def _lee_perezoso(
+    pdf, nombre_archivo: str, con_intermedias: bool, modo: Optional[str]
+) -> Union[Dict[str, Any], LecturaParcial]:
+    n = len(pdf.pages)
+    if PDF_PEREZOSA_MIN_PAGINAS <= 0 or n < max(3, PDF_PEREZOSA_MIN_PAGINAS):
+        return fila_desde_paginas(_paginas(pdf, 0, n), nombre_archivo, modo)
+
+    primera, ultima = _paginas(pdf, 0, 1)[0], _paginas(pdf, n - 1, n)[0]
+    fields = extract_fields([primera, ultima], nombre_archivo, modo)
+    if not fields.get("Faltan"):
+        return _fila(fields)
+    if not con_intermedias:
+        return LecturaParcial(n_paginas=n, primera=primera, ultima=ultima)
+    # Faltan campos: el documento entero, como si no hubiera lectura perezosa
+    return fila_desde_paginas([primera] + _paginas(pdf, 1, n - 1) + [ultima], nombre_archivo, modo)
+
+
+def parse_pdf_extremos(
+    pdf_bytes: bytes, nombre_archivo: str, modo: Optional[str] = None
+) -> Union[Dict[str, Any], LecturaParcial]:
+    """
+    Paso 1 de la lectura perezosa en el pool: la fila si basta con la primera y
+    la última página (o si el documento es corto y se ha leído entero); si no,
+    LecturaParcial para que el pool reparta las intermedias (read_pages).
+    """
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return _lee_perezoso(pdf, nombre_archivo, con_intermedias=False, modo=modo)
+
+
+def read_pages(pdf_bytes: bytes, desde: int, hasta: int) -> List[PaginaLayout]:
+    """Páginas [desde, hasta) (un trozo de las intermedias)."""
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return _paginas(pdf, desde, hasta)
+
+
+def trozos_intermedios(n_paginas: int, por_trozo: int = 0) -> List[tuple]:
+    """[(desde, hasta), ...] que cubren las páginas 1..n_paginas-2."""
+    por_trozo = por_trozo or PDF_PAGINAS_POR_TROZO
+    return [(a, min(a + por_trozo, n_paginas - 1)) for a in range(1, n_paginas - 1, max(1, por_trozo))]
+
+
+def parse_pdf_fields(pdf_bytes: bytes, nombre_archivo: str, modo: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Extrae las páginas (perezosamente, ver arriba) y devuelve la fila normalizada
+    (dict con COLUMNAS_FACTURA, más Proveedor_full/Invoice_full sin recortar)
+    con el motor de `modo`. Todo en un solo proceso.
+    """
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        return _lee_perezoso(pdf, nombre_archivo, con_intermedias=True, modo=modo)
+
+
+def parse_pdf_to_df(pdf_bytes: bytes, nombre_archivo: str, modo: Optional[str] = None) -> pd.DataFrame:
+    """
+    Usa el extractor estable (Neto + IVA + IRPF = Importe Bruto, tolerancia ±0,05),
+    corrige el patrón “21,00 % I.V.A. s/…”, y limpia incoherencias.
+    """
+    row = parse_pdf_fields(pdf_bytes, nombre_archivo, modo)
+    return pd.DataFrame([row], columns=COLUMNAS_FACTURA)
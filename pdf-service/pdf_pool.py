@@ -0,0 +1,183 @@
+# pdf_pool.py
+# Motor de extracción en paralelo para /api/pdf2excel.
+# Cada PDF (pdfplumber + regex del extractor) es trabajo CPU puro, así que se
+# reparte en un ProcessPoolExecutor y el event loop queda libre mientras tanto.
+# extract_many() devuelve todo junto; iter_extract() va dando cada archivo según
+# termina (para el streaming de /api/pdf2excel/stream).
+
+from __future__ import annotations
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import asyncio
+import multiprocessing
+import os
+import threading
+
+from extraction_cache import ExtractionCache
+from layout_extractor import valida_modo
+from pdf_parser import LecturaParcial, fila_desde_paginas, parse_pdf_extremos, read_pages, trozos_intermedios
+import profiling
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# PDF_POOL_WORKERS: nº de procesos (por defecto, nº de CPUs). 0 = sin procesos,
+#                   se extrae en un hilo del propio servidor (útil para depurar).
+# PDF_POOL_TIMEOUT: segundos máximos por archivo antes de darlo por perdido.
+PDF_POOL_WORKERS = int(os.environ.get("PDF_POOL_WORKERS", os.cpu_count() or 1))
+PDF_POOL_TIMEOUT = float(os.environ.get("PDF_POOL_TIMEOUT", "120"))
+
+
+class PdfExtractionError(Exception):
+    """Fallo al extraer un PDF concreto (incluye el nombre para el mensaje de error)."""
+
+    def __init__(self, nombre: str, causa: BaseException):
+        self.nombre = nombre
+        self.causa = causa
+        super().__init__(str(causa))
+
+
+class ExtractionPool:
+    """
+    Pool de extracción con nº de workers y timeout por archivo propios.
+    extract_many() devuelve las filas en el MISMO orden en que se subieron.
+
+    Nota: un archivo que agota el timeout se reporta como error, pero su
+    proceso sigue ocupado hasta que termine (no se puede matar uno suelto).
+    El timeout se aplica a cada tarea del archivo (extremos, cada trozo de
+    páginas intermedias, extractor final).
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.max_workers = PDF_POOL_WORKERS if max_workers is None else max_workers
+        self.timeout = PDF_POOL_TIMEOUT if timeout is None else timeout
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.max_workers <= 0:
+                    self._executor = ThreadPoolExecutor(max_workers=1)
+                else:
+                    # spawn también en Linux: hacer fork de un servidor con hilos es frágil
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+            return self._executor
+
+    def _reset_executor(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    async def _run(self, nombre: str, fn, *args) -> Any:
+        """Ejecuta fn(*args) en el pool con timeout; los fallos salen como PdfExtractionError."""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        if isinstance(executor, ThreadPoolExecutor):
+            # En hilos (workers=0) la extracción se puede perfilar (ver profiling.py)
+            fn = profiling.en_hilo(fn)
+        try:
+            fut = loop.run_in_executor(executor, fn, *args)
+            return await asyncio.wait_for(fut, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise PdfExtractionError(nombre, TimeoutError(f"tiempo agotado ({self.timeout:g} s)"))
+        except BrokenProcessPool as e:
+            # Un worker murió (p. ej. PDF que revienta pdfplumber): rehacemos el pool
+            self._reset_executor()
+            raise PdfExtractionError(nombre, e)
+        except Exception as e:
+            raise PdfExtractionError(nombre, e)
+
+    async def _extract_one(self, nombre: str, contenido: bytes, modo: str) -> Dict[str, Any]:
+        # Lectura perezosa (pdf_parser.py): primero primera + última página
+        res = await self._run(nombre, parse_pdf_extremos, contenido, nombre, modo)
+        if not isinstance(res, LecturaParcial):
+            return res
+        # Faltan campos: las páginas intermedias, en trozos repartidos entre los workers
+        trozos = await asyncio.gather(
+            *(self._run(nombre, read_pages, contenido, a, b) for a, b in trozos_intermedios(res.n_paginas))
+        )
+        paginas = [res.primera] + [p for trozo in trozos for p in trozo] + [res.ultima]
+        return await self._run(nombre, fila_desde_paginas, paginas, nombre, modo)
+
+    async def _extract_cached(
+        self, nombre: str, contenido: bytes, cache: Optional[ExtractionCache], modo: str
+    ) -> Dict[str, Any]:
+        if cache is None:
+            return await self._extract_one(nombre, contenido, modo)
+        clave = cache.key_for(contenido, modo)
+        # La caché toca SQLite (síncrono): fuera del event loop
+        fila = await asyncio.to_thread(cache.get, clave)
+        if fila is None:
+            fila = await self._extract_one(nombre, contenido, modo)
+            await asyncio.to_thread(cache.put, clave, fila)
+        return fila
+
+    async def iter_extract(
+        self,
+        archivos: List[Tuple[str, bytes]],
+        cache: Optional[ExtractionCache] = None,
+        modo: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[int, Any]]:
+        """
+        Igual que extract_many pero según van terminando: produce (índice, fila)
+        en orden de finalización; si un archivo falla, (índice, PdfExtractionError).
+        Si el consumidor deja de iterar, los archivos pendientes se cancelan.
+        """
+        modo = valida_modo(modo)
+
+        async def _uno(i: int, nombre: str, contenido: bytes) -> Tuple[int, Any]:
+            try:
+                return i, await self._extract_cached(nombre, contenido, cache, modo)
+            except PdfExtractionError as e:
+                return i, e
+            except Exception as e:  # p. ej. fallo de la caché
+                return i, PdfExtractionError(nombre, e)
+
+        tareas = [asyncio.ensure_future(_uno(i, n, c)) for i, (n, c) in enumerate(archivos)]
+        try:
+            for siguiente in asyncio.as_completed(tareas):
+                yield await siguiente
+        finally:
+            for t in tareas:
+                t.cancel()
+
+    async def extract_many(
+        self,
+        archivos: List[Tuple[str, bytes]],
+        cache: Optional[ExtractionCache] = None,
+        return_exceptions: bool = False,
+        progreso: Optional[Callable[[int, int], None]] = None,
+        modo: Optional[str] = None,
+    ) -> List[Any]:
+        """
+        Recibe [(nombre, bytes), ...] y devuelve [fila, ...] en el mismo orden.
+        Con `cache`, los PDFs ya vistos (mismo contenido y modo) no se vuelven a procesar.
+        `modo` = motor de extracción (texto | layout | auto; por defecto PDF_MODO_EXTRACCION).
+        Si algún archivo falla, lanza PdfExtractionError del primero (en orden de subida);
+        con return_exceptions=True, en su lugar devuelve el PdfExtractionError en esa posición.
+        `progreso(hechos, total)` se llama cada vez que termina un archivo (bien o mal).
+        """
+        resultados: List[Any] = [None] * len(archivos)
+        hechos = 0
+        async for i, fila in self.iter_extract(archivos, cache, modo):
+            resultados[i] = fila
+            hechos += 1
+            if progreso is not None:
+                progreso(hechos, len(archivos))
+        if not return_exceptions:
+            for r in resultados:
+                if isinstance(r, BaseException):
+                    raise r
+        return resultados
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,85 @@
+# preview.py
+# Vista previa de los resultados (pdf2excel, bankflowpro, contraste-facturas).
+#
+# Antes la vista previa solo viajaba en la cabecera X-Preview (JSON con
+# ensure_ascii=True: cada € o tilde ocupa 6 bytes), y con textos largos se
+# pasaba del límite de cabeceras de proxies / servidores. Ahora:
+#   - la vista previa completa (hasta PREVIEW_MAX_FILAS filas) se guarda junto
+#     al resultado del Job y se sirve en /api/jobs/{id}/preview, con nº de filas
+#     configurable y formato por filas (el de siempre) o por columnas (compacto);
+#   - X-Preview se sigue enviando para los clientes actuales, pero recortada
+#     para no pasar de PREVIEW_HEADER_MAX_BYTES (si no cabe nada, no se envía).
+#
+# Una vista previa es un dict JSON cuyas listas son las "filas" (p. ej.
+# {"Filas": 120, "Muestra": [{...}, ...]}); el resto de claves van tal cual.
+
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import json
+import os
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# PREVIEW_FILAS:            filas por defecto (cabecera y endpoint)
+# PREVIEW_MAX_FILAS:        filas que se guardan / máximo que se puede pedir
+# PREVIEW_HEADER_MAX_BYTES: tamaño máximo de la cabecera X-Preview
+PREVIEW_FILAS = int(os.environ.get("PREVIEW_FILAS", "50"))
+PREVIEW_MAX_FILAS = int(os.environ.get("PREVIEW_MAX_FILAS", "1000"))
+PREVIEW_HEADER_MAX_BYTES = int(os.environ.get("PREVIEW_HEADER_MAX_BYTES", "8192"))
+
+FORMATOS = ("filas", "columnas")
+
+
+def recorta(preview: Dict[str, Any], filas: int) -> Dict[str, Any]:
+    """Copia de la vista previa con cada lista cortada a `filas` elementos."""
+    return {k: (v[: max(0, filas)] if isinstance(v, list) else v) for k, v in preview.items()}
+
+
+def _columnas(filas: List[Any]) -> Any:
+    """[{a: 1, b: 2}, {a: 3, b: 4}] -> {"Columnas": [a, b], "Datos": [[1, 3], [2, 4]]}"""
+    if not filas or not all(isinstance(f, dict) for f in filas):
+        return filas
+    nombres: List[str] = []
+    for f in filas:
+        for k in f:
+            if k not in nombres:
+                nombres.append(k)
+    return {"Columnas": nombres, "Datos": [[f.get(k) for f in filas] for k in nombres]}
+
+
+def a_columnas(preview: Dict[str, Any]) -> Dict[str, Any]:
+    """Formato compacto: cada lista de filas se guarda por columnas (sin repetir claves)."""
+    return {k: (_columnas(v) if isinstance(v, list) else v) for k, v in preview.items()}
+
+
+def formatea(preview: Dict[str, Any], filas: Optional[int] = None, formato: str = "filas") -> Dict[str, Any]:
+    """Vista previa para el endpoint: `filas` (acotado a PREVIEW_MAX_FILAS) en el formato pedido."""
+    if formato not in FORMATOS:
+        raise ValueError(f"formato debe ser uno de {', '.join(FORMATOS)}")
+    n = PREVIEW_FILAS if filas is None else min(max(0, filas), PREVIEW_MAX_FILAS)
+    salida = recorta(preview, n)
+    return a_columnas(salida) if formato == "columnas" else salida
+
+
+def cabecera(preview: Dict[str, Any], max_bytes: Optional[int] = None) -> Optional[str]:
+    """
+    JSON para X-Preview (ensure_ascii=True, como siempre) con PREVIEW_FILAS filas
+    o las que quepan en max_bytes; None si ni sin filas cabe.
+    """
+    max_bytes = PREVIEW_HEADER_MAX_BYTES if max_bytes is None else max_bytes
+    largo = max((len(v) for v in preview.values() if isinstance(v, list)), default=0)
+    lo, hi = 0, min(PREVIEW_FILAS, largo)
+    texto = json.dumps(recorta(preview, hi), ensure_ascii=True)
+    if len(texto) <= max_bytes:
+        return texto
+    # Búsqueda binaria del mayor nº de filas que cabe
+    mejor: Optional[str] = None
+    while lo < hi:
+        medio = (lo + hi) // 2
+        candidato = json.dumps(recorta(preview, medio), ensure_ascii=True)
+        if len(candidato) <= max_bytes:
+            mejor, lo = candidato, medio + 1
+        else:
+            hi = medio
+    return mejor
@@ -0,0 +1,311 @@
+# profiling.py
+# Perfilado bajo demanda de una petición concreta (depuración de rendimiento).
+#
+# Con PROFILING_ACTIVO=1, una petición a /api/pdf2excel, /api/bankflowpro o
+# /api/contraste-facturas (o su variante /api/jobs/...) con la cabecera
+# "X-Profile: 1" se ejecuta perfilada y su respuesta trae X-Profile-Id y
+# X-Profile-Url. Del perfil se guardan en disco (PROFILING_DIR):
+#   - {id}.pstats:    volcado de cProfile (python -m pstats, snakeviz...);
+#   - {id}.collapsed: pilas muestreadas cada PROFILING_INTERVALO_MS, en formato
+#                     "colapsado" (una línea "a;b;c N" por pila), listo para
+#                     flamegraph.pl / speedscope;
+#   - {id}.json:      metadatos (endpoint, duración, nº de muestras, hilos).
+# y se descargan con GET /api/perfiles/{id}?formato=... (ver main.py).
+#
+# Qué se mide: los hilos que trabajan para el Job. jobs.py registra el hilo del
+# event loop mientras corre la tarea; en_hilo() registra los hilos de
+# asyncio.to_thread y del pool de extracción. Los PDFs de una petición perfilada
+# se extraen en un hilo del propio servidor y sin caché (main.py), para que lo
+# caro (pdfplumber, regex del extractor) aparezca en el perfil y no en otro
+# proceso. Lo que ejecute el event loop para otras peticiones mientras tanto
+# también cuenta: para un perfil limpio, mejor con el servidor sin otro tráfico.
+#
+# Solo un perfil a la vez (cProfile es un único perfilador por hilo); si llega
+# otra petición perfilada mientras tanto, se atiende sin perfilar.
+#
+# Desde Python 3.12 cProfile va sobre sys.monitoring y solo admite un perfilador
+# activo en todo el proceso: el segundo enable() lanza ValueError. Ese hilo se
+# queda entonces solo con el muestreo de pilas (el .collapsed lo incluye, el
+# .pstats no); el .json lo indica en "hilos_solo_muestreo".
+#
+# Desactivado por defecto: sin PROFILING_ACTIVO=1 la cabecera se ignora y los
+# endpoints de descarga responden 404, así que no se activa por descuido en
+# producción.
+
+from __future__ import annotations
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# PROFILING_ACTIVO:        "1" permite perfilar peticiones con la cabecera X-Profile (por defecto, no)
+# PROFILING_DIR:           carpeta donde se guardan los perfiles
+# PROFILING_MAX:           perfiles que se conservan (se borran los más antiguos)
+# PROFILING_INTERVALO_MS:  periodo del muestreo de pilas
+PROFILING_ACTIVO = os.environ.get("PROFILING_ACTIVO", "0") == "1"
+PROFILING_DIR = os.environ.get("PROFILING_DIR", os.path.join(tempfile.gettempdir(), "departamento-financiero-perfiles"))
+PROFILING_MAX = int(os.environ.get("PROFILING_MAX", "20"))
+PROFILING_INTERVALO_MS = float(os.environ.get("PROFILING_INTERVALO_MS", "5"))
+
+# Formatos descargables: formato -> (extensión, media type)
+FORMATOS = {
+    "collapsed": (".collapsed", "text/plain; charset=utf-8"),
+    "pstats": (".pstats", "application/octet-stream"),
+    "json": (".json", "application/json"),
+}
+
+_RX_ID = re.compile(r"[0-9a-f]{32}")
+_VALORES_SI = {"1", "true", "si", "sí", "yes"}
+
+
+def pedido(cabecera: Optional[str]) -> bool:
+    """¿La petición pide perfil (cabecera X-Profile) y el perfilado está permitido?"""
+    return PROFILING_ACTIVO and (cabecera or "").strip().lower() in _VALORES_SI
+
+
+# =========================
+# Perfil de una petición
+# =========================
+
+
+class Perfil:
+    """cProfile por hilo + muestreo de pilas de los hilos registrados."""
+
+    def __init__(self, perfil_id: str, endpoint: str, intervalo_ms: float = PROFILING_INTERVALO_MS):
+        self.id = perfil_id
+        self.endpoint = endpoint
+        self.intervalo = max(intervalo_ms, 0.5) / 1000
+        self.inicio = time.time()
+        self.duracion = 0.0
+        self.muestras = 0
+        self.pilas: Counter = Counter()
+        self._lock = threading.Lock()
+        self._hilos: Dict[int, str] = {}  # ident -> nombre (raíz de sus pilas)
+        self._perfiles: List[cProfile.Profile] = []
+        self.solo_muestreo = 0  # hilos sin cProfile (ver cabecera del módulo)
+        self._parar = threading.Event()
+        self._muestreador = threading.Thread(target=self._muestrea, name=f"perfil-{perfil_id[:8]}", daemon=True)
+
+    # ---------- hilos ----------
+
+    @contextmanager
+    def hilo(self) -> Iterator[None]:
+        """Perfila el hilo actual mientras dure el bloque."""
+        ident = threading.get_ident()
+        with self._lock:
+            if ident in self._hilos:  # ya registrado (bloques anidados)
+                anidado = True
+            else:
+                anidado = False
+                self._hilos[ident] = threading.current_thread().name
+        if anidado:
+            yield
+            return
+        prof: Optional[cProfile.Profile] = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # 3.12+: ya hay otro cProfile activo en el proceso
+            prof = None
+            with self._lock:
+                self.solo_muestreo += 1
+        try:
+            yield
+        finally:
+            if prof is not None:
+                prof.disable()
+            with self._lock:
+                self._hilos.pop(ident, None)
+                if prof is not None:
+                    self._perfiles.append(prof)
+
+    # ---------- muestreo ----------
+
+    def _muestrea(self) -> None:
+        while not self._parar.wait(self.intervalo):
+            with self._lock:
+                hilos = dict(self._hilos)
+            if not hilos:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, nombre in hilos.items():
+                    frame = frames.get(ident)
+                    # El event loop esperando en select() no es trabajo: no se anota
+                    if frame is not None and not frame.f_code.co_filename.endswith("selectors.py"):
+                        self.pilas[_colapsa(nombre, frame)] += 1
+                self.muestras += 1
+
+    def empieza(self) -> None:
+        self._muestreador.start()
+
+    def termina(self) -> None:
+        self._parar.set()
+        self._muestreador.join()
+        self.duracion = time.time() - self.inicio
+
+    # ---------- disco ----------
+
+    def guarda(self, carpeta: str = PROFILING_DIR) -> None:
+        os.makedirs(carpeta, exist_ok=True)
+        base = os.path.join(carpeta, self.id)
+        with self._lock:
+            perfiles = list(self._perfiles)
+            pilas = dict(self.pilas)
+        if perfiles:
+            stats = pstats.Stats(perfiles[0], stream=io.StringIO())
+            for prof in perfiles[1:]:
+                stats.add(prof)
+            stats.dump_stats(base + ".pstats")
+        with open(base + ".collapsed", "w", encoding="utf-8") as fh:
+            for pila, n in sorted(pilas.items(), key=lambda kv: -kv[1]):
+                fh.write(f"{pila} {n}\n")
+        meta = {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "inicio": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.inicio)),
+            "duracion_s": round(self.duracion, 3),
+            "muestras": self.muestras,
+            "intervalo_ms": self.intervalo * 1000,
+            "hilos_perfilados": len(perfiles),
+            "hilos_solo_muestreo": self.solo_muestreo,
+            "formatos": [f for f, (ext, _) in FORMATOS.items() if os.path.exists(base + ext)],
+        }
+        with open(base + ".json", "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, ensure_ascii=False, indent=2)
+        _recorta(carpeta, PROFILING_MAX)
+
+
+def _nombre_frame(frame) -> str:
+    co = frame.f_code
+    return f"{co.co_qualname} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})".replace(";", ",")
+
+
+def _colapsa(hilo: str, frame) -> str:
+    partes: List[str] = []
+    while frame is not None:
+        partes.append(_nombre_frame(frame))
+        frame = frame.f_back
+    partes.append(hilo.replace(";", ",").replace(" ", "_"))
+    return ";".join(reversed(partes))
+
+
+def _recorta(carpeta: str, maximo: int) -> None:
+    """Deja solo los `maximo` perfiles más recientes."""
+    metas = sorted(
+        (os.path.join(carpeta, n) for n in os.listdir(carpeta) if n.endswith(".json")),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for meta in metas[max(maximo, 1):]:
+        base = meta[: -len(".json")]
+        for ext, _ in FORMATOS.values():
+            try:
+                os.remove(base + ext)
+            except OSError:
+                pass
+
+
+# =========================
+# Perfil en curso (ContextVar, como la traza de metrics.py)
+# =========================
+
+_perfil: ContextVar[Optional[Perfil]] = ContextVar("perfil_en_curso", default=None)
+_uno_a_la_vez = threading.Lock()
+
+
+def perfil_actual() -> Optional[Perfil]:
+    return _perfil.get()
+
+
+@contextmanager
+def perfila(perfil_id: str, endpoint: str, activo: bool = True) -> Iterator[Optional[Perfil]]:
+    """
+    Perfila el bloque (el hilo actual y los que se registren con en_hilo()) y
+    guarda el perfil al salir. Devuelve None si no se perfila (no pedido,
+    desactivado u otro perfil en curso).
+    """
+    if not (activo and PROFILING_ACTIVO) or not _uno_a_la_vez.acquire(blocking=False):
+        yield None
+        return
+    p = Perfil(perfil_id, endpoint)
+    token = _perfil.set(p)
+    try:
+        p.empieza()
+        with p.hilo():
+            yield p
+    finally:
+        _perfil.reset(token)
+        p.termina()
+        try:
+            p.guarda()
+        finally:
+            _uno_a_la_vez.release()
+
+
+def en_hilo(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Envuelve fn para que, si hay un perfil en curso al envolverla, el hilo que
+    la ejecute (to_thread, pool de hilos) también se perfile. Sin perfil, fn tal cual.
+    """
+    p = _perfil.get()
+    if p is None:
+        return fn
+
+    @functools.wraps(fn)
+    def _perfilada(*args, **kwargs):
+        with p.hilo():
+            return fn(*args, **kwargs)
+
+    return _perfilada
+
+
+# =========================
+# Consulta de perfiles guardados
+# =========================
+
+
+def ruta(perfil_id: str, formato: str, carpeta: str = PROFILING_DIR) -> Optional[str]:
+    """Ruta del archivo del perfil en ese formato (None si el id/formato no es válido o no existe)."""
+    if not _RX_ID.fullmatch(perfil_id) or formato not in FORMATOS:
+        return None
+    r = os.path.join(carpeta, perfil_id + FORMATOS[formato][0])
+    return r if os.path.exists(r) else None
+
+
+def resumen(perfil_id: str, filas: int = 60, orden: str = "cumulative", carpeta: str = PROFILING_DIR) -> Optional[str]:
+    """Las `filas` funciones más caras del .pstats, como texto (python -m pstats)."""
+    r = ruta(perfil_id, "pstats", carpeta)
+    if r is None:
+        return None
+    salida = io.StringIO()
+    pstats.Stats(r, stream=salida).strip_dirs().sort_stats(orden).print_stats(filas)
+    return salida.getvalue()
+
+
+def lista(carpeta: str = PROFILING_DIR) -> List[Dict[str, Any]]:
+    """Metadatos de los perfiles guardados, del más reciente al más antiguo."""
+    if not os.path.isdir(carpeta):
+        return []
+    metas = []
+    for nombre in os.listdir(carpeta):
+        if nombre.endswith(".json"):
+            try:
+                with open(os.path.join(carpeta, nombre), encoding="utf-8") as fh:
+                    metas.append(json.load(fh))
+            except (OSError, ValueError):
+                pass
+    return sorted(metas, key=lambda m: m.get("inicio", ""), reverse=True)
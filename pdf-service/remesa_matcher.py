@@ -0,0 +1,109 @@
+# remesa_matcher.py
+# Reparto de líneas de detalle entre remesas del extracto (suma de subconjuntos).
+#
+# Caso típico: dos remesas en días consecutivos. La ventana ±1 día de cada una
+# contiene las líneas de AMBAS, así que la suma completa no cuadra con ninguna.
+# Aquí se busca, para una remesa, un subconjunto de las líneas candidatas cuya
+# suma (en céntimos enteros) coincida con el importe del extracto.
+#
+# Búsqueda en profundidad con poda (branch & bound):
+#   - las candidatas llegan ordenadas por preferencia (más cercanas en fecha
+#     primero), así la primera solución encontrada es la "más cercana";
+#   - se poda si la suma parcial se pasa del objetivo o si ni sumando todo lo
+#     que queda se llega;
+#   - los estados (línea, suma parcial) ya fallidos se memorizan (programación
+#     dinámica sobre céntimos: el trabajo queda acotado por nº líneas × objetivo);
+#   - presupuesto de tiempo: si se agota, no hay reparto y el llamador mantiene
+#     el comportamiento de siempre (aviso "No cuadra remesa").
+
+from __future__ import annotations
+from typing import List, Optional, Sequence
+import os
+import time
+
+# =========================
+# Configuración (variables de entorno)
+# =========================
+# BANKFLOW_REMESA_MAX_LINEAS:    máximo de líneas candidatas por remesa (las más cercanas en fecha)
+# BANKFLOW_REMESA_PRESUPUESTO_MS: tiempo máximo de búsqueda por remesa
+BANKFLOW_REMESA_MAX_LINEAS = int(os.environ.get("BANKFLOW_REMESA_MAX_LINEAS", "200"))
+BANKFLOW_REMESA_PRESUPUESTO_MS = float(os.environ.get("BANKFLOW_REMESA_PRESUPUESTO_MS", "250"))
+
+# Cada cuántos nodos se mira el reloj
+_NODOS_POR_CHEQUEO = 1024
+
+
+class _PresupuestoAgotado(Exception):
+    pass
+
+
+def a_centimos(importe: float) -> int:
+    """Importe en euros -> céntimos enteros (valor absoluto)."""
+    return int(round(abs(float(importe or 0.0)) * 100))
+
+
+def buscar_subconjunto(
+    importes_cent: Sequence[int],
+    objetivo_cent: int,
+    tolerancia_cent: int = 2,
+    max_lineas: Optional[int] = None,
+    presupuesto_ms: Optional[float] = None,
+) -> Optional[List[int]]:
+    """
+    Índices (sobre `importes_cent`, en orden ascendente) de un subconjunto cuya
+    suma esté a ±tolerancia_cent del objetivo, o None si no hay / se agota el tiempo.
+    `importes_cent` debe venir ya ordenado por preferencia; solo se usan las
+    primeras `max_lineas`. Las líneas de 0 céntimos nunca se eligen.
+    """
+    max_lineas = BANKFLOW_REMESA_MAX_LINEAS if max_lineas is None else max_lineas
+    presupuesto_ms = BANKFLOW_REMESA_PRESUPUESTO_MS if presupuesto_ms is None else presupuesto_ms
+
+    items = [(i, c) for i, c in enumerate(importes_cent[:max_lineas]) if c > 0]
+    if objetivo_cent <= tolerancia_cent or not items:
+        return None
+    n = len(items)
+    valores = [c for _, c in items]
+
+    # resto[k] = suma de valores[k:] (cota superior de lo que aún se puede añadir)
+    resto = [0] * (n + 1)
+    for k in range(n - 1, -1, -1):
+        resto[k] = resto[k + 1] + valores[k]
+
+    minimo = objetivo_cent - tolerancia_cent
+    maximo = objetivo_cent + tolerancia_cent
+    if resto[0] < minimo:
+        return None
+
+    limite = time.monotonic() + presupuesto_ms / 1000.0
+    fallidos: set = set()
+    elegidos: List[int] = []
+    nodos = 0
+
+    def dfs(k: int, suma: int) -> bool:
+        nonlocal nodos
+        if minimo <= suma <= maximo:
+            return True
+        if k >= n or suma + resto[k] < minimo:
+            return False
+        if (k, suma) in fallidos:
+            return False
+        nodos += 1
+        if nodos % _NODOS_POR_CHEQUEO == 0 and time.monotonic() > limite:
+            raise _PresupuestoAgotado()
+        v = valores[k]
+        if suma + v <= maximo:
+            elegidos.append(k)
+            if dfs(k + 1, suma + v):
+                return True
+            elegidos.pop()
+        if dfs(k + 1, suma):
+            return True
+        fallidos.add((k, suma))
+        return False
+
+    try:
+        if not dfs(0, 0):
+            return None
+    except (_PresupuestoAgotado, RecursionError):
+        return None
+    return sorted(items[k][0] for k in elegidos)
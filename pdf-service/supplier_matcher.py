@@ -0,0 +1,132 @@
+# supplier_matcher.py
+# Búsqueda de proveedores conocidos (proveedores.json) en el texto de una factura.
+#
+# proveedores.json (generado por rellenar_proveedores_json.py) tiene 500+ claves
+# en minúsculas ("momentum", "momentum arquitectura", ...) -> nombre completo.
+# En vez de probar clave a clave, se construye UNA vez un autómata Aho-Corasick
+# con todas ellas y se recorre el texto en una sola pasada lineal. Si aparecen
+# varias claves gana la más larga (la más específica); a igual longitud, la
+# que aparece antes en el texto.
+#
+# El autómata se reconstruye solo si proveedores.json cambia en disco.
+
+from __future__ import annotations
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import threading
+import time
+
+
+class AhoCorasick:
+    """Autómata Aho-Corasick (DFA completo) sobre un conjunto de claves."""
+
+    def __init__(self, keys: List[str]):
+        self.keys = list(keys)
+        goto: List[Dict[str, int]] = [{}]
+        out: List[int] = [-1]
+        for i, key in enumerate(self.keys):
+            node = 0
+            for ch in key:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    out.append(-1)
+                    goto[node][ch] = nxt
+                node = nxt
+            out[node] = i
+
+        # Enlaces de fallo por BFS; de paso se completa la tabla de transiciones
+        # (así el recorrido no tiene que seguir enlaces de fallo) y se guarda en
+        # cada nodo la clave más larga que termina ahí (la propia o la de su fallo).
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(g) for g in goto]
+        best = out[:]
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            f = fail[node]
+            if best[node] < 0:
+                best[node] = best[f]
+            for ch, tgt in delta[f].items():
+                delta[node].setdefault(ch, tgt)
+            for ch, child in goto[node].items():
+                queue.append(child)
+                fail[child] = delta[f].get(ch, 0) if node else 0
+        self._delta = delta
+        self._best = best
+
+    def find_all(self, text: str) -> Dict[int, int]:
+        """{índice de clave: posición final de su primera aparición} (las más largas por posición)."""
+        delta = self._delta
+        best = self._best
+        found: Dict[int, int] = {}
+        node = 0
+        for pos, ch in enumerate(text):
+            node = delta[node].get(ch, 0)
+            k = best[node]
+            if k >= 0 and k not in found:
+                found[k] = pos
+        return found
+
+    def longest(self, text: str) -> Optional[str]:
+        found = self.find_all(text)
+        if not found:
+            return None
+        k = min(found, key=lambda i: (-len(self.keys[i]), found[i]))
+        return self.keys[k]
+
+
+class SupplierMatcher:
+    """Proveedores de un JSON {clave: nombre completo} con recarga si cambia el archivo."""
+
+    # Como mucho un stat() del JSON cada estos segundos
+    CHECK_INTERVAL = 2.0
+
+    def __init__(self, path_json: str):
+        self.path_json = path_json
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._suppliers: Dict[str, str] = {}
+        self._automaton: Optional[AhoCorasick] = None
+        self._reload_if_changed(force=True)
+
+    def _reload_if_changed(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path_json).st_mtime
+            except OSError:
+                mtime = None
+            if not force and mtime == self._mtime:
+                return
+            self._mtime = mtime
+            suppliers: Dict[str, str] = {}
+            if mtime is not None:
+                try:
+                    with open(self.path_json, "r", encoding="utf-8") as f:
+                        suppliers = {str(k).lower(): v for k, v in json.load(f).items() if k}
+                except Exception:
+                    suppliers = {}
+            self._suppliers = suppliers
+            self._automaton = AhoCorasick(list(suppliers)) if suppliers else None
+
+    @property
+    def suppliers(self) -> Dict[str, str]:
+        self._reload_if_changed()
+        return self._suppliers
+
+    def match(self, text: str) -> Optional[Tuple[str, str]]:
+        """(clave, nombre completo) de la clave más larga presente en `text`, o None."""
+        self._reload_if_changed()
+        automaton, suppliers = self._automaton, self._suppliers
+        if automaton is None or not text:
+            return None
+        key = automaton.longest(text.lower())
+        return (key, suppliers[key]) if key is not None else None
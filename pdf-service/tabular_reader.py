@@ -0,0 +1,340 @@
+# tabular_reader.py
+# Lectura de extractos / detalles de remesa subidos como CSV o Excel.
+#
+# CSV: el archivo subido (UploadFile.file, un SpooledTemporaryFile) se lee tal cual,
+# sin copiarlo entero a memoria: de los primeros KB se deducen codificación y
+# separador, y luego el motor C de pandas lo recorre por bloques. Si el motor C
+# no puede con el archivo (comillas raras, nº de campos irregular...) se
+# reintenta con el motor python, como se hacía antes.
+#
+# Excel: libro en modo solo lectura (streaming); de cada hoja se miran solo las
+# 30 primeras filas para encontrar la cabecera y el resto se vuelca directamente
+# a columnas. Si python-calamine está instalado se usa en lugar de openpyxl.
+# El resultado es el mismo DataFrame que daba pd.ExcelFile(...).parse(dtype=str)
+# + fillna(""): enteros sin ".0", fechas "AAAA-MM-DD HH:MM:SS", marcadores de
+# NA de pandas y celdas de error como "", columnas "Unnamed: N" / "X.1".
+
+from __future__ import annotations
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+from typing import Any, BinaryIO, Iterable, Iterator, List, Optional, Sequence, Tuple
+import codecs
+import csv
+import unicodedata
+import pandas as pd
+
+try:  # backend rápido opcional
+    from python_calamine import CalamineWorkbook
+except ImportError:  # pragma: no cover
+    CalamineWorkbook = None
+
+# Bytes que se miran para deducir codificación y separador
+SNIFF_BYTES = 64 * 1024
+
+# Separadores candidatos, por orden de preferencia en caso de empate
+SEPARADORES = [";", ",", "\t", "|"]
+
+
+def _sniff_encoding(head: bytes) -> str:
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # final=False: un carácter multibyte cortado al final del bloque no es error
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        # Exportaciones de banca en Windows
+        return "cp1252"
+
+
+def _sniff_separator(texto: str) -> str:
+    """Separador más consistente en las primeras líneas (fuera de comillas)."""
+    lineas = [l for l in texto.splitlines()[:50] if l.strip()]
+    if len(lineas) > 1:
+        lineas = lineas[:-1]  # la última puede estar cortada
+    mejor, mejor_puntos = SEPARADORES[0], (0, 0)
+    for sep in SEPARADORES:
+        try:
+            cuentas = [len(fila) - 1 for fila in csv.reader(lineas, delimiter=sep)]
+        except csv.Error:
+            continue
+        if not cuentas or max(cuentas) == 0:
+            continue
+        # Preferimos el que da el mismo nº de campos en más líneas, y luego más campos
+        moda = max(set(cuentas), key=cuentas.count)
+        puntos = (cuentas.count(moda), moda) if moda > 0 else (0, 0)
+        if puntos > mejor_puntos:
+            mejor, mejor_puntos = sep, puntos
+    return mejor
+
+
+def sniff_csv(fh: BinaryIO) -> Tuple[str, str]:
+    """(codificación, separador) a partir de los primeros SNIFF_BYTES; deja fh al principio."""
+    fh.seek(0)
+    head = fh.read(SNIFF_BYTES)
+    fh.seek(0)
+    encoding = _sniff_encoding(head)
+    texto = head.decode(encoding.replace("-sig", ""), errors="ignore")
+    return encoding, _sniff_separator(texto)
+
+
+def read_csv_stream(fh: BinaryIO) -> pd.DataFrame:
+    """
+    CSV -> DataFrame (todo en str, vacíos como ""), leyendo el archivo por bloques.
+    """
+    encoding, sep = sniff_csv(fh)
+    otros: List[str] = [s for s in (";", ",") if s != sep]
+
+    intentos = [(sep, "c")] + [(sep, "python")] + [(s, "python") for s in otros]
+    ultimo_error: Exception | None = None
+    for separador, motor in intentos:
+        fh.seek(0)
+        try:
+            df = pd.read_csv(
+                fh, sep=separador, dtype=str, encoding=encoding, engine=motor,
+                encoding_errors="replace",
+            )
+            return df.fillna("")
+        except (pd.errors.ParserError, UnicodeDecodeError, csv.Error, ValueError) as e:
+            ultimo_error = e
+    raise RuntimeError(f"Lectura CSV falló: {type(ultimo_error).__name__}: {ultimo_error}")
+
+
+# =========================
+# Excel
+# =========================
+
+# Filas que se miran para encontrar la cabecera
+HEADER_SCAN_ROWS = 30
+
+# Textos que pandas (read_excel/read_csv) convierte en NaN por defecto
+_NA_STRINGS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+# Celdas de error de Excel (pandas también las deja en NaN)
+_EXCEL_ERRORS = frozenset(["#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"])
+
+
+def _norm_cell(x: Any) -> str:
+    s = str(x or "").strip().lower()
+    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+    return s.replace("\n", " ").replace("\r", " ")
+
+
+def find_header_row(rows: Sequence[Sequence[str]]) -> Optional[int]:
+    """
+    Busca la fila de cabecera detectando patrones:
+    1. Extracto: (fecha + concepto + importe)
+    2. Remesa: (importe + (beneficiario/proveedor/nombre o concepto))
+    """
+    for i, row in enumerate(rows[:HEADER_SCAN_ROWS]):
+        row_vals = [_norm_cell(v) for v in row]
+        if not any(row_vals):
+            continue
+
+        has_fecha = any("fecha" in v for v in row_vals)
+        has_concepto = any("concepto" in v for v in row_vals)
+        has_importe = any("importe" in v for v in row_vals)
+        has_beneficiario = any(
+            any(k in v for k in ["beneficiario", "proveedor", "nombre", "destinatario"])
+            for v in row_vals
+        )
+
+        # Patrón 1: Extracto bancario
+        if has_fecha and has_concepto and has_importe:
+            return i
+        # Patrón 2: Detalle de remesa
+        if has_importe and (has_beneficiario or has_concepto):
+            return i
+    return None
+
+
+def _celda(v: Any) -> Any:
+    """Valor de celda como lo deja el lector de pandas (antes de pasar a str)."""
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, (int, float)):
+        try:
+            n = int(v)
+        except (OverflowError, ValueError):
+            return v
+        return n if n == v else float(v)
+    if isinstance(v, date) and not isinstance(v, datetime):
+        return datetime.combine(v, time())
+    if isinstance(v, timedelta):
+        return pd.Timedelta(v)
+    return v
+
+
+def _celda_str(v: Any) -> str:
+    """Valor final de la celda en el DataFrame (dtype=str + fillna(""))."""
+    if isinstance(v, str):
+        return "" if (v in _NA_STRINGS or v in _EXCEL_ERRORS) else v
+    return str(v)
+
+
+def _recorta(row: Iterable[Any]) -> List[Any]:
+    fila = [_celda(v) for v in row]
+    while fila and fila[-1] == "":
+        fila.pop()
+    return fila
+
+
+def _nombres_columnas(cabecera: List[Any], ancho: int) -> List[Any]:
+    """Nombres como pandas: vacías -> 'Unnamed: i', duplicadas -> 'X.1', 'X.2'..."""
+    nombres: List[Any] = []
+    for i, c in enumerate(list(cabecera) + [""] * (ancho - len(cabecera))):
+        if isinstance(c, str) and c == "":
+            c = f"Unnamed: {i}"
+        elif isinstance(c, str) and c in _EXCEL_ERRORS:
+            c = float("nan")
+        nombres.append(c)
+    vistos: defaultdict = defaultdict(int)
+    for i, col in enumerate(nombres):
+        n = vistos[col]
+        while n > 0:
+            vistos[col] = n + 1
+            col = f"{col}.{n}"
+            n = vistos[col]
+        nombres[i] = col
+        vistos[col] = n + 1
+    return nombres
+
+
+class _Hoja:
+    """Filas de una hoja (ya recortadas) leídas bajo demanda."""
+
+    def __init__(self, filas: Iterator[Iterable[Any]]):
+        self._filas = filas
+        self.cabeza: List[List[Any]] = []
+
+    def lee_cabeza(self, n: int) -> List[List[Any]]:
+        while len(self.cabeza) < n:
+            try:
+                self.cabeza.append(_recorta(next(self._filas)))
+            except StopIteration:
+                break
+        return self.cabeza
+
+    def a_dataframe(self, header: int) -> pd.DataFrame:
+        """
+        Resto de la hoja -> DataFrame con la fila `header` como cabecera.
+        Cada fila de datos se vuelca según llega a las listas por columna (la
+        hoja no se guarda entera como filas). Las filas vacías quedan pendientes
+        y solo se añaden si después viene otra con datos: las del final se descartan.
+        """
+        cabecera: List[Any] = []
+        ancho = 0           # el mayor de las filas hasta la cabecera (incluida)
+        cols: List[List[str]] = []
+        n_datos = 0         # filas de datos ya volcadas en cols
+        n_filas = 0         # filas hasta la última no vacía (incluida)
+        previa = header     # índice de la última fila volcada (o la cabecera)
+        for i, f in enumerate(chain(self.cabeza, map(_recorta, self._filas))):
+            if i == header:
+                cabecera = f
+            if not f:
+                continue
+            n_filas = i + 1
+            if i <= header:
+                ancho = max(ancho, len(f))
+                continue
+            if len(f) > len(cols):
+                cols.extend([""] * n_datos for _ in range(len(f) - len(cols)))
+            pendientes = i - previa - 1  # filas vacías entre la anterior y esta
+            if pendientes:
+                for c in cols:
+                    c.extend([""] * pendientes)
+                n_datos += pendientes
+            for j, c in enumerate(cols):
+                c.append(_celda_str(f[j]) if j < len(f) else "")
+            n_datos += 1
+            previa = i
+        if not n_filas:
+            return pd.DataFrame()
+        if header >= n_filas:
+            raise ValueError(f"la hoja no tiene fila {header}")
+
+        ancho = max(ancho, len(cols))
+        cols.extend([""] * n_datos for _ in range(ancho - len(cols)))
+        columnas = _nombres_columnas(cabecera, ancho)
+        df = pd.DataFrame({j: c for j, c in enumerate(cols)}, dtype=str)
+        df.columns = columnas
+        return df
+
+
+class _LibroOpenpyxl:
+    def __init__(self, fh: BinaryIO):
+        from openpyxl import load_workbook
+        self._wb = load_workbook(fh, read_only=True, data_only=True, keep_links=False)
+        self.sheet_names = self._wb.sheetnames
+
+    def hoja(self, nombre: str) -> _Hoja:
+        ws = self._wb[nombre]
+        ws.reset_dimensions()  # algunas exportaciones declaran mal el rango
+        return _Hoja(ws.iter_rows(values_only=True))
+
+    def close(self) -> None:
+        self._wb.close()
+
+
+class _LibroCalamine:
+    def __init__(self, fh: BinaryIO):
+        self._wb = CalamineWorkbook.from_filelike(fh)
+        self.sheet_names = list(self._wb.sheet_names)
+
+    def hoja(self, nombre: str) -> _Hoja:
+        filas = self._wb.get_sheet_by_name(nombre).to_python(skip_empty_area=False)
+        return _Hoja(iter(filas))
+
+    def close(self) -> None:
+        pass
+
+
+def _abre_libro(fh: BinaryIO):
+    if CalamineWorkbook is not None:
+        try:
+            fh.seek(0)
+            return _LibroCalamine(fh)
+        except Exception:
+            pass
+    fh.seek(0)
+    return _LibroOpenpyxl(fh)
+
+
+def read_excel_stream(fh: BinaryIO) -> pd.DataFrame:
+    """
+    Excel -> DataFrame (todo en str) saltando metadatos (logo, titular, cuenta...):
+    la cabecera se detecta por contenido en las primeras filas de cada hoja.
+    """
+    try:
+        libro = _abre_libro(fh)
+    except Exception as e:
+        raise RuntimeError(f"Lectura Excel falló: {type(e).__name__}: {e}")
+
+    try:
+        # Recorre hojas y detecta cabecera por contenido
+        for sheet in libro.sheet_names:
+            try:
+                hoja = libro.hoja(sheet)
+                hdr_row = find_header_row(
+                    [[_celda_str(v) for v in f] for f in hoja.lee_cabeza(HEADER_SCAN_ROWS)]
+                )
+                if hdr_row is None:
+                    continue
+                df = hoja.a_dataframe(hdr_row)
+            except Exception:
+                continue
+            if df.shape[1] >= 2:  # Solo necesita 2+ columnas
+                return df
+
+        # Fallback: primera hoja tal cual (probablemente fallará pero es el último recurso)
+        try:
+            return libro.hoja(libro.sheet_names[0]).a_dataframe(0)
+        except Exception as e:
+            raise RuntimeError(f"Excel parse sin cabecera también falló: {type(e).__name__}: {e}")
+    finally:
+        libro.close()
@@ -0,0 +1,190 @@
+# xlsx_writer.py
+# Escritura de los Excel de salida (pdf2excel, bankflowpro) con xlsxwriter.
+#
+# Antes: to_excel con openpyxl y luego varias vueltas celda a celda para poner
+# formatos, bordes, anchos y sombreados (un objeto de estilo por celda).
+# Ahora: cada formato distinto se crea UNA vez (por columna / tipo de valor /
+# fila sombreada) y las filas se escriben en orden en modo constant_memory,
+# así que la memoria no crece con el nº de filas.
+#
+# El aspecto es el mismo que el de las hojas anteriores: mismos colores,
+# bordes, alineaciones, formatos numéricos y anchos de columna.
+#
+# El "plan" de estilo (SheetStyle) se calcula antes de escribir, por columnas
+# (anchos con column_widths, máscara de filas sombreadas con operaciones de
+# pandas/NumPy); write_sheet solo lo aplica.
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import io
+import math
+import numbers
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+# Ancho de un carácter en píxeles (fuente por defecto, Calibri 11)
+_PX_POR_CARACTER = 7
+
+
+@dataclass
+class SheetStyle:
+    """
+    Estilo de una hoja. Los formatos son dicts de xlsxwriter.
+      header:          formato de la fila de cabecera
+      number_formats:  por columna, formato de las celdas numéricas (None = sin formato)
+      text_formats:    por columna, formato del resto de celdas (texto / vacías)
+      widths:          por columna, ancho en caracteres (como column_dimensions de openpyxl)
+      row_fill:        máscara booleana por fila de datos; esas filas llevan fill_color
+    """
+    header: Dict[str, Any]
+    number_formats: List[Optional[Dict[str, Any]]]
+    text_formats: List[Optional[Dict[str, Any]]]
+    widths: Sequence[float]
+    row_fill: Optional[np.ndarray] = None
+    fill_color: Optional[str] = None
+    hide_gridlines: bool = True
+
+
+def _es_numero(v: Any) -> bool:
+    return isinstance(v, numbers.Number) and not (isinstance(v, float) and math.isnan(v))
+
+
+def _es_vacio(v: Any) -> bool:
+    return v is None or (isinstance(v, float) and math.isnan(v)) or v is pd.NA or v is pd.NaT
+
+
+class _Formatos:
+    """Formatos de xlsxwriter creados bajo demanda y reutilizados."""
+
+    def __init__(self, wb: xlsxwriter.Workbook, style: SheetStyle):
+        self._wb = wb
+        self._style = style
+        self._hechos: Dict[tuple, Any] = {}
+
+    def get(self, col: int, numerico: bool, sombreado: bool):
+        clave = (col, numerico, sombreado)
+        if clave in self._hechos:
+            return self._hechos[clave]
+        base = (self._style.number_formats if numerico else self._style.text_formats)[col]
+        props = dict(base or {})
+        if sombreado and self._style.fill_color:
+            props.update({"pattern": 1, "bg_color": self._style.fill_color})
+        fmt = self._wb.add_format(props) if props else None
+        self._hechos[clave] = fmt
+        return fmt
+
+
+def write_sheet(wb: xlsxwriter.Workbook, df: pd.DataFrame, sheet_name: str, style: SheetStyle) -> None:
+    """Escribe `df` (cabecera + filas) en una hoja nueva con el estilo dado."""
+    ws = wb.add_worksheet(sheet_name)
+    if style.hide_gridlines:
+        ws.hide_gridlines(2)
+
+    for c, w in enumerate(style.widths):
+        # Con píxeles el ancho guardado queda exactamente en `w` caracteres
+        ws.set_column_pixels(c, c, int(round(w * _PX_POR_CARACTER)))
+
+    header_fmt = wb.add_format(style.header)
+    for c, name in enumerate(df.columns):
+        ws.write_string(0, c, str(name), header_fmt)
+
+    formatos = _Formatos(wb, style)
+    columnas = [df[c].tolist() for c in df.columns]
+    sombra = style.row_fill if style.row_fill is not None else np.zeros(len(df), dtype=bool)
+
+    for r in range(len(df)):
+        fila = r + 1
+        sombreado = bool(sombra[r])
+        for c, valores in enumerate(columnas):
+            v = valores[r]
+            if _es_vacio(v):
+                fmt = formatos.get(c, False, sombreado)
+                if fmt is not None:
+                    ws.write_blank(fila, c, None, fmt)
+            elif isinstance(v, bool):
+                ws.write_boolean(fila, c, v, formatos.get(c, True, sombreado))
+            elif _es_numero(v):
+                ws.write_number(fila, c, float(v), formatos.get(c, True, sombreado))
+            else:
+                ws.write_string(fila, c, str(v), formatos.get(c, False, sombreado))
+
+
+# =========================
+# Anchos de columna (vectorizados)
+# =========================
+
+
+def _vacios(col: pd.Series) -> np.ndarray:
+    return col.isna().to_numpy()
+
+
+def text_width(col: pd.Series) -> int:
+    """max(len(str(v))) de la columna; las celdas vacías cuentan 0."""
+    if col.empty:
+        return 0
+    largos = col.astype(str).str.len().to_numpy()
+    largos = np.where(_vacios(col), 0, largos)
+    return int(largos.max())
+
+
+def eu_number_width(col: pd.Series) -> int:
+    """
+    Igual que max(len(f"{v:,.2f}") si v es número, len(str(v)) si no, 0 si vacío).
+    La longitud de f"{v:,.2f}" solo crece con |v| (por signo, -0.0 incluido),
+    así que basta formatear el mayor positivo y el mayor negativo.
+    """
+    if col.empty:
+        return 0
+    vacios = _vacios(col)
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        numeros = col.to_numpy(dtype=float)
+        es_num = ~vacios
+        ancho_texto = 0
+    else:
+        valores = col.tolist()
+        es_num = np.fromiter((_es_numero(v) for v in valores), dtype=bool, count=len(valores))
+        numeros = np.array([float(v) if n else 0.0 for v, n in zip(valores, es_num)], dtype=float)
+        texto = ~es_num & ~vacios
+        ancho_texto = int(col[texto].astype(str).str.len().max()) if texto.any() else 0
+
+    ancho_num = 0
+    negativos = np.signbit(numeros)
+    for signo in (~negativos, negativos):
+        sel = es_num & signo
+        if sel.any():
+            v = numeros[sel][np.argmax(np.abs(numeros[sel]))]
+            ancho_num = max(ancho_num, len(f"{v:,.2f}"))
+    return max(ancho_texto, ancho_num)
+
+
+def column_widths(
+    df: pd.DataFrame,
+    medida: Callable[[pd.Series], int] = text_width,
+    extra: int = 0,
+    minimo: int = 0,
+    maximo: Optional[int] = None,
+) -> List[int]:
+    """
+    Ancho por columna: min(max(minimo, len(cabecera), medida(columna)) + extra, maximo).
+    `medida` es text_width (texto tal cual) o eu_number_width (números "1,234.56").
+    """
+    anchos: List[int] = []
+    for c in df.columns:
+        w = max(minimo, len(str(c)), medida(df[c])) + extra
+        anchos.append(w if maximo is None else min(w, maximo))
+    return anchos
+
+
+def to_xlsx_bytes(hojas: List[tuple]) -> bytes:
+    """[(df, nombre_hoja, SheetStyle), ...] -> bytes del .xlsx"""
+    out = io.BytesIO()
+    wb = xlsxwriter.Workbook(out, {"constant_memory": True})
+    try:
+        for df, nombre, style in hojas:
+            write_sheet(wb, df, nombre, style)
+    finally:
+        wb.close()
+    return out.getvalue()